@@ -33,6 +33,11 @@ from typing import Dict, Optional
 import zstandard
 from tqdm import tqdm
 
+from pipeline.alignments.tokenization_cache import (
+    TokenizationCache,
+    get_tokenizer_version,
+    hash_file,
+)
 from pipeline.alignments.tokenizer import tokenize, TokenizerType
 from pipeline.common.datasets import decompress
 from pipeline.common.logging import get_logger
@@ -56,6 +61,7 @@ def run(
     output_tokenized: bool,
     priors_input_path: Optional[str],
     priors_output_path: Optional[str],
+    tokenization_cache_dir: Optional[str] = None,
 ) -> None:
     bin = os.environ["BIN"]
     src = os.environ["SRC"]
@@ -91,10 +97,9 @@ def run(
             tokenizer = TokenizerType.icu
         else:
             raise ValueError(f"Unrecognized tokenization type {tokenization}")
-        # C++ tokenizer can process 100k sentences per second on a single core,
-        # so the chunks to parallelize things should be large enough to increase throughput
-        tokenize(corpus_src, tokenized_src, src, sentences_per_chunk=500000, tokenizer=tokenizer)
-        tokenize(corpus_trg, tokenized_trg, trg, sentences_per_chunk=500000, tokenizer=tokenizer)
+        cache = TokenizationCache(tokenization_cache_dir) if tokenization_cache_dir else None
+        tokenize_with_cache(corpus_src, tokenized_src, src, tokenizer, cache)
+        tokenize_with_cache(corpus_trg, tokenized_trg, trg, tokenizer, cache)
 
     fwd_path, rev_path = align(
         corpus_src=tokenized_src,
@@ -143,6 +148,30 @@ def run(
     shutil.rmtree(tmp_dir)
 
 
+def tokenize_with_cache(
+    input_path: str,
+    output_path: str,
+    lang: str,
+    tokenizer: TokenizerType,
+    cache: Optional[TokenizationCache],
+) -> None:
+    """
+    Tokenize a corpus, re-using the tokenized output from the cache when the same corpus was
+    already tokenized with the same tokenizer and version.
+    """
+    input_digest = hash_file(input_path) if cache else ""
+    version = get_tokenizer_version(tokenizer.value)
+    if cache and cache.fetch(input_digest, tokenizer.value, lang, version, output_path):
+        return
+
+    # C++ tokenizer can process 100k sentences per second on a single core,
+    # so the chunks to parallelize things should be large enough to increase throughput
+    tokenize(input_path, output_path, lang, sentences_per_chunk=500000, tokenizer=tokenizer)
+
+    if cache:
+        cache.store(input_digest, tokenizer.value, lang, version, output_path)
+
+
 def maybe_decompress(file_path: str):
     if file_path.endswith(".zst"):
         return str(decompress(file_path, remove=True, logger=logger)), True
@@ -436,6 +465,15 @@ def main() -> None:
         help="Split corpus to chunks of N lines to calculate alignments on them separately. "
         "This helps with reducing the memory footprint. 100M by default.",
     )
+    parser.add_argument(
+        "--tokenization_cache_dir",
+        metavar="TOKENIZATION_CACHE_DIR",
+        type=str,
+        default=os.getenv("TOKENIZATION_CACHE_DIR"),
+        help="A directory to cache the tokenized corpora in. The tokenized corpus is re-used "
+        "when the same corpus is tokenized with the same tokenizer and version. "
+        "Defaults to the TOKENIZATION_CACHE_DIR environment variable.",
+    )
     args = parser.parse_args()
     logger.info("Starting generating alignments.")
 
@@ -456,6 +494,7 @@ def main() -> None:
         output_tokenized=args.output_tokenized,
         priors_input_path=priors_input_path,
         priors_output_path=args.priors_output_path,
+        tokenization_cache_dir=args.tokenization_cache_dir,
     )
     logger.info("Finished generating alignments.")
 
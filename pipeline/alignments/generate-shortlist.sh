@@ -36,23 +36,27 @@ corpus_trg="${corpus_prefix}.${TRG}.zst"
 
 
 echo "### Subword segmentation with SentencePiece"
-zstdmt -dc "${corpus_src}" |
-  parallel --no-notice --pipe -k -j "${threads}" --block 50M "${MARIAN}/spm_encode" --model "${vocab_src}" \
-   >"${dir}/corpus.spm.${SRC}"
-
-zstdmt -dc "${corpus_trg}" |
-  parallel --no-notice --pipe -k -j "${threads}" --block 50M "${MARIAN}/spm_encode" --model "${vocab_trg}" \
-   >"${dir}/corpus.spm.${TRG}"
-
+python3 spm_encode.py \
+  --corpus_src "${corpus_src}" \
+  --corpus_trg "${corpus_trg}" \
+  --vocab_src "${vocab_src}" \
+  --vocab_trg "${vocab_trg}" \
+  --output_dir "${dir}" \
+  --processes "${threads}"
+
+# The alignments need the uncompressed corpus, it is removed afterwards.
+zstdmt -dk "${dir}/corpus.spm.${SRC}.zst"
+zstdmt -dk "${dir}/corpus.spm.${TRG}.zst"
 python3 align.py \
   --corpus_src="${dir}/corpus.spm.${SRC}" \
   --corpus_trg="${dir}/corpus.spm.${TRG}" \
   --output_path="${output_dir}/corpus.aln"
+rm "${dir}/corpus.spm.${SRC}" "${dir}/corpus.spm.${TRG}"
 
 echo "### Creating shortlist"
 "${BIN}/extract_lex" \
-  "${dir}/corpus.spm.${TRG}" \
-  "${dir}/corpus.spm.${SRC}" \
+  <(zstdmt -dc "${dir}/corpus.spm.${TRG}.zst") \
+  <(zstdmt -dc "${dir}/corpus.spm.${SRC}.zst") \
   "${output_dir}/corpus.aln" \
   "${dir}/lex.s2t" \
   "${dir}/lex.t2s"
@@ -61,16 +65,23 @@ if [ -f "${dir}/lex.s2t" ]; then
   zstdmt "${dir}/lex.s2t"
 fi
 
-rm "${dir}/corpus.spm.${TRG}"
-rm "${dir}/corpus.spm.${SRC}"
+rm "${dir}/corpus.spm.${TRG}.zst"
+rm "${dir}/corpus.spm.${SRC}.zst"
 rm "${output_dir}/corpus.aln"
 
 echo "### Shortlist pruning"
 "${MARIAN}/spm_export_vocab" --model="${vocab_trg}" --output="${dir}/vocab.txt"
-zstdmt -dc "${dir}/lex.s2t.zst" |
-  grep -v NULL |
-  python3 "prune_shortlist.py" 100 "${dir}/vocab.txt" |
-  zstdmt >"${output_dir}/lex.s2t.pruned.zst"
+python3 "prune_shortlist.py" 100 "${dir}/vocab.txt" \
+  --input "${dir}/lex.s2t.zst" \
+  --output "${output_dir}/lex.s2t.pruned.zst"
+
+echo "### Converting the shortlist to the binary format"
+"${MARIAN}/spm_export_vocab" --model="${vocab_src}" --output="${dir}/vocab.src.txt"
+python3 "lexical_shortlist.py" \
+  --input "${output_dir}/lex.s2t.pruned.zst" \
+  --vocab_src "${dir}/vocab.src.txt" \
+  --vocab_trg "${dir}/vocab.txt" \
+  --output "${output_dir}/lex.s2t.pruned.csr"
 
 echo "### Deleting tmp dir"
 rm -rf "${dir}"
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Converts a pruned lexical shortlist into a compact, memory-mappable binary format.
+
+The text shortlist (lex.s2t.pruned.zst) has one "trg src prob" line per candidate, and needs to
+be parsed every time it is loaded. The binary format stores the candidates as compressed sparse
+rows (CSR) indexed by the source vocab id, so that the candidates of a source token can be looked
+up directly from a memory-mapped file.
+
+Note that this format is for Python tooling. Marian still consumes the text shortlist, or its
+own binary shortlist produced by `marian-conv --shortlist`.
+
+Layout (little endian):
+
+    header     magic "LEXCSR", version u16, src_vocab_size u32, trg_vocab_size u32, nnz u64
+    offsets    u64[src_vocab_size + 1]  The candidates of src id i are offsets[i]..offsets[i+1]
+    trg_ids    u32[nnz]                 The target vocab ids of the candidates
+    probs      f32[nnz]                 The probabilities of the candidates
+
+Example:
+    python pipeline/alignments/lexical_shortlist.py \\
+        --input lex.s2t.pruned.zst \\
+        --vocab_src vocab.src.txt \\
+        --vocab_trg vocab.trg.txt \\
+        --output lex.s2t.pruned.csr
+
+The vocabs are the text exports of the SentencePiece models from `spm_export_vocab`, where the
+line number is the vocab id.
+"""
+
+import argparse
+import struct
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, TextIO, Union
+
+import numpy as np
+import numpy.typing as npt
+
+from pipeline.common.downloads import read_lines
+from pipeline.common.logging import get_logger
+
+logger = get_logger(__file__)
+
+MAGIC = b"LEXCSR"
+VERSION = 1
+HEADER = struct.Struct("<6sHIIQ")
+# Pad the header so that the arrays are aligned.
+HEADER_BYTES = 64
+
+
+def load_vocab(vocab_path: Union[str, Path]) -> list[str]:
+    """
+    Load a vocab exported by `spm_export_vocab`, which has a "piece\\tscore" per line.
+    """
+    with read_lines(vocab_path) as lines:
+        return [line.rstrip("\n").split("\t")[0] for line in lines]
+
+
+class LexicalShortlist:
+    """
+    A memory-mapped reader of the binary lexical shortlist.
+
+    Usage:
+
+        shortlist = LexicalShortlist("lex.s2t.pruned.csr")
+        trg_ids, probs = shortlist.candidates(src_id)
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        with open(self.path, "rb") as file:
+            header = file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"The binary shortlist is truncated: {self.path}")
+        magic, version, src_vocab_size, trg_vocab_size, nnz = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError(f"The file is not a binary lexical shortlist: {self.path}")
+        if version != VERSION:
+            raise ValueError(f"Unsupported binary shortlist version {version}: {self.path}")
+
+        self.src_vocab_size: int = src_vocab_size
+        self.trg_vocab_size: int = trg_vocab_size
+        self.nnz: int = nnz
+
+        offsets_start = HEADER_BYTES
+        trg_ids_start = offsets_start + 8 * (src_vocab_size + 1)
+        probs_start = trg_ids_start + 4 * nnz
+
+        self.offsets = np.memmap(
+            self.path, dtype="<u8", mode="r", offset=offsets_start, shape=(src_vocab_size + 1,)
+        )
+        # memmap doesn't support empty arrays.
+        if nnz:
+            self.trg_ids = np.memmap(
+                self.path, dtype="<u4", mode="r", offset=trg_ids_start, shape=(nnz,)
+            )
+            self.probs = np.memmap(
+                self.path, dtype="<f4", mode="r", offset=probs_start, shape=(nnz,)
+            )
+        else:
+            self.trg_ids = np.empty(0, dtype="<u4")
+            self.probs = np.empty(0, dtype="<f4")
+
+    def __len__(self) -> int:
+        return self.nnz
+
+    def candidates(self, src_id: int) -> tuple[npt.NDArray[np.uint32], npt.NDArray[np.float32]]:
+        """
+        Get the target ids and probabilities for a source id, in the order of the text shortlist.
+        """
+        start = int(self.offsets[src_id])
+        end = int(self.offsets[src_id + 1])
+        return self.trg_ids[start:end], self.probs[start:end]
+
+    def entries(self) -> Iterator[tuple[int, int, float]]:
+        """
+        Iterate over the (src_id, trg_id, prob) of every candidate.
+        """
+        counts = np.diff(self.offsets.astype(np.int64))
+        src_ids = np.repeat(np.arange(self.src_vocab_size), counts)
+        yield from zip(src_ids.tolist(), self.trg_ids.tolist(), self.probs.tolist())
+
+    def write_text(self, src_vocab: list[str], trg_vocab: list[str], output: TextIO) -> None:
+        """
+        Write the shortlist back out in the text format, with lines grouped by the source id.
+        """
+        for src_id, trg_id, prob in self.entries():
+            output.write(f"{trg_vocab[trg_id]} {src_vocab[src_id]} {prob:.8f}\n")
+
+    def describe(self) -> dict[str, float]:
+        counts = np.diff(self.offsets.astype(np.int64))
+        src_with_candidates = int(np.count_nonzero(counts))
+        return {
+            "src_vocab_size": self.src_vocab_size,
+            "trg_vocab_size": self.trg_vocab_size,
+            "candidates": self.nnz,
+            "src_with_candidates": src_with_candidates,
+            "max_candidates": int(counts.max()) if len(counts) else 0,
+            "mean_candidates": (self.nnz / src_with_candidates) if src_with_candidates else 0.0,
+        }
+
+
+def write_binary_shortlist(
+    lines: Iterable[str],
+    src_vocab: list[str],
+    trg_vocab: list[str],
+    output_path: Union[str, Path],
+) -> int:
+    """
+    Convert the text shortlist lines into the binary format. Returns the number of lines that
+    were skipped because the tokens were not in the vocabs.
+    """
+    src_ids_lookup = {piece: i for i, piece in enumerate(src_vocab)}
+    trg_ids_lookup = {piece: i for i, piece in enumerate(trg_vocab)}
+
+    src_ids: list[int] = []
+    trg_ids: list[int] = []
+    probs: list[float] = []
+    skipped = 0
+    for line in lines:
+        fields = line.split()
+        if len(fields) != 3:
+            skipped += 1
+            continue
+        trg, src, prob = fields
+        src_id = src_ids_lookup.get(src)
+        trg_id = trg_ids_lookup.get(trg)
+        if src_id is None or trg_id is None:
+            skipped += 1
+            continue
+        src_ids.append(src_id)
+        trg_ids.append(trg_id)
+        probs.append(float(prob))
+
+    src_array = np.array(src_ids, dtype=np.int64)
+    # A stable sort retains the order of the candidates within a source token.
+    order = np.argsort(src_array, kind="stable")
+    offsets = np.zeros(len(src_vocab) + 1, dtype="<u8")
+    offsets[1:] = np.cumsum(np.bincount(src_array, minlength=len(src_vocab)))
+
+    with open(output_path, "wb") as file:
+        header = HEADER.pack(MAGIC, VERSION, len(src_vocab), len(trg_vocab), len(src_ids))
+        file.write(header.ljust(HEADER_BYTES, b"\0"))
+        file.write(offsets.tobytes())
+        file.write(np.array(trg_ids, dtype="<u4")[order].tobytes())
+        file.write(np.array(probs, dtype="<f4")[order].tobytes())
+
+    return skipped
+
+
+def main(args: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--input", type=str, required=True, help="The text shortlist, e.g. lex.s2t.pruned.zst"
+    )
+    parser.add_argument(
+        "--vocab_src", type=str, required=True, help="The exported source vocab text file."
+    )
+    parser.add_argument(
+        "--vocab_trg", type=str, required=True, help="The exported target vocab text file."
+    )
+    parser.add_argument(
+        "--output", type=str, required=True, help="The binary shortlist, e.g. lex.s2t.pruned.csr"
+    )
+    parsed_args = parser.parse_args(args)
+
+    src_vocab = load_vocab(parsed_args.vocab_src)
+    trg_vocab = load_vocab(parsed_args.vocab_trg)
+
+    logger.info(f"Converting {parsed_args.input} to {parsed_args.output}")
+    with read_lines(parsed_args.input) as lines:
+        skipped = write_binary_shortlist(lines, src_vocab, trg_vocab, parsed_args.output)
+    if skipped:
+        logger.warning(f"Skipped {skipped:,} lines that were malformed or not in the vocabs")
+
+    shortlist = LexicalShortlist(parsed_args.output)
+    for key, value in shortlist.describe().items():
+        logger.info(f" > {key}: {value:,}")
+
+
+if __name__ == "__main__":
+    main()
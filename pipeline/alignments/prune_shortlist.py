@@ -1,51 +1,329 @@
 #!/usr/bin/env python3
-# -*- coding: utf-8 -*-
+"""
+Prunes a lexical shortlist produced by extract_lex to the top candidates for each source word.
 
+The lexical table contains "trg src prob" triples. For each source word, the MAX most probable
+target words are kept, as well as any of the top MAX + 2 target words from the vocabulary.
+
+The table is streamed in chunks. Words are interned into integer ids and only the bounded top-k
+candidates for each source word are retained in NumPy arrays between chunks, so the memory
+usage is proportional to the size of the vocabulary rather than the size of the table.
+
+Example:
+    python pipeline/alignments/prune_shortlist.py 100 vocab.txt \\
+        --input lex.s2t.zst --output lex.s2t.pruned.zst
+
+    zstdmt -dc lex.s2t.zst | python pipeline/alignments/prune_shortlist.py 100 vocab.txt
+"""
+
+import argparse
 import sys
+from contextlib import ExitStack
+from itertools import islice
+from typing import Iterable, Optional, TextIO
+
+import numpy as np
+import numpy.typing as npt
+
+from pipeline.common.downloads import read_lines, write_lines
+from pipeline.common.logging import get_logger
+
+logger = get_logger(__file__)
+
+# How many lines of the lexical table to parse before merging them into the top-k candidates.
+CHUNK_LINES = 1_000_000
+
+# Marks the end of each line in the tokens of a chunk. It isn't whitespace, so str.split() keeps
+# it as a token of its own.
+LINE_END_TOKEN = "\x00"
+
+
+def split_lines(lines: list[str]) -> tuple[list[str], npt.NDArray[np.int64]]:
+    """
+    Split all of the lines of a chunk at once, with a LINE_END_TOKEN after the tokens of each
+    line. Returns the tokens, and the index of the LINE_END_TOKEN of each line.
+    """
+    text = "".join(lines)
+    if not text.endswith("\n"):
+        text += "\n"
+    if LINE_END_TOKEN not in text and text.count("\n") == len(lines):
+        tokens = text.replace("\n", f" {LINE_END_TOKEN} ").split()
+        if len(tokens) == 4 * len(lines) and tokens[3::4].count(LINE_END_TOKEN) == len(lines):
+            # Every line has 3 tokens, which is the case of almost all of the chunks.
+            return tokens, np.arange(3, len(tokens), 4)
+        is_line_end = np.fromiter(
+            map(LINE_END_TOKEN.__eq__, tokens), dtype=bool, count=len(tokens)
+        )
+        return tokens, np.flatnonzero(is_line_end)
+
+    # The line ends can't be told apart from the tokens, split the lines one by one.
+    split = [line.split() for line in lines]
+    tokens = [token for line_tokens in split for token in (*line_tokens, LINE_END_TOKEN)]
+    tokens_per_line = np.fromiter(map(len, split), dtype=np.int64, count=len(lines))
+    return tokens, np.cumsum(tokens_per_line + 1) - 1
+
+
+class Candidates:
+    """
+    Columnar storage of (src, trg, prob, seq) candidates. The "seq" is the line number where the
+    pair was first seen, and is used to break ties in the same way as a stable sort would.
+    """
+
+    def __init__(
+        self,
+        src: npt.NDArray[np.int32],
+        trg: npt.NDArray[np.int32],
+        prob: npt.NDArray[np.float64],
+        seq: npt.NDArray[np.int64],
+    ) -> None:
+        self.src = src
+        self.trg = trg
+        self.prob = prob
+        self.seq = seq
+
+    @staticmethod
+    def empty() -> "Candidates":
+        return Candidates(
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=np.int64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.src)
+
+    def concat(self, other: "Candidates") -> "Candidates":
+        return Candidates(
+            np.concatenate((self.src, other.src)),
+            np.concatenate((self.trg, other.trg)),
+            np.concatenate((self.prob, other.prob)),
+            np.concatenate((self.seq, other.seq)),
+        )
+
+    def take(self, indexes: npt.NDArray) -> "Candidates":
+        return Candidates(
+            self.src[indexes], self.trg[indexes], self.prob[indexes], self.seq[indexes]
+        )
+
+    def deduplicate(self) -> "Candidates":
+        """
+        A (src, trg) pair that is seen more than once keeps the probability that was seen last,
+        but keeps the position of when it was first seen, mirroring a dict assignment. extract_lex
+        writes each pair once, so this only guards against a malformed table. Only the retained
+        candidates can be deduplicated, as pruned pairs are not kept around.
+        """
+        if len(self) == 0:
+            return self
+        ordered = self.take(np.lexsort((self.seq, self.trg, self.src)))
+        is_start = np.ones(len(ordered), dtype=bool)
+        is_start[1:] = (ordered.src[1:] != ordered.src[:-1]) | (
+            ordered.trg[1:] != ordered.trg[:-1]
+        )
+        starts = np.flatnonzero(is_start)
+        ends = np.append(starts[1:], len(ordered)) - 1
+        return Candidates(
+            ordered.src[starts], ordered.trg[starts], ordered.prob[ends], ordered.seq[starts]
+        )
+
+    def top_k(self, k: int) -> "Candidates":
+        """
+        Keep the k most probable candidates for each source word. The result is sorted by the
+        source id, then by the descending probability.
+        """
+        if len(self) == 0:
+            return self
+        ordered = self.take(np.lexsort((self.seq, -self.prob, self.src)))
+        is_start = np.ones(len(ordered), dtype=bool)
+        is_start[1:] = ordered.src[1:] != ordered.src[:-1]
+        positions = np.arange(len(ordered))
+        group_start = np.maximum.accumulate(np.where(is_start, positions, 0))
+        return ordered.take(positions - group_start < k)
+
+
+class ShortlistPruner:
+    """
+    Incrementally consumes the lexical table and retains the bounded set of candidates.
+    """
+
+    def __init__(self, max_candidates: int, top_words: list[str]) -> None:
+        self.max_candidates = max_candidates
+
+        # Intern the words into ids. The source ids are assigned in the order they are first seen,
+        # which is the order the pruned shortlist is written out in.
+        self.src_ids: dict[str, int] = {}
+        self.trg_ids: dict[str, int] = {}
+
+        # The top words of the vocabulary are always kept when they are in the table. They are
+        # written out in the order of the vocabulary.
+        self.top_word_rank: dict[str, int] = {}
+        for rank, word in enumerate(top_words):
+            self.top_word_rank.setdefault(word, rank)
+        # Maps the trg id to its rank in the top words, or -1.
+        self.trg_top_rank = np.empty(0, dtype=np.int32)
+
+        self.kept = Candidates.empty()
+        self.kept_top_words = Candidates.empty()
+        self.lines_seen = 0
+        self.lines_skipped = 0
+
+    def add_lines(self, lines: list[str]) -> None:
+        # Split the whole chunk at once rather than line by line, as allocating a list per line
+        # dominates the run time on large tables.
+        tokens, line_ends = split_lines(lines)
+        line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+        # some lines include empty items for zh-en, 63 from ~400k
+        is_valid = line_ends - line_starts == 3
+        if is_valid.all():
+            trg_words, src_words, probs = tokens[0::4], tokens[1::4], tokens[2::4]
+        else:
+            valid_starts = line_starts[is_valid].tolist()
+            trg_words = [tokens[i] for i in valid_starts]
+            src_words = [tokens[i + 1] for i in valid_starts]
+            probs = [tokens[i + 2] for i in valid_starts]
+
+        # Intern the words, new words get the next id as setdefault evaluates len() first.
+        src_ids = self.src_ids
+        trg_ids = self.trg_ids
+        trg_count = len(trg_ids)
+        src = np.array([src_ids.setdefault(word, len(src_ids)) for word in src_words], np.int32)
+        trg = np.array([trg_ids.setdefault(word, len(trg_ids)) for word in trg_words], np.int32)
+        prob = np.array(probs, dtype=np.float64)
+
+        is_kept = np.ones(len(src), dtype=bool)
+        if "NULL" in src_ids:
+            is_kept &= src != src_ids["NULL"]
+        if "NULL" in trg_ids:
+            is_kept &= trg != trg_ids["NULL"]
+        src, trg, prob = src[is_kept], trg[is_kept], prob[is_kept]
+
+        chunk = Candidates(
+            src, trg, prob, np.arange(self.lines_seen, self.lines_seen + len(src), dtype=np.int64)
+        )
+        self.lines_seen += len(chunk)
+        self.lines_skipped += len(lines) - len(chunk)
+
+        new_trg_words = list(trg_ids)[trg_count:]
+        self.trg_top_rank = np.concatenate(
+            (
+                self.trg_top_rank,
+                np.array(
+                    [self.top_word_rank.get(word, -1) for word in new_trg_words], dtype=np.int32
+                ),
+            )
+        )
+
+        self.kept = self.kept.concat(chunk).deduplicate().top_k(self.max_candidates)
+
+        top_words = chunk.take(self.trg_top_rank[chunk.trg] >= 0)
+        self.kept_top_words = self.kept_top_words.concat(top_words).deduplicate()
+
+    def add_stream(self, lines: Iterable[str], chunk_lines: int = CHUNK_LINES) -> None:
+        lines = iter(lines)
+        while chunk := list(islice(lines, chunk_lines)):
+            self.add_lines(chunk)
+
+    def pruned(self) -> tuple[list[str], list[str], list[float]]:
+        """
+        Returns the (trg, src, prob) columns of the pruned shortlist. For each source word, the top
+        candidates are listed by descending probability, followed by the top words of the
+        vocabulary.
+        """
+        top_words = self.kept_top_words
+        src = np.concatenate((self.kept.src, top_words.src))
+        trg = np.concatenate((self.kept.trg, top_words.trg))
+        prob = np.concatenate((self.kept.prob, top_words.prob))
+        is_top_word = np.concatenate(
+            (np.zeros(len(self.kept), dtype=np.int8), np.ones(len(top_words), dtype=np.int8))
+        )
+        # The kept candidates are already in the order of descending probability.
+        within = np.concatenate(
+            (np.arange(len(self.kept), dtype=np.int64), self.trg_top_rank[top_words.trg])
+        )
+        order = np.lexsort((within, is_top_word, src))
+
+        src_words = list(self.src_ids)
+        trg_words = list(self.trg_ids)
+        return (
+            list(map(trg_words.__getitem__, trg[order].tolist())),
+            list(map(src_words.__getitem__, src[order].tolist())),
+            prob[order].tolist(),
+        )
 
-MAX = int(sys.argv[1])
-TOP = sys.argv[2]
 
-tops = []
+def load_top_words(vocab_path: str, max_candidates: int) -> list[str]:
+    top_words = []
+    with open(vocab_path, "r") as f:
+        for line in f:
+            top_words.append(line.strip().split()[0])
+            if len(top_words) == max_candidates + 2:
+                break
+    return top_words
 
-with open(TOP, "r") as f:
-    for line in f:
-        tops.append(line.strip().split()[0])
 
-tops = tops[: MAX + 2]
+def prune(
+    max_candidates: int,
+    vocab_path: str,
+    lines: Iterable[str],
+    output: TextIO,
+    chunk_lines: int = CHUNK_LINES,
+) -> ShortlistPruner:
+    pruner = ShortlistPruner(max_candidates, load_top_words(vocab_path, max_candidates))
+    pruner.add_stream(lines, chunk_lines)
+    output.writelines(map("{} {} {:.8f}\n".format, *pruner.pruned()))
 
-vocabTrg = []
-vocabSrc = []
-pairs = {}
+    logger.info(
+        f"Pruned {pruner.lines_seen:,} lexical pairs for {len(pruner.src_ids):,} source words "
+        f"({pruner.lines_skipped:,} lines skipped)"
+    )
+    return pruner
 
-for line in sys.stdin:
-    try:
-        trg, src, prob = line.strip().split()
-    # some lines include empty items for zh-en, 63 from ~400k
-    except ValueError:
-        continue
 
-    if trg == "NULL" or src == "NULL":
-        continue
+def main(args: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "max_candidates",
+        metavar="MAX",
+        type=int,
+        help="The number of most probable target words to keep for each source word.",
+    )
+    parser.add_argument(
+        "vocab",
+        metavar="VOCAB",
+        type=str,
+        help="The exported target vocab, the first MAX + 2 words are always kept.",
+    )
+    parser.add_argument(
+        "--input",
+        type=str,
+        default=None,
+        help="The lexical table, e.g. lex.s2t.zst. Defaults to stdin.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="The pruned lexical table, e.g. lex.s2t.pruned.zst. Defaults to stdout.",
+    )
+    parsed_args = parser.parse_args(args)
 
-    # sys.stderr.write("{} {} {} \n".format(trg, src, prob))
+    with ExitStack() as stack:
+        if parsed_args.input:
+            lines = stack.enter_context(read_lines(parsed_args.input))
+        else:
+            lines = sys.stdin
 
-    vocabTrg.append(trg)
-    vocabSrc.append(src)
+        if parsed_args.output:
+            output = stack.enter_context(write_lines(parsed_args.output))
+        else:
+            output = sys.stdout
 
-    prob = float(prob)
-    if src in pairs:
-        pairs[src][trg] = prob
-    else:
-        pairs[src] = {trg: prob}
+        prune(parsed_args.max_candidates, parsed_args.vocab, lines, output)
 
-vocabTrg = set(vocabTrg)
-vocabSrc = set(vocabSrc)
 
-for src in vocabSrc:
-    d = pairs[src]
-    topSrc = list(sorted(d, key=d.get, reverse=True)[:MAX])
-    for trg in topSrc + tops:
-        if trg in d:
-            prob = d[trg]
-            print("{} {} {:.8f}".format(trg, src, prob))
+if __name__ == "__main__":
+    main()
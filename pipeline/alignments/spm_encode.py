@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Encodes a parallel corpus into SentencePiece pieces for the shortlist generation.
+
+The corpus is read in chunks which are encoded by a pool of processes with the `sentencepiece`
+module, and the pieces are written straight to zstd in the original order. The throughput of the
+reading, encoding and writing stages is reported so that the bottleneck can be identified.
+
+Example:
+    SRC=ru TRG=en python pipeline/alignments/spm_encode.py \\
+        --corpus_src fetches/corpus.ru.zst \\
+        --corpus_trg fetches/corpus.en.zst \\
+        --vocab_src fetches/vocab.ru.spm \\
+        --vocab_trg fetches/vocab.en.spm \\
+        --output_dir artifacts/tmp_shortlist \\
+        --processes 32
+
+Outputs:
+    artifacts/tmp_shortlist/corpus.spm.ru.zst
+    artifacts/tmp_shortlist/corpus.spm.en.zst
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+from collections import deque
+from contextlib import ExitStack
+from dataclasses import dataclass
+from itertools import islice
+from pathlib import Path
+from typing import Optional, Union
+
+import sentencepiece as spm
+
+from pipeline.alignments.tokenization_cache import TokenizationCache, hash_file
+from pipeline.common.downloads import read_lines, write_lines
+from pipeline.common.logging import get_logger
+
+logger = get_logger(__file__)
+
+# How many lines are sent to a worker process at a time.
+CHUNK_LINES = 20_000
+
+# The SentencePiece processor of the worker process.
+_processor: Optional[spm.SentencePieceProcessor] = None
+
+
+def _init_worker(model_path: str) -> None:
+    global _processor
+    _processor = spm.SentencePieceProcessor(model_file=model_path)
+
+
+def _encode_chunk(lines: list[str]) -> tuple[str, float]:
+    """
+    Encode a chunk of lines in a worker process. Returns the encoded text and the time it took.
+    """
+    assert _processor, "The worker was not initialized"
+    start = time.perf_counter()
+    pieces = _processor.encode([line.rstrip("\n") for line in lines], out_type=str)
+    text = "".join([" ".join(line_pieces) + "\n" for line_pieces in pieces])
+    return text, time.perf_counter() - start
+
+
+@dataclass
+class EncodeStats:
+    """
+    The timing of each stage of the encoding. The encode time is the sum of the time spent in
+    each worker, while the other stages run on the main process.
+    """
+
+    lines: int = 0
+    input_bytes: int = 0
+    output_bytes: int = 0
+    read_seconds: float = 0.0
+    encode_seconds: float = 0.0
+    write_seconds: float = 0.0
+    wall_seconds: float = 0.0
+    processes: int = 1
+
+    def log(self, name: str) -> None:
+        def throughput(lines: int, bytes_: int, seconds: float) -> str:
+            seconds = max(seconds, 1e-9)
+            return f"{lines / seconds:,.0f} lines/s, {bytes_ / seconds / 1_000_000:,.1f} MB/s"
+
+        logger.info(f"Encoded {self.lines:,} lines of {name} in {self.wall_seconds:.1f}s")
+        logger.info(
+            f" > read:   {throughput(self.lines, self.input_bytes, self.read_seconds)} "
+            f"({self.read_seconds:.1f}s)"
+        )
+        logger.info(
+            f" > encode: {throughput(self.lines, self.input_bytes, self.encode_seconds)} "
+            f"per process ({self.encode_seconds:.1f}s over {self.processes} processes)"
+        )
+        logger.info(
+            f" > write:  {throughput(self.lines, self.output_bytes, self.write_seconds)} "
+            f"({self.write_seconds:.1f}s)"
+        )
+        logger.info(
+            f" > total:  {throughput(self.lines, self.input_bytes, self.wall_seconds)} "
+            f"({self.wall_seconds:.1f}s)"
+        )
+
+
+def encode_corpus(
+    input_path: Union[str, Path],
+    output_path: Union[str, Path],
+    model_path: Union[str, Path],
+    processes: int,
+    chunk_lines: int = CHUNK_LINES,
+) -> EncodeStats:
+    """
+    Encode a corpus with a pool of processes, and return the timing of its stages.
+    """
+    stats = EncodeStats(processes=processes)
+    wall_start = time.perf_counter()
+
+    with ExitStack() as stack:
+        lines = iter(stack.enter_context(read_lines(input_path)))
+        output = stack.enter_context(write_lines(output_path))
+        pool = stack.enter_context(
+            multiprocessing.Pool(processes, initializer=_init_worker, initargs=(str(model_path),))
+        )
+
+        def write_result(result: tuple[str, float]) -> None:
+            text, encode_seconds = result
+            stats.encode_seconds += encode_seconds
+            start = time.perf_counter()
+            stats.output_bytes += len(text.encode("utf-8"))
+            output.write(text)
+            stats.write_seconds += time.perf_counter() - start
+
+        # Bound the number of chunks in flight so that a slow writer doesn't buffer the corpus.
+        pending = deque()
+        while True:
+            start = time.perf_counter()
+            chunk = list(islice(lines, chunk_lines))
+            stats.read_seconds += time.perf_counter() - start
+            if not chunk:
+                break
+            stats.lines += len(chunk)
+            stats.input_bytes += sum(map(len, chunk))
+            pending.append(pool.apply_async(_encode_chunk, (chunk,)))
+
+            if len(pending) >= processes * 2:
+                write_result(pending.popleft().get())
+
+        while pending:
+            write_result(pending.popleft().get())
+
+    stats.wall_seconds = time.perf_counter() - wall_start
+    return stats
+
+
+def encode_with_cache(
+    input_path: Union[str, Path],
+    output_path: Union[str, Path],
+    model_path: Union[str, Path],
+    lang: str,
+    processes: int,
+    cache: Optional[TokenizationCache],
+    chunk_lines: int = CHUNK_LINES,
+) -> None:
+    """
+    Encode a corpus, re-using the encoded output from the tokenization cache when the same corpus
+    was already encoded with the same SentencePiece model.
+    """
+    input_digest = hash_file(input_path) if cache else ""
+    # SentencePiece models aren't versioned by a package, so the model itself is the version.
+    version = f"spm-{hash_file(model_path)}" if cache else ""
+    if cache and cache.fetch(input_digest, "spm", lang, version, output_path):
+        return
+
+    stats = encode_corpus(input_path, output_path, model_path, processes, chunk_lines)
+    stats.log(f"{lang} with {Path(model_path).name}")
+
+    if cache:
+        cache.store(input_digest, "spm", lang, version, output_path)
+
+
+def main(args: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("--corpus_src", type=str, required=True, help="The source corpus.")
+    parser.add_argument("--corpus_trg", type=str, required=True, help="The target corpus.")
+    parser.add_argument(
+        "--vocab_src", type=str, required=True, help="The source SentencePiece model."
+    )
+    parser.add_argument(
+        "--vocab_trg", type=str, required=True, help="The target SentencePiece model."
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=True,
+        help="The directory for the encoded corpus, corpus.spm.{lang}.zst",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="The number of processes used to encode the corpus.",
+    )
+    parser.add_argument(
+        "--chunk_lines",
+        type=int,
+        default=CHUNK_LINES,
+        help="The number of lines sent to a process at a time.",
+    )
+    parser.add_argument(
+        "--tokenization_cache_dir",
+        type=str,
+        default=os.environ.get("TOKENIZATION_CACHE_DIR"),
+        help="A directory to cache the encoded corpus in, so that it can be re-used "
+        "when the same corpus is encoded again. Defaults to $TOKENIZATION_CACHE_DIR.",
+    )
+    parsed_args = parser.parse_args(args)
+
+    src = os.environ["SRC"]
+    trg = os.environ["TRG"]
+    output_dir = Path(parsed_args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    cache = (
+        TokenizationCache(parsed_args.tokenization_cache_dir)
+        if parsed_args.tokenization_cache_dir
+        else None
+    )
+
+    for lang, corpus, vocab in (
+        (src, parsed_args.corpus_src, parsed_args.vocab_src),
+        (trg, parsed_args.corpus_trg, parsed_args.vocab_trg),
+    ):
+        output_path = output_dir / f"corpus.spm.{lang}.zst"
+        logger.info(f"Encoding {corpus} to {output_path}")
+        encode_with_cache(
+            corpus,
+            output_path,
+            vocab,
+            lang,
+            parsed_args.processes,
+            cache,
+            parsed_args.chunk_lines,
+        )
+
+
+if __name__ == "__main__":
+    main()
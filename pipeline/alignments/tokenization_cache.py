@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+A content-addressed cache of tokenized corpora.
+
+The same corpus can be tokenized several times by the alignment and shortlist steps. This
+cache stores the compressed tokenized output keyed by the digest of the input file, the
+tokenizer type, the language and the tokenizer version, so that later steps can reuse it
+rather than recomputing it.
+
+cache_dir
+├── 3f1c5a...e9.json
+├── 3f1c5a...e9.tok.zst
+├── 8ab02d...17.json
+└── 8ab02d...17.tok.zst
+
+Each entry has its own metadata file, named after the cache key, so that the tasks sharing
+a cache directory never write to the same file:
+
+    {
+      "input_digest": "6d3e...",
+      "tokenizer": "icu",
+      "lang": "en",
+      "version": "PyICU-2.15.2",
+      "lines": 1000000,
+      "file": "3f1c5a...e9.tok.zst"
+    }
+
+The metadata file is written after the tokenized file, so an entry is only visible once it is
+complete.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from dataclasses import asdict, dataclass
+from importlib import metadata
+from pathlib import Path
+from typing import Optional, Union
+
+from zstandard import ZstdCompressor, ZstdDecompressor
+
+from pipeline.common.logging import get_logger
+
+logger = get_logger(__file__)
+
+# Bump this to invalidate all of the existing cache entries, for instance when the
+# tokenization output changes in a way that the package versions don't capture.
+CACHE_FORMAT_VERSION = 1
+
+# The packages that provide the tokenizers, which are used to version the cache entries.
+TOKENIZER_PACKAGES = {
+    "fast_moses": "opus-fast-mosestokenizer",
+    "sacre_moses": "sacremoses",
+    "icu": "PyICU",
+}
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def hash_file(path: Union[str, Path]) -> str:
+    """
+    Compute the digest of the file contents. The file is streamed so that large corpora don't
+    need to be loaded into memory.
+    """
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_tokenizer_version(tokenizer: str) -> str:
+    """
+    Get the version of the package backing a tokenizer, for instance "PyICU-2.15.2". Tokenizers
+    that aren't backed by a known package, like SentencePiece models, must provide their own
+    version, e.g. the digest of the model file.
+    """
+    package = TOKENIZER_PACKAGES.get(tokenizer)
+    if not package:
+        raise ValueError(f"Unknown tokenizer version for: {tokenizer}")
+    try:
+        return f"{package}-{metadata.version(package)}"
+    except metadata.PackageNotFoundError:
+        return f"{package}-unknown"
+
+
+@dataclass
+class CacheEntry:
+    input_digest: str
+    tokenizer: str
+    lang: str
+    version: str
+    lines: int
+    file: str
+
+
+class TokenizationCache:
+    """
+    Store and retrieve tokenized corpora from a directory on disk.
+
+    Usage:
+
+        cache = TokenizationCache("/path/to/cache")
+        digest = hash_file("corpus.en")
+        if not cache.fetch(digest, "icu", "en", version, "corpus.tok-icu.en"):
+            tokenize("corpus.en", "corpus.tok-icu.en", ...)
+            cache.store(digest, "icu", "en", version, "corpus.tok-icu.en")
+    """
+
+    def __init__(self, cache_dir: Union[str, Path]) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(input_digest: str, tokenizer: str, lang: str, version: str) -> str:
+        key = "\t".join([str(CACHE_FORMAT_VERSION), input_digest, tokenizer, lang, version])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def entries(self) -> list[CacheEntry]:
+        """All of the entries of the cache."""
+        entries = []
+        for metadata_path in sorted(self.cache_dir.glob("*.json")):
+            with open(metadata_path, "r", encoding="utf-8") as file:
+                entries.append(CacheEntry(**json.load(file)))
+        return entries
+
+    def get(
+        self, input_digest: str, tokenizer: str, lang: str, version: str
+    ) -> Optional[CacheEntry]:
+        """
+        Look up an entry, making sure the tokenized file is still on disk.
+        """
+        key = TokenizationCache.get_key(input_digest, tokenizer, lang, version)
+        metadata_path = self.cache_dir / f"{key}.json"
+        if not metadata_path.exists():
+            return None
+        with open(metadata_path, "r", encoding="utf-8") as file:
+            entry = CacheEntry(**json.load(file))
+        if not (self.cache_dir / entry.file).exists():
+            logger.warning(f"The tokenization cache entry was missing its file: {entry.file}")
+            return None
+        return entry
+
+    def fetch(
+        self,
+        input_digest: str,
+        tokenizer: str,
+        lang: str,
+        version: str,
+        output_path: Union[str, Path],
+    ) -> bool:
+        """
+        Decompress a cached tokenized file to the output path, or copy it as is when the output
+        path is a .zst file. Returns False when there is no entry for this key.
+        """
+        entry = self.get(input_digest, tokenizer, lang, version)
+        if not entry:
+            self.misses += 1
+            logger.info(f"Tokenization cache miss: {tokenizer} {lang} {input_digest[:12]}")
+            return False
+
+        self.hits += 1
+        logger.info(f"Tokenization cache hit: {tokenizer} {lang} {input_digest[:12]}")
+        if str(output_path).endswith(".zst"):
+            shutil.copyfile(self.cache_dir / entry.file, output_path)
+            return True
+        with open(self.cache_dir / entry.file, "rb") as infile, open(output_path, "wb") as outfile:
+            ZstdDecompressor().copy_stream(infile, outfile)
+        return True
+
+    def store(
+        self,
+        input_digest: str,
+        tokenizer: str,
+        lang: str,
+        version: str,
+        tokenized_path: Union[str, Path],
+    ) -> CacheEntry:
+        """
+        Add a tokenized file to the cache. If the file is already compressed with zstd it is
+        copied as is, otherwise it is compressed.
+        """
+        key = TokenizationCache.get_key(input_digest, tokenizer, lang, version)
+        file_name = f"{key}.tok.zst"
+        destination = self.cache_dir / file_name
+        tmp_destination = self.cache_dir / f"{file_name}.{os.getpid()}.tmp"
+
+        tokenized_path = Path(tokenized_path)
+        lines = 0
+        if tokenized_path.suffix == ".zst":
+            shutil.copyfile(tokenized_path, tmp_destination)
+            with open(tokenized_path, "rb") as infile:
+                for chunk in ZstdDecompressor().read_to_iter(infile):
+                    lines += chunk.count(b"\n")
+        else:
+            with open(tokenized_path, "rb") as infile, open(tmp_destination, "wb") as outfile:
+                with ZstdCompressor(threads=-1).stream_writer(outfile) as writer:
+                    while chunk := infile.read(HASH_CHUNK_BYTES):
+                        lines += chunk.count(b"\n")
+                        writer.write(chunk)
+        os.replace(tmp_destination, destination)
+
+        entry = CacheEntry(
+            input_digest=input_digest,
+            tokenizer=tokenizer,
+            lang=lang,
+            version=version,
+            lines=lines,
+            file=file_name,
+        )
+        # Write the metadata atomically, so that a killed task doesn't leave a partial entry.
+        tmp_metadata_path = self.cache_dir / f"{key}.json.{os.getpid()}.tmp"
+        with open(tmp_metadata_path, "w", encoding="utf-8") as file:
+            json.dump(asdict(entry), file, indent=2)
+            file.write("\n")
+        os.replace(tmp_metadata_path, self.cache_dir / f"{key}.json")
+        logger.info(f"Stored in the tokenization cache: {tokenizer} {lang} {input_digest[:12]}")
+        return entry
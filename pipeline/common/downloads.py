@@ -4,13 +4,21 @@ import json
 import os
 import shutil
 import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from contextlib import ExitStack, contextmanager
+from dataclasses import asdict, dataclass
 from io import BufferedReader
 from pathlib import Path
+from threading import Lock
 from typing import Any, Callable, Generator, Literal, Optional, Union
 from zipfile import ZipFile
 
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from zstandard import ZstdCompressor, ZstdDecompressor
 
 from pipeline.common import format_bytes
@@ -18,16 +26,42 @@ from pipeline.common.logging import get_logger
 
 logger = get_logger(__file__)
 
+# Downloads of at least this size are split into ranges that are downloaded concurrently, when the
+# server supports range requests.
+RANGE_DOWNLOAD_MIN_BYTES = 64 * 1024 * 1024
+RANGE_DOWNLOAD_PART_BYTES = 16 * 1024 * 1024
+
+# The bounds of the size of the chunks of a download, which adapts to how fast they arrive.
+MIN_CHUNK_BYTES = 64 * 1024
+MAX_CHUNK_BYTES = 4 * 1024 * 1024
+CHUNK_TARGET_SEC = 0.1
+
+# The connections that are kept alive per host by the shared session, and the number of remote
+# files whose HEAD requests are cached.
+HTTP_POOL_MAXSIZE = 16
+HEAD_CACHE_SIZE = 1024
+
 
 class DownloadException(Exception):
     def __init__(self, msg: str):
         super().__init__(msg)
 
 
-def stream_download_to_file(url: str, destination: Union[str, Path]) -> None:
+class RangeNotSatisfiableException(DownloadException):
+    """The server answered a range request with a 416, which retrying won't change."""
+
+
+def stream_download_to_file(url: str, destination: Union[str, Path], connections: int = 1) -> None:
     """
     Streams a download to a file, and retries several times if there are any failures. The
     destination file must not already exist.
+
+    The download is written to "{destination}.part", and its state to "{destination}.part.json",
+    so that a download that was killed resumes from the last byte that was written, when the
+    server supports range requests and the file didn't change.
+
+    With several connections, large downloads are split into ranges that are downloaded
+    concurrently, when the server supports range requests.
     """
     if os.path.exists(destination):
         raise DownloadException(f"That file already exists: {destination}")
@@ -40,13 +74,348 @@ def stream_download_to_file(url: str, destination: Union[str, Path]) -> None:
         shutil.copy(mocked_location, destination)
         return
 
+    remote_file = get_remote_file_info(url)
+    use_ranges = (
+        connections > 1
+        and remote_file.accepts_ranges
+        and remote_file.size >= RANGE_DOWNLOAD_MIN_BYTES
+    )
+    partial_download = PartialDownload(url, destination, remote_file, use_ranges)
+
+    if use_ranges:
+        download_ranges_to_file(url, partial_download, remote_file.size, connections)
+    elif remote_file.size and partial_download.resume_from() == remote_file.size:
+        # The download was killed after it was written, but before it was completed.
+        logger.info(f"The partial download was already fully written: {partial_download.path}")
+    else:
+        try:
+            download_sequentially_to_file(url, partial_download)
+        except RangeNotSatisfiableException:
+            # The partial download doesn't match the remote file, e.g. it is larger than it.
+            logger.info(f"The partial download can't be resumed: {partial_download.path}")
+            partial_download.restart()
+            download_sequentially_to_file(url, partial_download)
+
+    partial_download.complete()
+
+
+@dataclass
+class RemoteFileInfo:
+    """What a HEAD request tells about a remote file."""
+
+    size: int
+    accepts_ranges: bool
+    # The ETag or Last-Modified header, which changes when the file changes.
+    validator: Optional[str]
+    content_type: Optional[str] = None
+    exists: bool = True
+
+
+@dataclass
+class HttpStats:
+    """The HTTP requests of the shared session, and how many of them reused a connection."""
+
+    requests: int = 0
+    connections: int = 0
+    head_requests: int = 0
+    cached_head_requests: int = 0
+    head_sec: float = 0.0
+
+    def __sub__(self, other: "HttpStats") -> "HttpStats":
+        return HttpStats(
+            **{key: value - getattr(other, key) for key, value in asdict(self).items()}
+        )
+
+
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_remote_file_infos: OrderedDict[str, RemoteFileInfo] = OrderedDict()
+_http_stats = HttpStats()
+_http_lock = Lock()
+
+
+class CountingHTTPConnection(HTTPConnection):
+    """A connection of the shared session, which counts the connections that are opened."""
+
+    def connect(self) -> None:
+        super().connect()
+        with _http_lock:
+            _http_stats.connections += 1
+
+
+class CountingHTTPSConnection(HTTPSConnection):
+    """A connection of the shared session, which counts the connections that are opened."""
+
+    def connect(self) -> None:
+        super().connect()
+        with _http_lock:
+            _http_stats.connections += 1
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CountingHTTPConnection
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CountingHTTPSConnection
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """An adapter whose pools count the connections they open."""
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+
+def count_http_request(response: requests.Response, *args, **kwargs) -> None:
+    """A response hook of the shared session, which counts its requests, including redirects."""
+    with _http_lock:
+        _http_stats.requests += 1
+
+
+def get_session() -> requests.Session:
+    """
+    The session that is shared by the HTTP requests, so that the connections are kept alive and
+    reused, e.g. for the many shards of a dataset on the same host. Forked processes get their own
+    session, as the connections of the parent can't be shared.
+    """
+    global _session, _session_pid
+    with _http_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = requests.Session()
+            # Keep a connection for each of the threads that download concurrently.
+            adapter = CountingHTTPAdapter(pool_maxsize=HTTP_POOL_MAXSIZE)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session.hooks["response"].append(count_http_request)
+            _session_pid = os.getpid()
+        return _session
+
+
+def get_http_stats() -> HttpStats:
+    """A snapshot of the HTTP requests that were made by the session of this process."""
+    with _http_lock:
+        return HttpStats(**asdict(_http_stats))
+
+
+def log_http_stats(since: HttpStats) -> None:
+    """Log the reuse of the connections and of the HEAD requests since a previous snapshot."""
+    stats = get_http_stats() - since
+    if not stats.requests and not stats.cached_head_requests:
+        return
+    message = f"{stats.requests} HTTP requests over {stats.connections} new connections"
+    if stats.cached_head_requests:
+        # The cached requests save the latency of a HEAD request each.
+        with _http_lock:
+            head_sec = _http_stats.head_sec / max(_http_stats.head_requests, 1)
+        message += (
+            f", {stats.cached_head_requests} HEAD requests were cached, saving about "
+            f"{stats.cached_head_requests * head_sec:.2f} sec"
+        )
+    logger.info(message)
+
+
+def head_remote_file(url: str) -> RemoteFileInfo:
+    """
+    Make a HEAD request for a remote file, which is cached per URL for the existing files, as
+    several functions need to know about the same file before it's read. A failing request
+    raises a RequestException.
+    """
+    with _http_lock:
+        remote_file = _remote_file_infos.get(url)
+        if remote_file:
+            _remote_file_infos.move_to_end(url)
+            _http_stats.cached_head_requests += 1
+            return remote_file
+
+    start_time = time.monotonic()
+    response = get_session().head(url, allow_redirects=True)
+    remote_file = RemoteFileInfo(
+        size=int(response.headers.get("content-length", 0)),
+        accepts_ranges=response.ok and response.headers.get("accept-ranges") == "bytes",
+        validator=response.headers.get("etag") or response.headers.get("last-modified"),
+        content_type=response.headers.get("content-type"),
+        exists=response.ok,
+    )
+
+    with _http_lock:
+        _http_stats.head_requests += 1
+        _http_stats.head_sec += time.monotonic() - start_time
+        # Missing files are requested again, as they may be created later.
+        if remote_file.exists:
+            _remote_file_infos[url] = remote_file
+            if len(_remote_file_infos) > HEAD_CACHE_SIZE:
+                _remote_file_infos.popitem(last=False)
+    return remote_file
+
+
+def get_remote_file_info(url: str) -> RemoteFileInfo:
+    """
+    Get the size of a remote file, and whether the server supports range requests for it. A
+    failing HEAD request is not an error, the file is then downloaded without range requests.
+    """
     try:
-        with open(destination, "wb") as file, DownloadChunkStreamer(url) as chunk_streamer:
+        return head_remote_file(url)
+    except requests.exceptions.RequestException as error:
+        logger.info(f"Range requests are not used, the HEAD request failed: {error}")
+        return RemoteFileInfo(0, False, None, exists=False)
+
+
+class PartialDownload:
+    """
+    A download in progress, which is written to "{destination}.part". Its state is kept in
+    "{destination}.part.json", so that it can be resumed if the download was killed. The state
+    is dropped when the URL, the size, or the validator of the remote file changed, or when it
+    was downloaded the other way, in ranges or in sequence.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        destination: Union[str, Path],
+        remote_file: RemoteFileInfo,
+        use_ranges: bool,
+    ) -> None:
+        self.destination = Path(destination)
+        self.path = Path(f"{destination}.part")
+        self.state_path = Path(f"{destination}.part.json")
+        self.state = {
+            "url": url,
+            "size": remote_file.size,
+            "validator": remote_file.validator,
+            "ranges": use_ranges,
+            "part_bytes": RANGE_DOWNLOAD_PART_BYTES,
+            "completed_ranges": [],
+        }
+
+        resumable = remote_file.accepts_ranges and remote_file.validator
+        previous_state = self.load_state() if resumable else None
+        if (
+            previous_state
+            and self.path.exists()
+            and all(
+                previous_state.get(key) == self.state[key]
+                for key in ("url", "size", "validator", "ranges", "part_bytes")
+            )
+        ):
+            self.state = previous_state
+            logger.info(f"Resuming the partial download: {self.path}")
+        else:
+            self.path.unlink(missing_ok=True)
+            self.save_state()
+
+    def load_state(self) -> Optional[dict]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def save_state(self) -> None:
+        # Replace the state at once, so that a killed download never leaves half of it.
+        temp_path = self.state_path.with_suffix(".tmp")
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(self.state, file)
+        os.replace(temp_path, self.state_path)
+
+    def resume_from(self) -> int:
+        """The byte to resume a sequential download from."""
+        return self.path.stat().st_size if self.path.exists() else 0
+
+    def restart(self) -> None:
+        """Drop the partial download and its state, to download the file from the start."""
+        self.path.unlink(missing_ok=True)
+        self.state["completed_ranges"] = []
+        self.save_state()
+
+    def complete_range(self, byte_range: tuple[int, int]) -> None:
+        self.state["completed_ranges"].append(list(byte_range))
+        self.save_state()
+
+    def completed_ranges(self) -> set[tuple[int, int]]:
+        return {(start, end) for start, end in self.state["completed_ranges"]}
+
+    def complete(self) -> None:
+        self.path.rename(self.destination)
+        self.state_path.unlink(missing_ok=True)
+
+
+def download_sequentially_to_file(url: str, partial_download: PartialDownload) -> None:
+    """Download a file in a single request, resuming from the end of the partial download."""
+    resume_from = partial_download.resume_from()
+    with open(partial_download.path, "ab" if resume_from else "wb") as file, DownloadChunkStreamer(
+        url, byte_range=(resume_from, None) if resume_from else None
+    ) as chunk_streamer:
+        for chunk in chunk_streamer.download_chunks():
+            file.write(chunk)
+
+
+def download_ranges_to_file(
+    url: str, partial_download: PartialDownload, size: int, connections: int
+) -> None:
+    """
+    Download a file in parts with range requests over several connections, and write each part
+    in place in the partial download. Each part retries on its own, and the completed parts are
+    skipped when a download is resumed.
+    """
+    completed_ranges = partial_download.completed_ranges()
+    ranges = [
+        (start, min(start + RANGE_DOWNLOAD_PART_BYTES, size))
+        for start in range(0, size, RANGE_DOWNLOAD_PART_BYTES)
+    ]
+    logger.info(
+        f"Downloading {size:,} bytes in {len(ranges)} parts with {connections} connections"
+    )
+    if completed_ranges:
+        logger.info(f"{len(completed_ranges)} parts were already downloaded")
+    with open(partial_download.path, "ab") as file:
+        file.truncate(size)
+
+    def download_range(byte_range: tuple[int, int]) -> None:
+        start, end = byte_range
+        with open(partial_download.path, "r+b") as file, DownloadChunkStreamer(
+            url, byte_range=byte_range, report_progress=False
+        ) as chunk_streamer:
+            file.seek(start)
             for chunk in chunk_streamer.download_chunks():
                 file.write(chunk)
-    except DownloadException:
-        Path(destination).unlink()
-        raise
+            if file.tell() != end:
+                raise DownloadException(
+                    f"Expected the bytes {start}-{end - 1}, but the download stopped at "
+                    f"{file.tell()}"
+                )
+
+    downloaded_bytes = sum(end - start for start, end in completed_ranges)
+    resumed_bytes = downloaded_bytes
+    start_time = time.monotonic()
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        futures = {
+            executor.submit(download_range, byte_range): byte_range
+            for byte_range in ranges
+            if byte_range not in completed_ranges
+        }
+        try:
+            for future in as_completed(futures):
+                future.result()
+                start, end = futures[future]
+                partial_download.complete_range((start, end))
+                downloaded_bytes += end - start
+                bytes_per_sec = (downloaded_bytes - resumed_bytes) / max(
+                    time.monotonic() - start_time, 1e-9
+                )
+                logger.info(
+                    f"{downloaded_bytes / size * 100.0:.0f}% downloaded "
+                    f"({downloaded_bytes}/{size} bytes, {bytes_per_sec / 1_000_000:.1f} MB/s)"
+                )
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    logger.info("100% downloaded - Download finished.")
 
 
 def get_mocked_downloads_file_path(url: str) -> Optional[str]:
@@ -85,8 +454,7 @@ def location_exists(location: str):
         return True
 
     if location.startswith("http://") or location.startswith("https://"):
-        response = requests.head(location, allow_redirects=True)
-        return response.ok
+        return head_remote_file(location).exists
     return os.path.exists(location)
 
 
@@ -106,9 +474,7 @@ def get_download_size(url: str) -> int:
     if mocked_file_path:
         return os.path.getsize(mocked_file_path)
 
-    response = requests.head(url, allow_redirects=True)
-    size = response.headers.get("content-length", 0)
-    return int(size)
+    return head_remote_file(url).size
 
 
 class RemoteDecodingLineStreamer:
@@ -196,11 +562,26 @@ class DownloadChunkStreamer(io.IOBase):
 
         with DownloadChunkStreamer(url) as f:
              gzip.GzipFile(fileobj=f)
+
+    With a byte range, only the bytes from its start up to its end are downloaded. The end can
+    be None to download up to the end of the file, for instance to resume a download.
+
+    The chunks start small, and grow up to several MB while they arrive faster than the target
+    duration of a chunk, so that fast downloads don't pay the overhead of many small chunks.
     """
 
-    def __init__(self, url: str, total_retries=3, timeout_sec=10.0, wait_before_retry_sec=60.0):
+    def __init__(
+        self,
+        url: str,
+        total_retries=3,
+        timeout_sec=10.0,
+        wait_before_retry_sec=60.0,
+        byte_range: Optional[tuple[int, Optional[int]]] = None,
+        report_progress=True,
+    ):
         self.url = url
         self.response = None
+        self.byte_range = byte_range
 
         # How many retry attempts should there be, and how long to wait between retries.
         self.total_retries = total_retries
@@ -209,14 +590,18 @@ class DownloadChunkStreamer(io.IOBase):
         # How long to wait for a response to timeout? This is the time that no new data is received.
         self.timeout_sec = timeout_sec
 
+        self.report_progress = report_progress
         self.report_every = 0.05  # What percentage of the download to report updates?
         self.next_report_percent = self.report_every  # The next report percentage.
 
         self.downloaded_bytes = 0
-        self.chunk_bytes = 8 * 1024
+        self.chunk_bytes = MIN_CHUNK_BYTES
+
+        # The time spent downloading, for the throughput.
+        self.elapsed_sec = 0.0
 
         # The buffered `read` data.
-        self.buffer = b""
+        self.buffer = bytearray()
 
         # The Generator result of _download_chunks.
         self.chunk_iter: Optional[Generator[bytes, None, None]] = None
@@ -255,14 +640,12 @@ class DownloadChunkStreamer(io.IOBase):
             return b""
 
         if size < 0:
-            # Load everything into the buffer, and return it.
-            for chunk in self.chunk_iter:
-                self.buffer += chunk
-            result = self.buffer
-            self.buffer = b""
+            # Load everything, and return it.
+            result = b"".join([self.buffer, *self.chunk_iter])
+            self.buffer = bytearray()
             return result
 
-        # Load the buffer with requested amount of data to read. -1 indicates load everything.
+        # Load the buffer with requested amount of data to read.
         while len(self.buffer) < size:
             chunk = next(self.chunk_iter, None)
             if chunk:
@@ -271,24 +654,45 @@ class DownloadChunkStreamer(io.IOBase):
                 # The stream ended.
                 break
 
-        # Return the requested read amount, and divide up the remaining buffer.
-        result = self.buffer[:size]
-        self.buffer = self.buffer[size:]
+        # Return the requested read amount, and remove it from the front of the buffer, which
+        # doesn't move the rest of the buffer.
+        result = bytes(self.buffer[:size])
+        del self.buffer[:size]
 
         return result
 
+    def readinto(self, buffer) -> int:
+        """Read into a writable buffer, without an intermediate bytes object for large reads."""
+        view = memoryview(buffer).cast("B")
+        if not self.chunk_iter:
+            return 0
+
+        size = min(len(self.buffer), len(view))
+        view[:size] = self.buffer[:size]
+        del self.buffer[:size]
+        while size < len(view):
+            chunk = next(self.chunk_iter, None)
+            if not chunk:
+                break
+            copied = min(len(chunk), len(view) - size)
+            view[size : size + copied] = chunk[:copied]
+            self.buffer += chunk[copied:]
+            size += copied
+        return size
+
     def readable(self):
         return True
 
     def download_chunks(self) -> Generator[bytes, None, None]:
         """
         This method is the generator that is responsible for running the request, and retrying
-        when there is a failure. It yields the fixed size byte chunks, and exposes a generator
-        to be consumed. This generator can be used directly in a for loop, or the entire class
-        can be passed in as a file handle.
+        when there is a failure. It yields the byte chunks, and exposes a generator to be
+        consumed. This generator can be used directly in a for loop, or the entire class can be
+        passed in as a file handle.
         """
         next_report_percent = self.report_every
         total_bytes = 0
+        start_byte, end_byte = self.byte_range or (0, None)
         exception = None
 
         for retry in range(self.total_retries):
@@ -297,49 +701,73 @@ class DownloadChunkStreamer(io.IOBase):
 
             try:
                 headers = {}
-                if self.downloaded_bytes > 0:
+                if self.byte_range or self.downloaded_bytes > 0:
                     # Pick up the download from where it was before.
-                    headers = {"Range": f"bytes={self.downloaded_bytes}-"}
+                    end = "" if end_byte is None else end_byte - 1
+                    headers = {"Range": f"bytes={start_byte + self.downloaded_bytes}-{end}"}
 
-                self.response = requests.get(
+                self.response = get_session().get(
                     self.url, headers=headers, stream=True, timeout=self.timeout_sec
                 )
+                if headers and self.response.status_code == 416:
+                    raise RangeNotSatisfiableException(
+                        f"The range {headers['Range']} of {self.url} is not satisfiable"
+                    )
                 self.response.raise_for_status()
+                if headers and self.response.status_code != 206:
+                    raise DownloadException(
+                        f"The server did not return the range {headers['Range']} of {self.url}"
+                    )
 
                 # Report the download size.
                 if not total_bytes and "content-length" in self.response.headers:
-                    total_bytes = int(self.response.headers["content-length"])
-                    logger.info(f"Download size: {total_bytes:,} bytes")
-
-                for chunk in self.response.iter_content(chunk_size=self.chunk_bytes):
-                    if not chunk:
-                        continue
+                    total_bytes = (
+                        int(self.response.headers["content-length"]) + self.downloaded_bytes
+                    )
+                    if self.report_progress:
+                        logger.info(f"Download size: {total_bytes:,} bytes")
 
+                chunk_start = time.monotonic()
+                while chunk := self.response.raw.read(self.chunk_bytes, decode_content=True):
+                    chunk_sec = time.monotonic() - chunk_start
+                    self.elapsed_sec += chunk_sec
                     self.downloaded_bytes += len(chunk)
+                    if len(chunk) == self.chunk_bytes:
+                        self.adapt_chunk_bytes(chunk_sec)
 
                     # Report the percentage downloaded every `report_every` percentage.
-                    if total_bytes and self.downloaded_bytes >= next_report_percent * total_bytes:
+                    if (
+                        self.report_progress
+                        and total_bytes
+                        and self.downloaded_bytes >= next_report_percent * total_bytes
+                    ):
                         logger.info(
                             f"{self.downloaded_bytes / total_bytes * 100.0:.0f}% downloaded "
-                            f"({self.downloaded_bytes}/{total_bytes} bytes)"
+                            f"({self.downloaded_bytes}/{total_bytes} bytes, "
+                            f"{self.throughput_description()})"
                         )
                         next_report_percent += self.report_every
 
                     yield chunk
+                    chunk_start = time.monotonic()
 
                 # The download is complete.
                 self.close()
-                logger.info("100% downloaded - Download finished.")
+                if self.report_progress:
+                    logger.info(
+                        f"100% downloaded - Download finished. {self.downloaded_bytes:,} bytes in "
+                        f"{self.elapsed_sec:.1f} sec ({self.throughput_description()})"
+                    )
                 return
 
             except requests.exceptions.Timeout as error:
                 logger.error(f"The connection timed out: {error}.")
                 exception = error
 
-            except requests.exceptions.RequestException as error:
+            except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as error:
                 # The RequestException is the generic error that catches all classes of "requests"
-                # errors. Don't attempt to be be smart about this, just attempt again until
-                # the retries are done.
+                # errors, and the urllib3 errors are raised while reading the response. Don't
+                # attempt to be be smart about this, just attempt again until the retries are done.
                 logger.error(f"A download error occurred: {error}")
                 exception = error
 
@@ -354,6 +782,21 @@ class DownloadChunkStreamer(io.IOBase):
         self.close()
         raise DownloadException("The download failed.") from exception
 
+    def adapt_chunk_bytes(self, chunk_sec: float) -> None:
+        """
+        Double the chunk size when a full chunk arrived in less than half the target duration,
+        and halve it when it took more than twice as long.
+        """
+        if chunk_sec < CHUNK_TARGET_SEC / 2:
+            self.chunk_bytes = min(self.chunk_bytes * 2, MAX_CHUNK_BYTES)
+        elif chunk_sec > CHUNK_TARGET_SEC * 2:
+            self.chunk_bytes = max(self.chunk_bytes // 2, MIN_CHUNK_BYTES)
+
+    def throughput_description(self) -> str:
+        if not self.elapsed_sec:
+            return "- MB/s"
+        return f"{self.downloaded_bytes / self.elapsed_sec / 1_000_000:.1f} MB/s"
+
     def decode(self, byte_stream) -> Generator[bytes, None, None]:
         """Pass through the byte stream. This method can be specialized by child classes."""
         return byte_stream
@@ -371,6 +814,7 @@ def _read_lines_multiple_files(
     """
 
     stack = None
+    http_stats = get_http_stats()
 
     def iter(stack: ExitStack):
         for file_path in files:
@@ -387,6 +831,7 @@ def _read_lines_multiple_files(
     finally:
         if stack:
             stack.close()
+        log_http_stats(http_stats)
 
 
 @contextmanager
@@ -422,8 +867,7 @@ def _read_lines_single_file(
         if location.startswith("http://") or location.startswith("https://"):
             # This is a remote file.
 
-            response = requests.head(location, allow_redirects=True)
-            content_type = response.headers.get("Content-Type")
+            content_type = head_remote_file(location).content_type
             if content_type == "application/gzip":
                 yield stack.enter_context(RemoteGzipLineStreamer(location))  # type: ignore[reportReturnType]
 
@@ -512,14 +956,81 @@ def read_lines(
     )
 
 
+class ParallelGzipWriter(io.RawIOBase):
+    """
+    A binary file writer that compresses gzip with multiple threads. The input is split into
+    blocks that are compressed concurrently, and each block is written out as its own gzip
+    member. A file made of concatenated members is a valid gzip file for any gzip reader.
+    zlib releases the GIL while compressing, so the threads compress in parallel.
+
+        with open("corpus.tsv.gz", "wb") as file, ParallelGzipWriter(file, threads=8) as writer:
+            writer.write(b"line\n")
+    """
+
+    def __init__(
+        self,
+        file: io.IOBase,
+        threads: int,
+        block_bytes: int = 4 * 1024 * 1024,
+        compresslevel: int = 6,
+    ) -> None:
+        super().__init__()
+        self.file = file
+        self.block_bytes = block_bytes
+        self.compresslevel = compresslevel
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        # Bound the compressed blocks that are waiting to be written.
+        self.max_pending = threads * 2
+        self.pending: deque[Future[bytes]] = deque()
+        self.buffer = bytearray()
+        self.blocks_written = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:  # type: ignore[override]
+        self.buffer += data
+        while len(self.buffer) >= self.block_bytes:
+            self._submit(bytes(self.buffer[: self.block_bytes]))
+            del self.buffer[: self.block_bytes]
+        return len(data)
+
+    def _submit(self, block: bytes) -> None:
+        self.pending.append(
+            self.executor.submit(gzip.compress, block, self.compresslevel, mtime=0)
+        )
+        while len(self.pending) > self.max_pending:
+            self._write_next()
+
+    def _write_next(self) -> None:
+        self.file.write(self.pending.popleft().result())
+        self.blocks_written += 1
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            # An empty file is not valid gzip, so always write at least one member.
+            if self.buffer or not (self.blocks_written or self.pending):
+                self._submit(bytes(self.buffer))
+                self.buffer.clear()
+            while self.pending:
+                self._write_next()
+        finally:
+            self.executor.shutdown()
+            super().close()
+
+
 @contextmanager
-def write_lines(path: Path | str, encoding="utf-8"):
+def write_lines(path: Path | str, encoding="utf-8", threads: Optional[int] = None):
     """
     A smart function to create a context to write lines to a file. It works on .zst, .gz, and
     raw text files. It reads the extension to determine the file type. If writing out a raw
     text file, for instance a sample of a dataset that is just used for viewing, include a
     "byte order mark" so that the browser can properly detect the encoding.
 
+    When threads is provided, .gz files are compressed with multiple threads.
+
     with write_lines("output.txt.gz") as output:
         output.write("writing a line\n")
         output.write("writing a second lines\n")
@@ -534,6 +1045,10 @@ def write_lines(path: Path | str, encoding="utf-8"):
             file = stack.enter_context(open(path, "wb"))
             compressor = stack.enter_context(ZstdCompressor().stream_writer(file))
             yield stack.enter_context(io.TextIOWrapper(compressor, encoding=encoding))
+        elif path.endswith(".gz") and threads and threads > 1:
+            file = stack.enter_context(open(path, "wb"))
+            compressor = stack.enter_context(ParallelGzipWriter(file, threads))
+            yield stack.enter_context(io.TextIOWrapper(compressor, encoding=encoding))
         elif path.endswith(".gz"):
             yield stack.enter_context(gzip.open(path, "wt", encoding=encoding))
         else:
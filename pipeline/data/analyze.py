@@ -11,14 +11,29 @@ Usage:
         --dataset "opus_NLLB/v1"
         --language en
 
-For parallel corpora, add the arguments twice, separated by a `--`.
+For parallel corpora, add the arguments twice, separated by a `--`. The datasets are read
+concurrently, and the histograms of blocks of lines can be computed in a pool of processes with
+`--processes`. The histograms are saved as JSON alongside the plots.
+
+For huge datasets, `--sample_lines` estimates the histograms from about this many lines of
+random blocks instead, so that the cost doesn't grow with the size of the dataset. The estimates
+come with confidence bounds for each bin.
 """
 
 import argparse
 import gzip
+import json
+import math
+import mmap
+import multiprocessing
 import os
 import sys
-from typing import Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+from multiprocessing.pool import Pool
+from typing import BinaryIO, Iterable, Optional
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -37,6 +52,31 @@ from pipeline.common.logging import get_logger
 
 logger = get_logger(__file__)
 
+# How many lines are counted at a time.
+BLOCK_LINES = 10_000
+
+# Whether each codepoint is whitespace, as used by str.split(). All the whitespace codepoints
+# are below U+3001, and the last entry is used for all the higher codepoints.
+WHITESPACE_TABLE = np.array(
+    [chr(codepoint).isspace() for codepoint in range(0x3002)], dtype=np.uint8
+)
+
+# The lines are sampled by the blocks of this size that contain their newline.
+SAMPLE_BLOCK_BYTES = 4096
+
+# How many frames of a zstd file with several frames are decompressed to sample its lines.
+SAMPLE_FRAMES = 64
+
+# Files that can't be sampled in place are decompressed in chunks of this size, which is a
+# multiple of the block size.
+SAMPLE_CHUNK_BYTES = 16_384 * SAMPLE_BLOCK_BYTES
+
+# The z-score of the confidence bounds of the sampled histograms, for 95% confidence.
+CONFIDENCE_Z = 1.96
+
+ZSTD_MAGIC = 0xFD2FB528
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A50
+
 
 def get_line_streamer(file_location: str):
     """Streams in lines from remote locations, or from disk. Accepts zst, gz, and plain text."""
@@ -53,7 +93,329 @@ def get_line_streamer(file_location: str):
     return open(file_location, "rt")
 
 
-def main(args: Optional[list[str]] = None) -> None:
+def count_block(lines: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Count the codepoints and the words of a block of lines, like `len(line)` and
+    `len(line.split())`, and return the histograms of both as bin counts.
+    """
+    codepoint_counts, word_counts = count_lines(lines)
+    return np.bincount(codepoint_counts), np.bincount(word_counts)
+
+
+def count_lines(lines: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Count the codepoints and the words of each line, like `len(line)` and `len(line.split())`.
+    """
+    codepoint_counts = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+    codepoints = np.frombuffer("".join(lines).encode("utf-32-le"), dtype=np.uint32)
+    # The higher codepoints are clipped to the last entry of the table.
+    is_space = np.take(WHITESPACE_TABLE, codepoints, mode="clip").view(bool)
+
+    # A word starts on a non-whitespace codepoint that follows whitespace or a line start.
+    offsets = np.zeros(len(lines), dtype=np.int64)
+    np.cumsum(codepoint_counts[:-1], out=offsets[1:])
+    follows_space = np.ones(len(codepoints), dtype=bool)
+    follows_space[1:] = is_space[:-1]
+    follows_space[offsets[offsets < len(codepoints)]] = True
+    word_starts = ~is_space & follows_space
+
+    # Add a trailing entry so that the offsets of empty lines at the end are valid.
+    word_starts = np.append(word_starts, False)
+    word_counts = np.add.reduceat(word_starts.astype(np.int64), offsets)
+    # The reduction of an empty line is the value at its offset, which belongs to the next line.
+    word_counts[codepoint_counts == 0] = 0
+
+    return codepoint_counts, word_counts
+
+
+def analyze_dataset(
+    file_location: str, pool: Optional[Pool], processes: int
+) -> tuple["Histogram", "Histogram"]:
+    """
+    Compute the histograms of the codepoints and words per line of a dataset. The blocks of lines
+    are counted in the pool when there is one, with a bounded number of blocks in flight.
+    """
+    codepoints_distribution = Histogram()
+    word_distribution = Histogram()
+
+    def add_counts(counts: tuple[np.ndarray, np.ndarray]) -> None:
+        codepoints_distribution.add_bincount(counts[0])
+        word_distribution.add_bincount(counts[1])
+
+    with get_line_streamer(file_location) as lines:
+        pending = deque()
+        for block in yield_blocks(lines):
+            if not pool:
+                add_counts(count_block(block))
+                continue
+            pending.append(pool.apply_async(count_block, (block,)))
+            if len(pending) >= processes * 2:
+                add_counts(pending.popleft().get())
+
+        while pending:
+            add_counts(pending.popleft().get())
+
+    return codepoints_distribution, word_distribution
+
+
+@dataclass
+class LineSample:
+    """
+    The lines of random blocks of a dataset. A line belongs to the block of its newline, and all
+    the lines have the same probability to be sampled. The lines of a cluster of blocks are
+    sampled together, which the confidence bounds account for.
+    """
+
+    method: str
+    lines: list[str] = field(default_factory=list)
+    clusters: list[int] = field(default_factory=list)
+    cluster_count: int = 0
+    # The estimate of the number of lines of the dataset.
+    estimated_lines: float = 0.0
+
+    def add_lines(self, text: str, cluster: int) -> None:
+        """Add the lines of a text that ends with a newline."""
+        lines = text.split("\n")[:-1]
+        self.lines.extend(f"{line}\n" for line in lines)
+        self.clusters.extend([cluster] * len(lines))
+
+
+def sample_dataset(
+    file_location: str, sample_lines: int, rng: np.random.Generator
+) -> tuple["Histogram", "Histogram"]:
+    """
+    Estimate the histograms of the codepoints and words per line of a dataset from a sample of
+    its lines, with confidence bounds for their bins.
+    """
+    sample = sample_file_lines(file_location, sample_lines, rng)
+    logger.info(
+        f"Sampled {len(sample.lines):,} lines of {file_location} with {sample.method}, out of an "
+        f"estimated {sample.estimated_lines:,.0f} lines"
+    )
+
+    codepoints_distribution = Histogram(sampled=True)
+    word_distribution = Histogram(sampled=True)
+    if sample.lines:
+        codepoint_counts, word_counts = count_lines(sample.lines)
+        clusters = np.array(sample.clusters)
+        # Scale the counts of the sampled lines to estimate the counts of all the lines.
+        scale = sample.estimated_lines / len(sample.lines)
+        codepoints_distribution.add_sample(codepoint_counts, clusters, sample.cluster_count, scale)
+        word_distribution.add_sample(word_counts, clusters, sample.cluster_count, scale)
+
+    return codepoints_distribution, word_distribution
+
+
+def sample_file_lines(
+    file_location: str, sample_lines: int, rng: np.random.Generator
+) -> LineSample:
+    """
+    Sample the lines of a local file. Plain text files are sampled in place, and zstd files with
+    several frames by decompressing a fixed number of random frames. Other compressed files are
+    decompressed, but only the sampled lines are decoded and counted. The last line of a file is
+    only sampled when it ends with a newline.
+    """
+    if file_location.endswith(".gz"):
+        with gzip.open(file_location, "rb") as stream:
+            return sample_stream_lines(stream, sample_lines, rng)
+
+    if file_location.endswith(".zst"):
+        frames = find_zstd_frames(file_location)
+        if len(frames) > 1:
+            return sample_zstd_frame_lines(file_location, frames, sample_lines, rng)
+        with zstandard.open(file_location, "rb") as stream:
+            return sample_stream_lines(stream, sample_lines, rng)
+
+    sample = LineSample("random blocks")
+    with open(file_location, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if not size:
+            return sample
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            block_count = -(-size // SAMPLE_BLOCK_BYTES)
+            blocks = rng.choice(block_count, min(block_count, sample_lines), replace=False)
+            for block in blocks.tolist():
+                if len(sample.lines) >= sample_lines:
+                    break
+                start = block * SAMPLE_BLOCK_BYTES
+                text = read_lines_ending_in(buffer, start, start + SAMPLE_BLOCK_BYTES)
+                sample.add_lines(text, sample.cluster_count)
+                sample.cluster_count += 1
+
+    sample.estimated_lines = block_count * len(sample.lines) / sample.cluster_count
+    return sample
+
+
+def sample_zstd_frame_lines(
+    file_location: str,
+    frames: list[tuple[int, int]],
+    sample_lines: int,
+    rng: np.random.Generator,
+) -> LineSample:
+    """
+    Sample the lines of random frames of a zstd file, like the ones written by pzstd. The random
+    blocks are taken from all the decompressed frames, and the frames are the clusters. The lines
+    that cross the frames can't be decoded on their own, and are left out.
+    """
+    sampled_frames = sorted(
+        rng.choice(len(frames), min(SAMPLE_FRAMES, len(frames)), replace=False).tolist()
+    )
+    sample = LineSample(
+        f"random blocks of {len(sampled_frames)} of {len(frames)} zstd frames",
+        cluster_count=len(sampled_frames),
+    )
+
+    buffers = []
+    complete_lines = 0
+    with open(file_location, "rb") as file:
+        for frame in sampled_frames:
+            offset, size = frames[frame]
+            file.seek(offset)
+            buffer = zstandard.ZstdDecompressor().decompressobj().decompress(file.read(size))
+            buffers.append(buffer)
+            complete_lines += buffer.count(b"\n") - (frame != 0 and b"\n" in buffer)
+
+    # The start of the blocks of each frame, as if the frames were concatenated.
+    block_starts = np.cumsum([0] + [-(-len(buffer) // SAMPLE_BLOCK_BYTES) for buffer in buffers])
+    blocks = rng.choice(block_starts[-1], min(block_starts[-1], sample_lines), replace=False)
+    for block in blocks.tolist():
+        if len(sample.lines) >= sample_lines:
+            break
+        cluster = int(np.searchsorted(block_starts, block, side="right")) - 1
+        start = (block - block_starts[cluster]) * SAMPLE_BLOCK_BYTES
+        text = read_lines_ending_in(
+            buffers[cluster],
+            start,
+            start + SAMPLE_BLOCK_BYTES,
+            starts_complete=sampled_frames[cluster] == 0,
+        )
+        sample.add_lines(text, cluster)
+
+    sample.estimated_lines = complete_lines * len(frames) / len(sampled_frames)
+    return sample
+
+
+def sample_stream_lines(
+    stream: BinaryIO, sample_lines: int, rng: np.random.Generator
+) -> LineSample:
+    """
+    Sample the lines of a stream that can't be read at random offsets. The stream is read in
+    chunks, and a reservoir keeps a uniform sample of the blocks of all the chunks, so that only
+    the lines of the sampled blocks are decoded.
+    """
+    sample = LineSample("a reservoir of random blocks")
+    reservoir: list[str] = []
+    reservoir_size = 0
+    block_count = 0
+    line_count = 0
+    # A buffer starts with the incomplete line of the previous chunk.
+    carry = b""
+    while chunk := stream.read(SAMPLE_CHUNK_BYTES):
+        buffer = carry + chunk
+        chunk_lines = chunk.count(b"\n")
+        line_count += chunk_lines
+        chunk_blocks = -(-len(chunk) // SAMPLE_BLOCK_BYTES)
+        if not reservoir_size:
+            # Keep enough blocks for the sample, given the lines per block of the first chunk.
+            lines_per_block = max(chunk_lines, 1) / chunk_blocks
+            reservoir_size = max(1, math.ceil(sample_lines / lines_per_block))
+
+        # A block replaces a random one of the reservoir with the probability of the size of the
+        # reservoir over the number of blocks so far.
+        indexes = np.arange(block_count, block_count + chunk_blocks)
+        slots = np.where(
+            indexes < reservoir_size, indexes, rng.integers(0, indexes + 1, chunk_blocks)
+        )
+        for block in np.flatnonzero(slots < reservoir_size).tolist():
+            start = len(carry) + block * SAMPLE_BLOCK_BYTES
+            text = read_lines_ending_in(buffer, start, start + SAMPLE_BLOCK_BYTES)
+            slot = int(slots[block])
+            if slot < len(reservoir):
+                reservoir[slot] = text
+            else:
+                reservoir.append(text)
+
+        block_count += chunk_blocks
+        carry = buffer[buffer.rfind(b"\n") + 1 :]
+
+    for cluster, text in enumerate(reservoir):
+        sample.add_lines(text, cluster)
+    sample.cluster_count = len(reservoir)
+    sample.estimated_lines = line_count
+    return sample
+
+
+def read_lines_ending_in(buffer: bytes, start: int, end: int, starts_complete: bool = True) -> str:
+    """
+    Read the lines of a buffer that end with a newline between the start and the end. The first
+    line of the buffer is left out when it doesn't start at the beginning of the buffer.
+    """
+    last_newline = buffer.rfind(b"\n", start, end)
+    if last_newline == -1:
+        return ""
+    line_start = buffer.rfind(b"\n", 0, start) + 1
+    if not line_start and not starts_complete:
+        line_start = buffer.find(b"\n", start, end) + 1
+    return buffer[line_start : last_newline + 1].decode("utf-8", errors="replace")
+
+
+def find_zstd_frames(file_location: str) -> list[tuple[int, int]]:
+    """
+    Find the offsets and the compressed sizes of the frames of a zstd file, from the headers of
+    the frames and of their blocks. Nothing is decompressed. Raises a ValueError for a truncated
+    or corrupt file.
+    """
+    frames = []
+    with open(file_location, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        offset = 0
+        while offset < size:
+            file.seek(offset)
+            header = file.read(18)
+            magic = int.from_bytes(header[:4], "little")
+            if magic & 0xFFFFFFF0 == ZSTD_SKIPPABLE_MAGIC:
+                offset += 8 + int.from_bytes(header[4:8], "little")
+                continue
+            if magic != ZSTD_MAGIC:
+                raise ValueError(f"Invalid zstd frame at offset {offset} of {file_location}")
+
+            try:
+                frame_end = offset + zstandard.frame_header_size(header)
+            except zstandard.ZstdError as error:
+                raise ValueError(
+                    f"Truncated zstd frame at offset {offset} of {file_location}"
+                ) from error
+            while True:
+                file.seek(frame_end)
+                block_bytes = file.read(3)
+                if len(block_bytes) < 3:
+                    raise ValueError(f"Truncated zstd frame at offset {offset} of {file_location}")
+                block_header = int.from_bytes(block_bytes, "little")
+                block_type = (block_header >> 1) & 3
+                # RLE blocks store a single byte.
+                frame_end += 3 + (1 if block_type == 1 else block_header >> 3)
+                if block_header & 1:
+                    break
+            if zstandard.get_frame_parameters(header).has_checksum:
+                frame_end += 4
+            if frame_end > size:
+                raise ValueError(f"Truncated zstd frame at offset {offset} of {file_location}")
+
+            frames.append((offset, frame_end - offset))
+            offset = frame_end
+    return frames
+
+
+def yield_blocks(lines: Iterable[str]) -> Iterable[list[str]]:
+    iterator = iter(lines)
+    while block := list(islice(iterator, BLOCK_LINES)):
+        yield block
+
+
+def parse_dataset_args(args: Optional[list[str]] = None) -> list[argparse.Namespace]:
+    """
+    Parse the arguments of each dataset, which are separated by "--".
+    """
     parser = argparse.ArgumentParser(
         description=__doc__,
         formatter_class=argparse.RawTextHelpFormatter,  # Preserves whitespace in the help text.
@@ -71,80 +433,215 @@ def main(args: Optional[list[str]] = None) -> None:
         required=True,
         help="The dataset language, as a BCP-47 language tag",
     )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=0,
+        help="How many processes count the lines of the datasets. The largest value given for\n"
+        "any of the datasets is used for all of them. Set to 0 to count in this process.",
+    )
+    parser.add_argument(
+        "--sample_lines",
+        type=int,
+        default=0,
+        help="Estimate the histograms from about this many lines of random blocks of the\n"
+        "dataset. Set to 0 to count all the lines. Remote datasets are always fully counted.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="The seed of the random sampling of the lines.",
+    )
     # All the use of "--" to add more arguments.
     parser.add_argument("next_dataset_args", nargs=argparse.REMAINDER)
 
     parsed_args = parser.parse_args(args)
 
-    # Defer parsing any options after "--", and recurse below if there are some.
-    next_dataset_args: Optional[list[str]] = None
-    if len(parsed_args.next_dataset_args):
-        if parsed_args.next_dataset_args[0] != "--":
-            print(next_dataset_args)
-            raise Exception("Unexpected arguments. Use -- to pass in multiple datasets.")
-        next_dataset_args = parsed_args.next_dataset_args[1:]
+    if not len(parsed_args.next_dataset_args):
+        return [parsed_args]
+    if parsed_args.next_dataset_args[0] != "--":
+        print(parsed_args.next_dataset_args)
+        raise Exception("Unexpected arguments. Use -- to pass in multiple datasets.")
+    # Apply the arguments again after "--".
+    return [parsed_args, *parse_dataset_args(parsed_args.next_dataset_args[1:])]
+
+
+def main(args: Optional[list[str]] = None) -> None:
+    datasets_args = parse_dataset_args(args)
+    processes = max(dataset_args.processes for dataset_args in datasets_args)
+
+    for dataset_args in datasets_args:
+        logger.info(f"file_location: {dataset_args.file_location}")
+        logger.info(f"output_dir: {dataset_args.output_dir}")
+        logger.info(f"dataset: {dataset_args.dataset}")
+        logger.info(f"language: {dataset_args.language}")
+
+    # The datasets are read and decompressed concurrently, and share the pool of processes.
+    pool = multiprocessing.Pool(processes) if processes else None
+    try:
+        with ThreadPoolExecutor(max_workers=len(datasets_args)) as executor:
+            distributions = list(
+                executor.map(
+                    lambda dataset_args: analyze_dataset_args(dataset_args, pool, processes),
+                    datasets_args,
+                )
+            )
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    # Matplotlib isn't thread safe, so the plots are drawn one after the other.
+    for dataset_args, (codepoints_distribution, word_distribution) in zip(
+        datasets_args, distributions
+    ):
+        save_distributions(dataset_args, codepoints_distribution, word_distribution)
+
+
+def analyze_dataset_args(
+    parsed_args: argparse.Namespace, pool: Optional[Pool], processes: int
+) -> tuple["Histogram", "Histogram"]:
+    file_location: str = parsed_args.file_location
+    if not parsed_args.sample_lines:
+        return analyze_dataset(file_location, pool, processes)
+    if file_location.startswith("http://") or file_location.startswith("https://"):
+        logger.warning(f"Counting all the lines of {file_location}, which can't be sampled.")
+        return analyze_dataset(file_location, pool, processes)
+    rng = np.random.default_rng(parsed_args.seed)
+    return sample_dataset(file_location, parsed_args.sample_lines, rng)
 
-    logger.info(f"file_location: {parsed_args.file_location}")
-    logger.info(f"output_dir: {parsed_args.output_dir}")
-    logger.info(f"dataset: {parsed_args.dataset}")
-    logger.info(f"language: {parsed_args.language}")
 
+def save_distributions(
+    parsed_args: argparse.Namespace,
+    codepoints_distribution: "Histogram",
+    word_distribution: "Histogram",
+) -> None:
     dataset = Dataset(parsed_args.dataset)
     graph_prefix = f"{dataset.file_safe_name()}.{parsed_args.language}"
 
-    # Compute the distributions for both the codepoints, and word size.
-    codepoints_distribution = Histogram()
-    word_distribution = Histogram()
-    with get_line_streamer(parsed_args.file_location) as lines:
-        for line in lines:
-            codepoints_distribution.count(len(line))
-            word_distribution.count(len(line.split()))
-
-    plot_logarithmic_histogram(
-        word_distribution,
-        max_size=5_000,  # words
-        title="\n".join(
-            [
-                "Word Count Distribution",
-                f"{parsed_args.dataset} - {parsed_args.language}",
-            ]
-        ),
-        x_axis_label="Words (log scale)",
-        filename=os.path.join(parsed_args.output_dir, f"{graph_prefix}.distribution-words.png"),
-    )
-
-    plot_logarithmic_histogram(
-        codepoints_distribution,
-        max_size=10_000,  # codepoints
-        title="\n".join(
-            [
-                "Codepoints per Sentence Distribution",
-                f"{parsed_args.dataset} - {parsed_args.language}",
-            ]
+    for histogram, name, max_size, title, x_axis_label in (
+        (
+            word_distribution,
+            "words",
+            5_000,  # words
+            "Word Count Distribution",
+            "Words (log scale)",
         ),
-        x_axis_label="Codepoints (log scale)",
-        filename=os.path.join(
-            parsed_args.output_dir, f"{graph_prefix}.distribution-codepoints.png"
+        (
+            codepoints_distribution,
+            "codepoints",
+            10_000,  # codepoints
+            "Codepoints per Sentence Distribution",
+            "Codepoints (log scale)",
         ),
-    )
-
-    if next_dataset_args:
-        # Apply the arguments again after "--".
-        main(next_dataset_args)
+    ):
+        filename = os.path.join(parsed_args.output_dir, f"{graph_prefix}.distribution-{name}")
+        plot_logarithmic_histogram(
+            histogram,
+            max_size=max_size,
+            title="\n".join(
+                [
+                    f"{title} (sampled)" if histogram.sampled else title,
+                    f"{parsed_args.dataset} - {parsed_args.language}",
+                ]
+            ),
+            x_axis_label=x_axis_label,
+            filename=f"{filename}.png",
+        )
+        save_histogram_json(
+            histogram,
+            max_size=max_size,
+            dataset=parsed_args.dataset,
+            language=parsed_args.language,
+            unit=name,
+            filename=f"{filename}.json",
+        )
 
 
 class Histogram:
     """Computes a histogram based on counts."""
 
-    def __init__(self) -> None:
+    def __init__(self, sampled: bool = False) -> None:
         # The keys are the bins, the values are the counts.
-        self.data: dict[int, int] = {}
+        self.data: dict[int, float] = {}
+        # The histograms estimated from a sample of the lines keep the values of the sampled lines
+        # and their clusters, for the confidence bounds.
+        self.sampled = sampled
+        self.sample_values = np.zeros(0, dtype=np.int64)
+        self.sample_clusters = np.zeros(0, dtype=np.int64)
+        self.cluster_count = 0
 
     def count(self, count: int):
         if count not in self.data:
             self.data[count] = 0
         self.data[count] += 1
 
+    def add_bincount(self, bincount: np.ndarray):
+        """Add the counts of `np.bincount`, where the index is the bin."""
+        for value in np.flatnonzero(bincount).tolist():
+            self.data[value] = self.data.get(value, 0) + bincount[value].item()
+
+    def add_sample(
+        self, values: np.ndarray, clusters: np.ndarray, cluster_count: int, scale: float
+    ):
+        """Add the values of the sampled lines, which each stand for `scale` lines."""
+        self.add_bincount(np.bincount(values) * scale)
+        self.sample_values = values
+        self.sample_clusters = clusters
+        self.cluster_count = cluster_count
+
+    def bin_fractions(self, bins: list[float]) -> np.ndarray:
+        """The fractions of all the lines in each of the bins."""
+        bin_counts, _ = np.histogram(list(self.data), bins=bins, weights=list(self.data.values()))
+        total = sum(self.data.values())
+        return bin_counts / total if total else bin_counts
+
+    def bin_fraction_bounds(self, bins: list[float]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The Wilson score interval of the fractions of the lines in the bins of a sampled
+        histogram. The lines of a cluster are sampled together, so the number of samples of
+        each bin is derived from the variance of its fraction across the clusters.
+        """
+        fractions = self.bin_fractions(bins)
+        lines = len(self.sample_values)
+        if not lines:
+            return fractions, fractions
+
+        # The sampled lines of each bin in each cluster.
+        cluster_bin_lines, _, _ = np.histogram2d(
+            self.sample_clusters,
+            self.sample_values,
+            bins=[np.arange(self.cluster_count + 1), bins],
+        )
+        cluster_lines = np.bincount(self.sample_clusters, minlength=self.cluster_count)
+        samples = np.full(len(fractions), float(lines))
+        if self.cluster_count > 1:
+            # The variance of the ratio of the lines in the bin to all the lines.
+            variance = (
+                np.square(cluster_bin_lines - np.outer(cluster_lines, fractions)).sum(axis=0)
+                * self.cluster_count
+                / (self.cluster_count - 1)
+                / lines**2
+            )
+            # The bins that are empty or have all the lines have no variance, and are treated as
+            # if the lines were sampled one by one.
+            has_variance = variance > 0
+            samples[has_variance] = (
+                fractions[has_variance] * (1 - fractions[has_variance]) / variance[has_variance]
+            )
+
+        z2 = CONFIDENCE_Z**2
+        center = (fractions + z2 / (2 * samples)) / (1 + z2 / samples)
+        margin = (
+            CONFIDENCE_Z
+            / (1 + z2 / samples)
+            * np.sqrt(fractions * (1 - fractions) / samples + z2 / (4 * samples**2))
+        )
+        low = np.where(fractions > 0, center - margin, 0).clip(0)
+        high = np.where(fractions < 1, center + margin, 1).clip(max=1)
+        return low, high
+
     def log_scale_bins(self, max_size: int, bin_count: int = 30) -> list[int]:
         """Converts the linear bins of the histogram into into logscale bins."""
         # Start with a few small value bins, since it's easy to start with some small fractional
@@ -170,6 +667,20 @@ def plot_logarithmic_histogram(
     plt.title(title)
     plt.hist(histogram.data.keys(), bins=bins, weights=histogram.data.values(), alpha=0.7)
 
+    if histogram.sampled:
+        # The bounds are of the fractions of the lines, scaled to the estimated number of lines.
+        total = sum(histogram.data.values())
+        fractions = histogram.bin_fractions(bins)
+        low, high = histogram.bin_fraction_bounds(bins)
+        plt.errorbar(
+            np.sqrt(bins[:-1] * bins[1:]),
+            fractions * total,
+            yerr=np.array([fractions - low, high - fractions]).clip(0) * total,
+            fmt="none",
+            ecolor="black",
+            capsize=2,
+        )
+
     plt.xlabel(x_axis_label)
     plt.xscale("log")
     plt.xticks(ticks=bins, labels=[f"{int(edge)}" for edge in bins], rotation="vertical")
@@ -186,5 +697,42 @@ def plot_logarithmic_histogram(
     plt.close()
 
 
+def save_histogram_json(
+    histogram: Histogram, max_size: int, dataset: str, language: str, unit: str, filename: str
+):
+    """
+    Save the histogram, so that it can be rendered without analyzing the dataset again. It
+    includes the counts per value, and the counts of the logarithmic bins of the plot. The
+    counts of an estimated histogram are fractional, and its bins have confidence bounds.
+    """
+    values = sorted(histogram.data)
+    bins = histogram.log_scale_bins(max_size)
+    bin_counts, _ = np.histogram(
+        values, bins=bins, weights=[histogram.data[value] for value in values]
+    )
+    data = {
+        "dataset": dataset,
+        "language": language,
+        "unit": unit,
+        "lines": sum(histogram.data.values()),
+        "values": values,
+        "counts": [histogram.data[value] for value in values],
+        "bins": [float(edge) for edge in bins],
+        "bin_counts": [int(count) for count in bin_counts],
+    }
+    if histogram.sampled:
+        low, high = histogram.bin_fraction_bounds(bins)
+        data["bin_counts"] = bin_counts.tolist()
+        data["sampled"] = {
+            "confidence": 0.95,
+            "bin_fractions": histogram.bin_fractions(bins).tolist(),
+            "bin_fractions_low": low.tolist(),
+            "bin_fractions_high": high.tolist(),
+        }
+    logger.info(f"Saving histogram to: {filename}")
+    with open(filename, "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=2)
+
+
 if __name__ == "__main__":
     main()
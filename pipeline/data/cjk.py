@@ -1,12 +1,16 @@
 """
 Chinese, Japanese, Korean (CJK) specific data importing code
 """
+import multiprocessing
+from collections import deque
 from enum import Flag
+from itertools import islice
 from pathlib import Path
-from typing import Optional
+from typing import Any, Iterable, Iterator, Optional
 
-import hanzidentifier
+import numpy as np
 import opencc
+from hanzidentifier import helpers as hanzi_helpers
 
 from pipeline.common.datasets import Statistics
 from pipeline.common.downloads import read_lines, write_lines
@@ -16,6 +20,9 @@ logger = get_logger(__file__)
 
 CJK_LANGS = ["zh", "ja", "ko"]
 
+# How many lines are detected and converted at a time, and sent to the processes of the pool.
+CHUNK_LINES = 10_000
+
 
 class ChineseType(Flag):
     none = 0
@@ -23,6 +30,60 @@ class ChineseType(Flag):
     traditional = 2
 
 
+# The script of each Chinese character, indexed by codepoint, as identified by hanzidentifier
+# from the CC-CEDICT dictionary. The values are the flags of ChineseType for the Chinese
+# characters, i.e. 1 for simplified, 2 for traditional, 3 for both. The other characters are
+# ignored when detecting the script of a text, and are NOT_HANZI, which has all the bits set so
+# that it doesn't change the bitwise AND of the characters of a text, and the NO_HANZI bit set
+# to know when a text doesn't have any Chinese characters.
+NO_HANZI = 4
+NOT_HANZI = NO_HANZI | 3
+
+
+def build_script_table() -> np.ndarray:
+    codepoints = [ord(char) for char in hanzi_helpers.ALL_CHARACTERS]
+    # The last entry is not a Chinese character, and is used for all the higher codepoints.
+    table = np.full(max(codepoints) + 2, NOT_HANZI, dtype=np.uint8)
+    table[codepoints] = 0
+    for char in hanzi_helpers.SIMPLIFIED_CHARACTERS:
+        table[ord(char)] |= ChineseType.simplified.value
+    for char in hanzi_helpers.TRADITIONAL_CHARACTERS:
+        table[ord(char)] |= ChineseType.traditional.value
+    return table
+
+
+SCRIPT_TABLE = build_script_table()
+# The ChineseType of the bitwise AND of the characters of a text. When the characters are only
+# compatible with different scripts, e.g. "simplified" and "traditional", the text is mixed,
+# which is considered as both.
+SCRIPT_TYPES = {
+    value: ChineseType(value) if value else ChineseType.traditional | ChineseType.simplified
+    for value in range(4)
+}
+for value in range(4):
+    SCRIPT_TYPES[NO_HANZI | value] = ChineseType.none
+
+
+def detect_lines(lines: list[str]) -> list[ChineseType]:
+    """
+    Detect the script of each line, like hanzidentifier.identify, with a lookup of the script of
+    all the characters of the lines at once, and a reduction of the scripts of each line.
+    """
+    if not lines:
+        return []
+    codepoints = np.frombuffer("".join(lines).encode("utf-32-le"), dtype=np.uint32)
+    scripts = SCRIPT_TABLE[np.minimum(codepoints, len(SCRIPT_TABLE) - 1)]
+    # The empty lines would be reduced to the value of the next character, so a NOT_HANZI is
+    # added at the end for an empty last line, and the empty lines are set to NO_HANZI.
+    scripts = np.append(scripts, np.uint8(NOT_HANZI))
+    lengths = np.fromiter((len(line) for line in lines), dtype=np.int64, count=len(lines))
+    offsets = np.zeros(len(lines), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    reduced = np.bitwise_and.reduceat(scripts, offsets)
+    reduced[lengths == 0] = NO_HANZI
+    return [SCRIPT_TYPES[value] for value in reduced.tolist()]
+
+
 class ConversionStep(Statistics):
     """
     When converting data, count how many sentences were converted, and how many were visited.
@@ -48,9 +109,17 @@ class DatasetStatistics(Statistics):
 
 
 class ChineseConverter:
-    def __init__(self):
+    """
+    Convert or filter the lines of a dataset to one variant of Chinese. The lines are processed
+    in chunks, which are spread over a pool of processes when `processes` is set, and the output
+    is written in the order of the input.
+    """
+
+    def __init__(self, processes: int = 0, chunk_lines: int = CHUNK_LINES):
         self.s2t = opencc.OpenCC("s2t.json")
         self.t2s = opencc.OpenCC("t2s.json")
+        self.processes = processes
+        self.chunk_lines = chunk_lines
 
     def convert_file(
         self, input_path: Path, output_path: Path, to: ChineseType
@@ -60,15 +129,11 @@ class ChineseConverter:
         """
         stats = DatasetStatistics(output_path, to)
         with write_lines(output_path) as out_file, read_lines(input_path) as lines:
-            for line in lines:
-                stats.script_conversion.visited += 1
-                ch_type = self._detect(line)
-                if ch_type in (ch_type.none, to):
-                    new_line = line
-                else:
-                    new_line = self._convert_line(line, to)
-                    stats.script_conversion.converted += 1
-                out_file.write(new_line)
+            chunks = self._map_chunks("convert_lines", self._chunk(lines), to)
+            for chunk, (new_lines, converted) in chunks:
+                stats.script_conversion.visited += len(chunk)
+                stats.script_conversion.converted += converted
+                out_file.writelines(new_lines)
         return stats
 
     def filter_file(self, input_path: Path, output_path: Path, variant: ChineseType):
@@ -77,13 +142,14 @@ class ChineseConverter:
         """
         stats = DatasetStatistics(output_path, variant)
         with write_lines(output_path) as out_file, read_lines(input_path) as lines:
-            for line in lines:
-                stats.script_conversion.visited += 1
-                ch_type = self._detect(line)
-                if ch_type == variant:
-                    out_file.write(line)
-                else:
-                    stats.script_conversion.filtered += 1
+            chunks = self._map_chunks("filter_lines", self._chunk(lines), variant)
+            for chunk, keep in chunks:
+                stats.script_conversion.visited += len(chunk)
+                for line, keep_line in zip(chunk, keep):
+                    if keep_line:
+                        out_file.write(line)
+                    else:
+                        stats.script_conversion.filtered += 1
 
         return stats
 
@@ -105,27 +171,98 @@ class ChineseConverter:
             read_lines(zh_path) as zh_lines,
             read_lines(other_path) as other_lines,
         ):
-            for zh_line, other_line in zip(zh_lines, other_lines):
-                stats.script_conversion.visited += 1
-                ch_type = self._detect(zh_line)
-                if ch_type == variant:
-                    zh_out_file.write(zh_line)
-                    other_out_file.write(other_line)
-                else:
-                    stats.script_conversion.filtered += 1
+            # Only the Chinese lines are sent to the pool. The chunks of the other side are kept
+            # here, and the results come back in the same order.
+            other_chunks: deque[list[str]] = deque()
+
+            def yield_zh_chunks() -> Iterator[list[str]]:
+                for line_pairs in self._chunk(zip(zh_lines, other_lines)):
+                    zh_chunk, other_chunk = zip(*line_pairs)
+                    other_chunks.append(list(other_chunk))
+                    yield list(zh_chunk)
+
+            chunks = self._map_chunks("filter_lines", yield_zh_chunks(), variant)
+            for zh_chunk, keep in chunks:
+                other_chunk = other_chunks.popleft()
+                stats.script_conversion.visited += len(zh_chunk)
+                for zh_line, other_line, keep_line in zip(zh_chunk, other_chunk, keep):
+                    if keep_line:
+                        zh_out_file.write(zh_line)
+                        other_out_file.write(other_line)
+                    else:
+                        stats.script_conversion.filtered += 1
 
         return stats
 
+    def convert_lines(self, lines: list[str], to: ChineseType) -> tuple[list[str], int]:
+        """
+        Convert a chunk of lines to one variant of Chinese, and return the new lines along with
+        how many of them were converted. The lines that need a conversion are joined with
+        newlines, and converted with a single OpenCC call.
+        """
+        indexes = [
+            i
+            for i, ch_type in enumerate(detect_lines(lines))
+            if ch_type not in (ChineseType.none, to)
+        ]
+        if not indexes:
+            return lines, 0
+
+        # The lines include their newline, except for the last line of a file.
+        texts = [lines[i].removesuffix("\n") for i in indexes]
+        converted_texts = self._convert_line("\n".join(texts), to).split("\n")
+        if len(converted_texts) != len(texts):
+            # OpenCC doesn't convert newlines, but fall back to converting each line rather than
+            # misaligning the output if it ever does.
+            logger.warning("The lines of a chunk were not preserved, converting them one by one")
+            converted_texts = [self._convert_line(text, to) for text in texts]
+
+        new_lines = list(lines)
+        for i, converted_text in zip(indexes, converted_texts):
+            new_lines[i] = converted_text + "\n" if lines[i].endswith("\n") else converted_text
+        return new_lines, len(indexes)
+
+    def filter_lines(self, lines: list[str], variant: ChineseType) -> list[bool]:
+        """
+        Returns whether each line of a chunk is written in the specified variant of Chinese.
+        """
+        return [ch_type == variant for ch_type in detect_lines(lines)]
+
+    def _chunk(self, lines: Iterable[Any]) -> Iterator[list[Any]]:
+        iterator = iter(lines)
+        while chunk := list(islice(iterator, self.chunk_lines)):
+            yield chunk
+
+    def _map_chunks(
+        self, method: str, chunks: Iterable[list[str]], *args: Any
+    ) -> Iterator[tuple[list[str], Any]]:
+        """
+        Apply a method of the converter to each chunk of lines, and yield the chunks along with
+        the results in order. With several processes, each one has its own converter, and a
+        bounded number of chunks are in flight so that a slow writer doesn't buffer the dataset.
+        """
+        if not self.processes:
+            for chunk in chunks:
+                yield chunk, getattr(self, method)(chunk, *args)
+            return
+
+        with multiprocessing.Pool(
+            self.processes, initializer=_init_worker, initargs=(self.chunk_lines,)
+        ) as pool:
+            pending: deque = deque()
+            for chunk in chunks:
+                pending.append((chunk, pool.apply_async(_run_converter, (method, chunk, *args))))
+                if len(pending) >= self.processes * 2:
+                    done_chunk, result = pending.popleft()
+                    yield done_chunk, result.get()
+
+            while pending:
+                done_chunk, result = pending.popleft()
+                yield done_chunk, result.get()
+
     @staticmethod
     def _detect(text) -> ChineseType:
-        res = hanzidentifier.identify(text)
-        if res == hanzidentifier.SIMPLIFIED:
-            return ChineseType.simplified
-        if res == hanzidentifier.TRADITIONAL:
-            return ChineseType.traditional
-        if res in (hanzidentifier.BOTH, hanzidentifier.MIXED):
-            return ChineseType.traditional | ChineseType.simplified
-        return ChineseType.none
+        return detect_lines([text])[0]
 
     def _convert_line(self, text: str, to: ChineseType) -> str:
         if to == ChineseType.simplified:
@@ -135,9 +272,38 @@ class ChineseConverter:
         raise ValueError(f"Unsupported type: {to}")
 
 
-def handle_chinese_mono(file_destination: Path, is_src: bool, variant: ChineseType):
+def get_processes(processes: Optional[int]) -> int:
+    # A single process converts the lines itself, rather than through a pool.
+    processes = multiprocessing.cpu_count() if processes is None else processes
+    return processes if processes > 1 else 0
+
+
+# The converter of a process of the pool, see _init_worker.
+_converter: Optional[ChineseConverter] = None
+
+
+def _init_worker(chunk_lines: int) -> None:
+    global _converter
+    _converter = ChineseConverter(chunk_lines=chunk_lines)
+
+
+def _run_converter(method: str, lines: list[str], *args: Any) -> Any:
+    assert _converter, "The converter process was not initialized"
+    return getattr(_converter, method)(lines, *args)
+
+
+def handle_chinese_mono(
+    file_destination: Path,
+    is_src: bool,
+    variant: ChineseType,
+    processes: Optional[int] = None,
+):
+    """
+    Convert or filter a monolingual Chinese dataset. The lines are processed by `processes`,
+    which defaults to the number of CPUs.
+    """
     converted_path = file_destination.with_suffix(".converted.zst")
-    chinese_converter = ChineseConverter()
+    chinese_converter = ChineseConverter(get_processes(processes))
     if is_src:
         logger.info(f"Converting the output file to {variant}")
         stats = chinese_converter.convert_file(file_destination, converted_path, variant)
@@ -151,11 +317,21 @@ def handle_chinese_mono(file_destination: Path, is_src: bool, variant: ChineseTy
     stats.save_json()
 
 
-def handle_chinese_parallel(output_prefix: str, src: str, trg: str, variant: ChineseType):
+def handle_chinese_parallel(
+    output_prefix: str,
+    src: str,
+    trg: str,
+    variant: ChineseType,
+    processes: Optional[int] = None,
+):
+    """
+    Convert or filter the Chinese side of a parallel dataset. The lines are processed by
+    `processes`, which defaults to the number of CPUs.
+    """
     if "zh" not in (src, trg):
         raise ValueError("Run only for Chinese")
 
-    chinese_converter = ChineseConverter()
+    chinese_converter = ChineseConverter(get_processes(processes))
     is_src = src == "zh"
     if is_src:
         logger.info(f"Converting the output file to {variant}")
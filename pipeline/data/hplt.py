@@ -1,8 +1,18 @@
 import json
+import multiprocessing
+import multiprocessing.pool
+import queue
 import random
+import re
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import ExitStack
 from dataclasses import dataclass
+from itertools import islice
+from multiprocessing.pool import AsyncResult
 from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, Union
 import icu
 
 from pipeline.common.datasets import (
@@ -11,7 +21,13 @@ from pipeline.common.datasets import (
     Statistics,
     WeakStringSet,
 )
-from pipeline.common.downloads import location_exists, read_lines, write_lines
+from pipeline.common.downloads import (
+    get_http_stats,
+    location_exists,
+    log_http_stats,
+    read_lines,
+    write_lines,
+)
 from pipeline.common.logging import get_logger
 from pipeline.common.memory import log_memory
 
@@ -19,6 +35,20 @@ logger = get_logger(__name__)
 
 random.seed(38947598475)
 
+# How many shards are downloaded and decompressed ahead of the one being processed.
+PREFETCH_SHARDS = 2
+# The lines of a shard are handed over from the prefetching threads in chunks, and a bounded
+# number of chunks are buffered per shard so that prefetching doesn't hold whole shards in memory.
+PREFETCH_CHUNK_LINES = 100
+PREFETCH_QUEUE_CHUNKS = 50
+
+# Match the fields that decide if a document is kept, without decoding the whole document. The
+# keys can't be found inside of the text, since the quotes of JSON strings are escaped.
+DOC_SCORES_KEY = '"doc_scores"'
+DOC_LANG_KEY = '"lang"'
+DOC_SCORE_REGEX = re.compile(r'"doc_scores"\s*:\s*\[\s*(-?[0-9][0-9.eE+-]*)')
+DOC_LANG_REGEX = re.compile(r'"lang"\s*:\s*\[\s*"([^"\\]*)"')
+
 
 @dataclass
 class HPLTDocument:
@@ -49,6 +79,33 @@ class HPLTDocument:
     lines: list[str]
 
 
+def decode_document_header(document_json: str) -> Optional[tuple[float, str]]:
+    """
+    Extract the overall document score and the most probable document language, i.e.
+    doc_scores[0] and lang[0], from the JSON of a document without decoding its text. This is
+    enough to reject most documents. None is returned when the fields can't be found, and the
+    document must be fully decoded instead.
+    """
+    # Finding the keys first is much faster than searching with the regexes. The scores are
+    # at the end of the HPLT documents, and the languages are before the text.
+    score_index = document_json.rfind(DOC_SCORES_KEY)
+    lang_index = document_json.find(DOC_LANG_KEY)
+    if score_index == -1 or lang_index == -1:
+        return None
+    score_match = DOC_SCORE_REGEX.match(document_json, score_index)
+    lang_match = DOC_LANG_REGEX.match(document_json, lang_index)
+    if not score_match or not lang_match:
+        return None
+    try:
+        return float(score_match.group(1)), lang_match.group(1)
+    except ValueError:
+        return None
+
+
+def decode_document(document_json: str) -> HPLTDocument:
+    return HPLTDocument(**json.loads(document_json))
+
+
 class FilteringStatistics(Statistics):
     """
     Gather statistics about the filtering process.
@@ -139,6 +196,245 @@ def load_shuffled_shard_urls(hplt_locale: str) -> list[str]:
     return shard_urls
 
 
+class ShardPrefetcher:
+    """
+    Stream the lines of the shards in order, while the next shards are downloaded and
+    decompressed in background threads. Each shard is read by its own thread into a bounded
+    queue, and the shards are consumed in the order of the URLs, so that the output is the same
+    as reading them one after the other.
+
+    Closing the prefetcher stops the threads, e.g. once enough lines were collected, and the
+    shards that weren't started yet are never requested.
+
+    Usage:
+
+        with ShardPrefetcher(urls, prefetch_shards=2) as lines:
+            for line in lines:
+                ...
+    """
+
+    _END = object()
+
+    def __init__(
+        self,
+        urls: list[str],
+        prefetch_shards: int = PREFETCH_SHARDS,
+        on_enter_location: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        self.urls = urls
+        self.prefetch_shards = prefetch_shards
+        self.on_enter_location = on_enter_location
+        # The shard being consumed is read in the background as well.
+        self.executor = ThreadPoolExecutor(
+            max_workers=prefetch_shards + 1, thread_name_prefix="hplt-prefetch"
+        )
+        self.stop_event = threading.Event()
+        self.queues: list[queue.Queue] = []
+        self.futures: list[Future] = []
+        self.http_stats = get_http_stats()
+
+    def __enter__(self) -> Iterator[str]:
+        return self._iter_lines()
+
+    def __exit__(self, *_args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.stop_event.set()
+        for future in self.futures:
+            future.cancel()
+        self.executor.shutdown(wait=True)
+        log_http_stats(self.http_stats)
+
+    def _put(self, shard_queue: queue.Queue, item: object) -> bool:
+        """
+        Put an item in the queue of a shard, giving up when the prefetcher is closed.
+        """
+        while not self.stop_event.is_set():
+            try:
+                shard_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read_shard(self, url: str, shard_queue: queue.Queue) -> None:
+        try:
+            with read_lines(url) as lines:
+                chunk = []
+                for line in lines:
+                    chunk.append(line)
+                    if len(chunk) == PREFETCH_CHUNK_LINES:
+                        if not self._put(shard_queue, chunk):
+                            return
+                        chunk = []
+                if chunk and not self._put(shard_queue, chunk):
+                    return
+            self._put(shard_queue, ShardPrefetcher._END)
+        except Exception as exception:
+            self._put(shard_queue, exception)
+
+    def _start(self, index: int) -> None:
+        if index < len(self.urls) and index == len(self.queues):
+            shard_queue: queue.Queue = queue.Queue(maxsize=PREFETCH_QUEUE_CHUNKS)
+            self.queues.append(shard_queue)
+            self.futures.append(
+                self.executor.submit(self._read_shard, self.urls[index], shard_queue)
+            )
+
+    def _iter_lines(self) -> Iterator[str]:
+        for index, url in enumerate(self.urls):
+            # Start reading this shard, and the next ones ahead of it.
+            for next_index in range(index, index + self.prefetch_shards + 1):
+                self._start(next_index)
+
+            logger.info(f"Reading lines from: {url}")
+            if self.on_enter_location:
+                self.on_enter_location(url)
+
+            shard_queue = self.queues[index]
+            while (item := shard_queue.get()) is not ShardPrefetcher._END:
+                if isinstance(item, Exception):
+                    raise item
+                yield from item
+
+
+# The outcomes of the lines of a kept document.
+LINE_KEPT = "k"
+LINE_FILTERED_LOCALE = "l"
+LINE_FILTERED_TOO_LONG = "t"
+
+# How many documents are sent at a time to the filtering processes.
+FILTER_BATCH_DOCUMENTS = 100
+
+
+@dataclass
+class FilteredDocument:
+    """
+    The result of filtering a document, before its segments are deduplicated and written.
+    """
+
+    # Set to "doc_score" or "doc_locale" when the whole document was filtered out.
+    filtered_by: Optional[str]
+    # The outcome of each visited line, e.g. "kkltk", see the LINE_* constants.
+    line_outcomes: str
+    # The segments to write, with the index of the line that completed each segment. The last
+    # segment of a document is completed after all of its lines, at len(line_outcomes).
+    segments: list[tuple[int, str]]
+
+
+class DocumentFilter:
+    """
+    Filter the lines of a document on their locale and length, and merge them into segments.
+    This doesn't depend on the previous documents, so documents can be filtered in any process,
+    and the HpltDownloader deduplicates and writes the segments in the order of the documents.
+    """
+
+    def __init__(
+        self,
+        hplt_locale: str,
+        hplt_min_doc_score: float,
+        max_characters: int,
+        merge_lines: bool,
+    ) -> None:
+        self.hplt_locale = hplt_locale
+        self.hplt_min_doc_score = hplt_min_doc_score
+        self.max_characters = max_characters
+        self.merge_lines = merge_lines
+
+    def filter(self, document_json: str) -> FilteredDocument:
+        # Only the fields used for filtering are extracted at first, so that the text of the
+        # rejected documents is never decoded.
+        document: Optional[HPLTDocument] = None
+        header = decode_document_header(document_json)
+        if header:
+            overall_doc_score, doc_lang = header
+        else:
+            document = decode_document(document_json)
+            overall_doc_score = document.doc_scores[0]
+            doc_lang = document.lang[0]
+
+        # HPLT 2.0 uses document level scores
+        if overall_doc_score < self.hplt_min_doc_score:
+            return FilteredDocument("doc_score", "", [])
+
+        # We want only documents written primarily in the target language
+        if doc_lang != self.hplt_locale:
+            return FilteredDocument("doc_locale", "", [])
+
+        if document is None:
+            document = decode_document(document_json)
+
+        line_outcomes: list[str] = []
+        segments: list[tuple[int, str]] = []
+        accumulated_text = ""
+        cumulative_char_count = 0
+
+        # Visit the lines in the document.
+        for line_index, (line_locale, line) in enumerate(zip(document.seg_langs, document.lines)):
+            char_count = len(line)
+            if line_locale != self.hplt_locale or char_count > self.max_characters:
+                # Line locale does not match expected locale, or the line is too long, filter
+                # it and write out the text accumulated so far.
+                line_outcomes.append(
+                    LINE_FILTERED_LOCALE
+                    if line_locale != self.hplt_locale
+                    else LINE_FILTERED_TOO_LONG
+                )
+                if accumulated_text:
+                    segments.append((line_index, accumulated_text))
+                accumulated_text = ""
+                cumulative_char_count = 0
+                continue
+
+            line_outcomes.append(LINE_KEPT)
+
+            # Just write the current line if merging is disabled
+            if not self.merge_lines:
+                if line:
+                    segments.append((line_index, line))
+                continue
+
+            # Text accumulation mode starts here
+
+            # Determine if this sentence should be added to the previous one or
+            # written out as a new line.
+            if cumulative_char_count + char_count + 1 > self.max_characters:
+                # This line would be too long, write it out.
+                if accumulated_text:
+                    segments.append((line_index, accumulated_text))
+                accumulated_text = ""
+                cumulative_char_count = 0
+
+            cumulative_char_count += char_count
+            # Collect this line to write.
+            if accumulated_text:
+                accumulated_text = f"{accumulated_text} {line}"
+                # count the whitespace
+                cumulative_char_count += 1
+            else:
+                accumulated_text = line
+
+        if accumulated_text:
+            segments.append((len(line_outcomes), accumulated_text))
+
+        return FilteredDocument(None, "".join(line_outcomes), segments)
+
+
+# The document filter of a filtering process, see _init_filter_worker.
+_document_filter: Optional[DocumentFilter] = None
+
+
+def _init_filter_worker(document_filter: DocumentFilter) -> None:
+    global _document_filter
+    _document_filter = document_filter
+
+
+def _filter_documents(documents: list[str]) -> list[FilteredDocument]:
+    assert _document_filter, "The filtering process was not initialized"
+    return [_document_filter.filter(document_json) for document_json in documents]
+
+
 class HpltDownloader:
     """
     Downloads and filters the HPLT dataset.
@@ -152,6 +448,11 @@ class HpltDownloader:
      - max_lines: The maximum number of lines to include in the final dataset.
      - file_destination: The destination path where the final dataset will be written.
      - merge_lines: Whether to accumulate line of the same document in one segment until max_characters is reached.
+     - prefetch_shards: How many shards to download and decompress ahead in background threads.
+                        Set to 0 to read the shards one after the other.
+     - processes: How many processes filter and merge the lines of the documents. The segments
+                  are still deduplicated and written in order by this process, so the output is
+                  the same. Set to 0 to filter the documents in this process.
     """
 
     def __init__(
@@ -162,15 +463,22 @@ class HpltDownloader:
         max_lines: int,
         file_destination: Path,
         merge_lines: bool,
+        prefetch_shards: int = PREFETCH_SHARDS,
+        processes: int = 0,
     ) -> None:
-        self.merge_lines = merge_lines
+        self.prefetch_shards = prefetch_shards
+        self.processes = processes
         self.max_lines = max_lines
-        self.max_characters = max_characters
-        self.hplt_min_doc_score = hplt_min_doc_score
         self.hplt_locale = get_hplt_locale(language)
-        self.accumulated_text = ""
-        self.cumulative_char_count = 0
+        self.document_filter = DocumentFilter(
+            self.hplt_locale, hplt_min_doc_score, max_characters, merge_lines
+        )
         self.visited_lines = 0
+        # The number of documents read when each shard was entered. Documents can be read ahead
+        # of the writer, so the shards are only counted as visited once their first document is
+        # written.
+        self.documents_read = 0
+        self.shard_starts: deque[int] = deque()
         self.file_destination = file_destination
         self.stats = FilteringStatistics(file_destination)
         self.strings_seen = WeakStringSet()
@@ -191,112 +499,140 @@ class HpltDownloader:
         shuffled_shard_urls = load_shuffled_shard_urls(self.hplt_locale)
         self.stats.shards.filtered = len(shuffled_shard_urls)
 
+        pool = None
+        if self.processes:
+            # Start the processes before the prefetching threads, as they are forked.
+            logger.info(f"Filtering the documents with {self.processes} processes")
+            pool = self.stack.enter_context(
+                multiprocessing.Pool(
+                    self.processes,
+                    initializer=_init_filter_worker,
+                    initargs=(self.document_filter,),
+                )
+            )
+
         # The shard URLs are shuffled, and then streamed into the read_lines iterator.
         # This iterator can work over multiple documents. The first document is loaded,
         # and then the documents in the shard are read in order from that shard. After
         # the first shard is read, the iterator continues with the next shards until
         # enough fluent sentences are collected. At this point the remaining shards
         # will not be visited.
-        document_stream = self.stack.enter_context(
-            read_lines(shuffled_shard_urls, on_enter_location=self.stats.count_shards_visited)
-        )
-
-        for document_json in document_stream:
-            self.stats.document_count.value += 1
-            document = HPLTDocument(**json.loads(document_json))
-            overall_doc_score = document.doc_scores[0]
-            doc_lang = document.lang[0]
-
-            self._maybe_write_accumulated_text()
-
-            # HPLT 2.0 uses document level scores
-            if overall_doc_score < self.hplt_min_doc_score:
-                self.stats.filtered_doc_score.value += 1
-                continue
-
-            # We want only documents written primarily in the target language
-            if doc_lang != self.hplt_locale:
-                self.stats.filtered_doc_locale.value += 1
-                continue
+        document_stream: Union[ShardPrefetcher, Iterator[str]]
+        if self.prefetch_shards:
+            # The next shards are downloaded and decompressed in the background, in the same
+            # order, while the current one is being processed.
+            document_stream = self.stack.enter_context(
+                ShardPrefetcher(
+                    shuffled_shard_urls,
+                    prefetch_shards=self.prefetch_shards,
+                    on_enter_location=self._enter_shard,
+                )
+            )
+        else:
+            document_stream = self.stack.enter_context(
+                read_lines(shuffled_shard_urls, on_enter_location=self._enter_shard)
+            )
 
-            # Visit the lines in the document.
-            for line_locale, line in zip(document.seg_langs, document.lines):
-                self.visited_lines += 1
-                self._process_line(line_locale, line)
-                if self.visited_lines % 5_000_000 == 0:
-                    logger.info(f"Visited {self.visited_lines:,} lines")
-                    logger.info(f"Kept {self.stats.visited_lines.kept:,}.")
-                    logger.info(
-                        f"Wrote {self.stats.final_lines.value:,} out of {self.max_lines:,}."
-                    )
-                    log_memory()
-
-                if self.stats.final_lines.value == self.max_lines:
-                    break
+        documents = self._count_documents(document_stream)
+        if pool:
+            filtered_documents = self._filter_in_pool(pool, documents)
+        else:
+            filtered_documents = map(self.document_filter.filter, documents)
 
-            if self.stats.final_lines.value == self.max_lines:
+        for filtered_document in filtered_documents:
+            if self._write_document(filtered_document):
                 break
-
-            self._maybe_write_accumulated_text()
+        else:
+            # Count the empty shards at the end.
+            self._count_shards_visited(self.documents_read)
 
         self.stats.visited_lines.filtered = self.visited_lines - self.stats.visited_lines.kept
         logger.info(f"Wrote {self.stats.final_lines.value:,} lines to: {self.file_destination}")
         stat_path = self.stats.save_json()
         logger.info(f"Saved filtering stats to: {stat_path}")
 
-    def _process_line(self, line_locale: str, line: str):
-        # Line locale does not match expected locale, filter
-        if line_locale != self.hplt_locale:
-            self.stats.filtered_line_locale.value += 1
-            self._maybe_write_accumulated_text()
-            return
-
-        char_count = len(line)
-        # Filter long segments
-        if char_count > self.max_characters:
-            self.stats.filtered_too_long.value += 1
-            self._maybe_write_accumulated_text()
-            return
-
-        # Just write the current line if merging is disabled
-        if not self.merge_lines:
-            self.accumulated_text = line
-            self.stats.visited_lines.kept += 1
-            self._maybe_write_accumulated_text()
-            return
-
-        # Text accumulation mode starts here
-
-        self.stats.visited_lines.kept += 1
-
-        # Determine if this sentence should be added to the previous one or
-        # written out as a new line.
-        if self.cumulative_char_count + char_count + 1 > self.max_characters:
-            # This line would be too long, write it out.
-            self._maybe_write_accumulated_text()
-
-        self.cumulative_char_count += char_count
-        # Collect this line to write.
-        if self.accumulated_text:
-            self.accumulated_text = f"{self.accumulated_text} {line}"
-            # count the whitespace
-            self.cumulative_char_count += 1
-        else:
-            self.accumulated_text = line
+    def _enter_shard(self, _url: str) -> None:
+        self.shard_starts.append(self.documents_read)
 
-    def _maybe_write_accumulated_text(self):
+    def _count_documents(self, document_stream: Iterable[str]) -> Iterator[str]:
+        for document_json in document_stream:
+            self.documents_read += 1
+            yield document_json
+
+    def _count_shards_visited(self, document_index: int) -> None:
+        while self.shard_starts and self.shard_starts[0] <= document_index:
+            self.shard_starts.popleft()
+            self.stats.count_shards_visited()
+
+    def _filter_in_pool(
+        self, pool: multiprocessing.pool.Pool, document_stream: Iterable[str]
+    ) -> Iterator[FilteredDocument]:
         """
-        Since the loop below is building up paragraphs of text, we only want to write
-        out a line when enough text has been accumulated. The paragraph should be
-        written out when either the text gets too long, or the next line is discarded.
+        Filter batches of documents in the pool, and yield the results in the order of the
+        documents.
         """
+        documents = iter(document_stream)
+        # Bound the number of batches in flight, so that the documents are only read ahead of
+        # the writer by a few batches, and the reading stops soon after max_lines is reached.
+        pending: deque[AsyncResult] = deque()
+        while batch := list(islice(documents, FILTER_BATCH_DOCUMENTS)):
+            pending.append(pool.apply_async(_filter_documents, (batch,)))
+            if len(pending) >= self.processes * 2:
+                yield from pending.popleft().get()
+
+        while pending:
+            yield from pending.popleft().get()
+
+    def _write_document(self, filtered_document: FilteredDocument) -> bool:
+        """
+        Deduplicate and write the segments of a filtered document, and count its statistics.
+        Returns True once max_lines is reached. The lines of the document after the one that
+        completed the last segment are then not counted as visited.
+        """
+        self._count_shards_visited(self.stats.document_count.value)
+        self.stats.document_count.value += 1
+        if filtered_document.filtered_by == "doc_score":
+            self.stats.filtered_doc_score.value += 1
+            return False
+        if filtered_document.filtered_by == "doc_locale":
+            self.stats.filtered_doc_locale.value += 1
+            return False
+
+        line_outcomes = filtered_document.line_outcomes
+        done = False
+        if self.stats.final_lines.value == self.max_lines:
+            # The last segment of the previous document reached max_lines. It is only checked
+            # after visiting a line, so the first line of this document is visited as well.
+            line_outcomes = line_outcomes[:1]
+            done = True
+        else:
+            for line_index, segment in filtered_document.segments:
+                self._write_segment(segment)
+                if self.stats.final_lines.value == self.max_lines and line_index < len(
+                    line_outcomes
+                ):
+                    line_outcomes = line_outcomes[: line_index + 1]
+                    done = True
+                    break
 
-        self.cumulative_char_count = 0
-        if self.accumulated_text:
-            if self.accumulated_text in self.strings_seen:
-                self.stats.duplicate_lines.value += 1
-            else:
-                self.outfile.write(self.accumulated_text + "\n")
-                self.stats.final_lines.value += 1
-                self.strings_seen.add(self.accumulated_text)
-            self.accumulated_text = ""
+        visited_lines = self.visited_lines
+        self.visited_lines += len(line_outcomes)
+        self.stats.visited_lines.kept += line_outcomes.count(LINE_KEPT)
+        self.stats.filtered_line_locale.value += line_outcomes.count(LINE_FILTERED_LOCALE)
+        self.stats.filtered_too_long.value += line_outcomes.count(LINE_FILTERED_TOO_LONG)
+
+        if visited_lines // 5_000_000 != self.visited_lines // 5_000_000:
+            logger.info(f"Visited {self.visited_lines:,} lines")
+            logger.info(f"Kept {self.stats.visited_lines.kept:,}.")
+            logger.info(f"Wrote {self.stats.final_lines.value:,} out of {self.max_lines:,}.")
+            log_memory()
+
+        return done
+
+    def _write_segment(self, segment: str):
+        if segment in self.strings_seen:
+            self.stats.duplicate_lines.value += 1
+        else:
+            self.outfile.write(segment + "\n")
+            self.stats.final_lines.value += 1
+            self.strings_seen.add(segment)
@@ -25,7 +25,7 @@ from contextlib import ExitStack
 from pathlib import Path
 from typing import Optional
 
-from hplt import HpltDownloader
+from hplt import PREFETCH_SHARDS, HpltDownloader
 
 from pipeline.common.datasets import Dataset, shuffle_with_max_lines
 from pipeline.common.downloads import (
@@ -72,6 +72,20 @@ def main(args_list: Optional[list[str]] = None) -> None:
         help="Whether to accumulate lines of the same document in one output segment until `hplt_max_characters` is reached.",
         default=False,
     )
+    parser.add_argument(
+        "--hplt_prefetch_shards",
+        type=int,
+        help="How many HPLT shards to download and decompress ahead in background threads. "
+        "Set to 0 to disable prefetching.",
+        default=PREFETCH_SHARDS,
+    )
+    parser.add_argument(
+        "--hplt_processes",
+        type=int,
+        help="How many processes filter and merge the lines of the HPLT documents. "
+        "Set to 0 to filter them in the main process.",
+        default=0,
+    )
     parser.add_argument(
         "--artifacts", type=Path, help="The location where the dataset will be saved"
     )
@@ -102,6 +116,8 @@ def main(args_list: Optional[list[str]] = None) -> None:
             max_lines=args.max_sentences,
             file_destination=file_destination,
             merge_lines=args.hplt_merge_lines,
+            prefetch_shards=args.hplt_prefetch_shards,
+            processes=args.hplt_processes,
         ).download()
 
         return
@@ -9,6 +9,7 @@ from enum import Enum
 from pathlib import Path
 import zipfile
 
+from zstandard import ZstdCompressor
 
 from pipeline.common.command_runner import run_command
 from pipeline.common.downloads import stream_download_to_file, compress_file, DownloadException
@@ -16,6 +17,9 @@ from pipeline.common.logging import get_logger
 
 logger = get_logger(__file__)
 
+# The OPUS archives can be several GB, and are downloaded in ranges over several connections.
+OPUS_DOWNLOAD_CONNECTIONS = 8
+
 
 class Downloader(Enum):
     opus = "opus"
@@ -43,7 +47,7 @@ def opus(src: str, trg: str, dataset: str, output_prefix: Path):
     def download_opus(pair):
         url = f"https://object.pouta.csc.fi/OPUS-{dataset}/moses/{pair}.txt.zip"
         logger.info(f"Downloading corpus for {pair} {url} to {archive_path}")
-        stream_download_to_file(url, archive_path)
+        stream_download_to_file(url, archive_path, connections=OPUS_DOWNLOAD_CONNECTIONS)
 
     try:
         pair = f"{src}-{trg}"
@@ -53,16 +57,15 @@ def opus(src: str, trg: str, dataset: str, output_prefix: Path):
         pair = f"{trg}-{src}"
         download_opus(pair)
 
-    logger.info("Extracting directory")
-    with zipfile.ZipFile(archive_path, "r") as zip_ref:
-        zip_ref.extractall(tmp_dir)
-
+    # Stream the corpus files out of the archive into zstd, rather than extracting them to disk.
     logger.info("Compressing output files")
-    for lang in (src, trg):
-        file_path = tmp_dir / f"{name}.{pair}.{lang}"
-        compressed_path = compress_file(file_path, keep_original=False, compression="zst")
-        output_path = output_prefix.with_suffix(f".{lang}.zst")
-        compressed_path.rename(output_path)
+    with zipfile.ZipFile(archive_path, "r") as archive:
+        for lang in (src, trg):
+            output_path = output_prefix.with_suffix(f".{lang}.zst")
+            with archive.open(f"{name}.{pair}.{lang}") as infile, open(
+                output_path, "wb"
+            ) as outfile:
+                ZstdCompressor().copy_stream(infile, outfile)
 
     shutil.rmtree(tmp_dir)
     logger.info("Done: Downloading opus corpus")
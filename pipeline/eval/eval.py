@@ -38,20 +38,38 @@ For instance for a value of: "fetches/wmt09":
   fetches
   ├── wmt09.en.zst
   └── wmt09.ca.zst
+
+Multiple datasets:
+
+Several datasets can be evaluated for the same model in one process, by passing as many
+--dataset_prefix as --artifacts_prefix. The COMET model is then only loaded once. The metrics
+are published to W&B for the dataset of the task label, so only a single dataset can be
+evaluated with the W&B publication.
+
+Streaming:
+
+With --streaming, all of the datasets are translated by a single marian-decoder process. The
+BLEU and chrF statistics are accumulated as the translations stream out of Marian, and the
+COMET model is loaded and run in a worker thread while Marian is still decoding.
 """
 
 
 import argparse
 import json
 import os
+import queue
+import shutil
 import subprocess
+import threading
+from dataclasses import dataclass
 from textwrap import dedent, indent
-from typing import Optional
+from typing import Any, Callable, Optional, Union
 
-from sacrebleu.metrics.bleu import BLEU, BLEUScore
-from sacrebleu.metrics.chrf import CHRF, CHRFScore
+from sacrebleu.metrics.bleu import BLEU
+from sacrebleu.metrics.chrf import CHRF
+from sacrebleu.utils import sum_of_lists
 
-from pipeline.common.downloads import decompress_file
+from pipeline.common.downloads import decompress_file, read_lines, write_lines
 from pipeline.common.logging import get_logger
 from pipeline.common.marian import assert_gpus_available
 
@@ -71,6 +89,15 @@ except ImportError as e:
     print(f"Failed to import tracking module: {e}")
     WANDB_AVAILABLE = False
 
+# The default comet model.
+# It should match the model used in https://github.com/mozilla/firefox-translations-models/
+COMET_MODEL_NAME = "Unbabel/wmt22-comet-da"
+
+# How many translations are scored at a time in the streaming mode.
+STREAMING_CHUNK_LINES = 1000
+
+Metric = Union[BLEU, CHRF]
+
 
 def run_bash_oneliner(command: str):
     """
@@ -90,6 +117,463 @@ def run_bash_oneliner(command: str):
     return subprocess.check_call(command, shell=True)
 
 
+@dataclass
+class Dataset:
+    """
+    The paths of the fetches and artifacts of an evaluation dataset.
+    """
+
+    dataset_prefix: str
+    artifacts_prefix: str
+    src: str
+    trg: str
+
+    @property
+    def source_file_compressed(self) -> str:
+        return f"{self.dataset_prefix}.{self.src}.zst"
+
+    @property
+    def source_file(self) -> str:
+        return f"{self.artifacts_prefix}.{self.src}"
+
+    @property
+    def target_file_compressed(self) -> str:
+        return f"{self.dataset_prefix}.{self.trg}.zst"
+
+    @property
+    def target_file(self) -> str:
+        return f"{self.artifacts_prefix}.{self.trg}"
+
+    @property
+    def target_ref_file(self) -> str:
+        return f"{self.artifacts_prefix}.{self.trg}.ref"
+
+    @property
+    def marian_log_file(self) -> str:
+        return f"{self.artifacts_prefix}.log"
+
+    @property
+    def metrics_file(self) -> str:
+        return f"{self.artifacts_prefix}.metrics"
+
+    @property
+    def metrics_json(self) -> str:
+        return f"{self.artifacts_prefix}.metrics.json"
+
+
+class IncrementalMetric:
+    """
+    Accumulate the sufficient statistics of a sacrebleu metric as chunks of translations come
+    in, so that the corpus score can be computed without keeping the corpus in memory. This
+    relies on the statistics extraction of sacrebleu, which is summed per segment in
+    `corpus_score` in the same way.
+    """
+
+    def __init__(self, metric: Metric) -> None:
+        self.metric = metric
+        self.stats: Optional[list] = None
+
+    def update(self, hypotheses: list[str], references: list[str]) -> None:
+        stats = sum_of_lists(self.metric._extract_corpus_statistics(hypotheses, [references]))
+        if self.stats is None:
+            self.stats = stats
+        else:
+            self.stats = [total + value for total, value in zip(self.stats, stats)]
+
+    def details(self) -> dict[str, Any]:
+        if self.stats is None:
+            raise ValueError("No translations were scored.")
+        score = self.metric._compute_score_from_stats(self.stats)
+        return get_score_details(self.metric, score)
+
+
+def get_score_details(metric: Metric, score: Any) -> dict[str, Any]:
+    return json.loads(score.format(signature=metric.get_signature().format(), is_json=True))
+
+
+def get_comet_gpu_count(gpus: Optional[str]) -> int:
+    if os.environ.get("COMET_CPU") or not gpus:
+        return 0  # Let tests override the CPU count.
+    # GPU information comes in the form of a list of numbers, e.g. "0 1 2 3". Split these to
+    # get the GPU count.
+    return len(gpus.split(" "))
+
+
+def load_comet_model():
+    logger.info("Loading COMET")
+    import comet
+
+    # COMET_MODEL_DIR allows tests to place the model in a data directory
+    comet_checkpoint = comet.download_model(
+        COMET_MODEL_NAME, saving_directory=os.environ.get("COMET_MODEL_DIR")
+    )
+    return comet.load_from_checkpoint(comet_checkpoint)
+
+
+class CometWorker(threading.Thread):
+    """
+    Load the COMET model and score chunks of translations in the background, so that COMET
+    overlaps with the decoding. The system score is the mean of the segment scores, like the
+    one computed by `predict` on the whole corpus.
+    """
+
+    def __init__(self, load_model: Callable[[], Any], gpu_count: int) -> None:
+        super().__init__(name="comet", daemon=True)
+        self.load_model = load_model
+        self.gpu_count = gpu_count
+        self.chunks: queue.Queue[Optional[tuple[int, list[dict[str, str]]]]] = queue.Queue()
+        self.segment_scores: dict[int, list[float]] = {}
+        self.error: Optional[BaseException] = None
+
+    def submit(self, dataset_index: int, data: list[dict[str, str]]) -> None:
+        self.chunks.put((dataset_index, data))
+
+    def run(self) -> None:
+        try:
+            model = self.load_model()
+            comet_mode = "cpu" if self.gpu_count == 0 else "gpu"
+            logger.info(
+                f'Computing the COMET score with "{COMET_MODEL_NAME}" using the {comet_mode}'
+            )
+            while (chunk := self.chunks.get()) is not None:
+                dataset_index, data = chunk
+                results = model.predict(data, gpus=self.gpu_count, progress_bar=False)
+                self.segment_scores.setdefault(dataset_index, []).extend(results.scores)
+        except BaseException as error:
+            self.error = error
+            # Drain the queue so that the producer is never blocked on a failed worker.
+            while self.chunks.get() is not None:
+                pass
+
+    def finish(self) -> dict[int, float]:
+        """
+        Wait for the scoring to be done, and return the system score of each dataset.
+        """
+        self.chunks.put(None)
+        self.join()
+        if self.error:
+            raise self.error
+        return {
+            dataset_index: round(sum(scores) / len(scores), 4)
+            for dataset_index, scores in self.segment_scores.items()
+        }
+
+
+def get_marian_command(
+    marian_decoder: str, models: str, marian_config: str, log_file: str, extra_args: list[str]
+) -> str:
+    return (
+        f"{marian_decoder} --models {models} --config {marian_config} "
+        f"--quiet --quiet-translation --log {log_file} {' '.join(extra_args)}"
+    )
+
+
+def evaluate_sequentially(
+    datasets: list[Dataset],
+    marian_decoder: str,
+    args: argparse.Namespace,
+    marian_extra_args: list[str],
+    comet_skip: bool,
+) -> list[tuple[dict, dict, Union[float, str]]]:
+    """
+    Translate each dataset with its own marian-decoder pipeline, then compute the metrics from
+    the files written to the artifacts.
+    """
+    results = []
+    comet_model = None
+    for dataset in datasets:
+        logger.info("Save the original target sentences to the artifacts")
+        decompress_file(
+            dataset.target_file_compressed,
+            keep_original=False,
+            decompressed_path=dataset.target_ref_file,
+        )
+
+        run_bash_oneliner(
+            f"""
+            # Decompress the source file, e.g. $fetches/wmt09.en.zst
+            zstdmt -dc "{dataset.source_file_compressed}"
+
+            # Tee the source file into the artifacts directory, e.g. $artifacts/wmt09.en
+            | tee "{dataset.source_file}"
+
+            # Take the source and pipe it in to be decoded (translated) by Marian.
+            | {marian_decoder}
+                --models {args.models}
+                --config {args.marian_config}
+                --quiet
+                --quiet-translation
+                --log {dataset.marian_log_file}
+                {" ".join(marian_extra_args)}
+
+            # The translations be "tee"ed out to the artifacts, e.g. $artifacts/wmt09.ca
+            | tee "{dataset.target_file}"
+            """
+        )
+
+        with open(dataset.target_ref_file, "r") as file:
+            target_ref_lines = file.readlines()
+        with open(dataset.target_file, "r") as file:
+            target_lines = file.readlines()
+        with open(dataset.source_file, "r") as file:
+            source_lines = file.readlines()
+
+        compute_bleu = BLEU(trg_lang=dataset.trg)
+        compute_chrf = CHRF()
+
+        logger.info("Computing the BLEU score.")
+        bleu_details = get_score_details(
+            compute_bleu, compute_bleu.corpus_score(target_lines, [target_ref_lines])
+        )
+
+        logger.info("Computing the chrF score.")
+        chrf_details = get_score_details(
+            compute_chrf, compute_chrf.corpus_score(target_lines, [target_ref_lines])
+        )
+
+        if comet_skip:
+            comet_score = "skipped"
+        else:
+            # The COMET model is shared by all of the datasets.
+            if comet_model is None:
+                comet_model = load_comet_model()
+            comet_data = []
+            for source, target, target_ref in zip(source_lines, target_lines, target_ref_lines):
+                comet_data.append({"src": source, "mt": target, "ref": target_ref})
+            gpu_count = get_comet_gpu_count(args.gpus)
+            comet_mode = "cpu" if gpu_count == 0 else "gpu"
+            logger.info(
+                f'Computing the COMET score with "{COMET_MODEL_NAME}" using the {comet_mode}'
+            )
+
+            comet_results = comet_model.predict(comet_data, gpus=gpu_count)
+            # Reduce the precision.
+            comet_score = round(comet_results.system_score, 4)
+
+        results.append((bleu_details, chrf_details, comet_score))
+    return results
+
+
+def evaluate_streaming(
+    datasets: list[Dataset],
+    marian_decoder: str,
+    args: argparse.Namespace,
+    marian_extra_args: list[str],
+    comet_skip: bool,
+    chunk_lines: int = STREAMING_CHUNK_LINES,
+) -> list[tuple[dict, dict, Union[float, str]]]:
+    """
+    Translate all of the datasets with a single marian-decoder process, and compute the metrics
+    as the translations stream out of it.
+
+    A writer thread feeds the source sentences of every dataset to Marian, and queues them with
+    their dataset index. Marian outputs a translation per line in order, so each translation is
+    matched with the next queued source sentence. The queue isn't bounded, as Marian buffers a
+    maxi-batch of its input before outputting anything.
+
+    The Marian log covers all of the datasets, and is written to the log of each of them.
+    """
+    comet_worker = None
+    if not comet_skip:
+        comet_worker = CometWorker(load_comet_model, get_comet_gpu_count(args.gpus))
+        comet_worker.start()
+
+    command = get_marian_command(
+        marian_decoder,
+        args.models,
+        args.marian_config,
+        datasets[0].marian_log_file,
+        marian_extra_args,
+    )
+    logger.info(f"Running: {command}")
+    marian = subprocess.Popen(
+        command,
+        shell=True,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        encoding="utf-8",
+    )
+    assert marian.stdin and marian.stdout
+
+    sources: queue.Queue[tuple[int, str]] = queue.Queue()
+    writer_errors: list[BaseException] = []
+
+    def write_sources() -> None:
+        try:
+            for dataset_index, dataset in enumerate(datasets):
+                with (
+                    read_lines(dataset.source_file_compressed) as lines,
+                    write_lines(dataset.source_file) as source_file,
+                ):
+                    for line in lines:
+                        source_file.write(line)
+                        sources.put((dataset_index, line))
+                        marian.stdin.write(line)
+        except BaseException as error:
+            writer_errors.append(error)
+        finally:
+            marian.stdin.close()
+
+    writer = threading.Thread(target=write_sources, name="marian-input", daemon=True)
+    writer.start()
+
+    # The statistics of the metrics are accumulated as the translations come in, but the
+    # scores are only computed once Marian and the writer succeeded, so that their errors
+    # aren't hidden by the scoring of missing translations.
+    dataset_metrics: list[tuple[IncrementalMetric, IncrementalMetric, int, int]] = []
+    for dataset_index, dataset in enumerate(datasets):
+        bleu = IncrementalMetric(BLEU(trg_lang=dataset.trg))
+        chrf = IncrementalMetric(CHRF())
+        source_chunk: list[str] = []
+        target_chunk: list[str] = []
+        ref_chunk: list[str] = []
+        ref_count = 0
+        translation_count = 0
+
+        def score_chunk() -> None:
+            bleu.update(target_chunk, ref_chunk)
+            chrf.update(target_chunk, ref_chunk)
+            if comet_worker:
+                comet_worker.submit(
+                    dataset_index,
+                    [
+                        {"src": source.rstrip("\n"), "mt": target.rstrip("\n"), "ref": ref}
+                        for source, target, ref in zip(source_chunk, target_chunk, ref_chunk)
+                    ],
+                )
+            source_chunk.clear()
+            target_chunk.clear()
+            ref_chunk.clear()
+
+        with (
+            read_lines(dataset.target_file_compressed) as refs,
+            write_lines(dataset.target_ref_file) as ref_file,
+            write_lines(dataset.target_file) as target_file,
+        ):
+            for ref in refs:
+                ref_count += 1
+                ref_file.write(ref)
+                target = marian.stdout.readline()
+                if not target:
+                    continue
+                source_index, source = sources.get()
+                if source_index != dataset_index:
+                    # Don't leave Marian and the writer blocked on the pipes.
+                    marian.kill()
+                    raise Exception(
+                        "The source and reference sentences of "
+                        f"{datasets[min(source_index, dataset_index)].dataset_prefix} "
+                        "don't have the same number of lines."
+                    )
+                translation_count += 1
+                target_file.write(target)
+
+                source_chunk.append(source)
+                target_chunk.append(target)
+                ref_chunk.append(ref.rstrip("\n"))
+                if len(target_chunk) == chunk_lines:
+                    score_chunk()
+            if target_chunk:
+                score_chunk()
+
+        logger.info(f"Translated and scored {dataset.dataset_prefix}")
+        dataset_metrics.append((bleu, chrf, ref_count, translation_count))
+
+    marian.stdout.close()
+    writer.join()
+    returncode = marian.wait()
+    # Marian logs the translation of every dataset to the log of the first one, which is copied
+    # so that every dataset has its log, like in the sequential mode.
+    if os.path.exists(datasets[0].marian_log_file):
+        for dataset in datasets[1:]:
+            if dataset.marian_log_file != datasets[0].marian_log_file:
+                shutil.copyfile(datasets[0].marian_log_file, dataset.marian_log_file)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+    if writer_errors:
+        raise writer_errors[0]
+    for dataset, (_, _, ref_count, translation_count) in zip(datasets, dataset_metrics):
+        if not ref_count:
+            raise Exception(f"The dataset {dataset.dataset_prefix} is empty.")
+        if translation_count < ref_count:
+            raise Exception(
+                f"Marian produced {translation_count} translations for the {ref_count} "
+                f"sentences of {dataset.dataset_prefix}."
+            )
+    if not sources.empty():
+        source_index, _ = sources.get()
+        raise Exception(
+            f"The source and reference sentences of {datasets[source_index].dataset_prefix} "
+            "don't have the same number of lines."
+        )
+
+    results = [[bleu.details(), chrf.details(), "skipped"] for bleu, chrf, _, _ in dataset_metrics]
+
+    if comet_worker:
+        logger.info("Waiting for the COMET scores.")
+        comet_scores = comet_worker.finish()
+        for dataset_index, result in enumerate(results):
+            result[2] = comet_scores.get(dataset_index, "skipped")
+
+    return [tuple(result) for result in results]
+
+
+def write_metrics(
+    dataset: Dataset, bleu_details: dict, chrf_details: dict, comet_score: Union[float, str]
+) -> None:
+    metrics = {
+        "bleu": {
+            "score": bleu_details["score"],
+            # Example details:
+            # {
+            #     "name": "BLEU",
+            #     "score": 0.4,
+            #     "signature": "nrefs:1|case:mixed|eff:no|tok:13a|smooth:exp|version:2.0.0",
+            #     "verbose_score": "15.6/0.3/0.2/0.1 (BP = 0.823 ratio = 0.837 hyp_len = 180 ref_len = 215)",
+            #     "nrefs": "1",
+            #     "case": "mixed",
+            #     "eff": "no",
+            #     "tok": "13a",
+            #     "smooth": "exp",
+            #     "version": "2.0.0"
+            # }
+            "details": bleu_details,
+        },
+        "chrf": {
+            "score": chrf_details["score"],
+            # Example details:
+            # {
+            #     "name": "chrF2",
+            #     "score": 0.64,
+            #     "signature": "nrefs:1|case:mixed|eff:yes|nc:6|nw:0|space:no|version:2.0.0",
+            #     "nrefs": "1",
+            #     "case": "mixed",
+            #     "eff": "yes",
+            #     "nc": "6",
+            #     "nw": "0",
+            #     "space": "no",
+            #     "version": "2.0.0"
+            # }
+            "details": chrf_details,
+        },
+        "comet": {
+            "score": comet_score,
+            "details": {
+                "model": COMET_MODEL_NAME,
+                "score": comet_score,
+            },
+        },
+    }
+
+    logger.info(f"Writing {dataset.metrics_json}")
+    with open(dataset.metrics_json, "w") as file:
+        file.write(json.dumps(metrics, indent=2))
+
+    logger.info(f'Writing the metrics in the older "text" format: {dataset.metrics_file}')
+    with open(dataset.metrics_file, "w") as file:
+        file.write(f"{bleu_details['score']}\n" f"{chrf_details['score']}\n" f"{comet_score}\n")
+
+
 def main(args_list: Optional[list[str]] = None) -> None:
     parser = argparse.ArgumentParser(
         description=__doc__,
@@ -98,10 +582,14 @@ def main(args_list: Optional[list[str]] = None) -> None:
     parser.add_argument(
         "--artifacts_prefix",
         type=str,
-        help="The location where the translated results will be saved",
+        nargs="+",
+        help="The location where the translated results will be saved, one per dataset prefix.",
     )
     parser.add_argument(
-        "--dataset_prefix", type=str, help="The evaluation datasets prefix, used in the form."
+        "--dataset_prefix",
+        type=str,
+        nargs="+",
+        help="The evaluation datasets prefix, used in the form.",
     )
     parser.add_argument("--src", type=str, help='The source language, e.g "en".')
     parser.add_argument("--trg", type=str, help='The target language, e.g "ca".')
@@ -145,6 +633,12 @@ def main(args_list: Optional[list[str]] = None) -> None:
     parser.add_argument(
         "--model_variant", type=str, help="The model variant to use, (gpu, cpu, quantized)"
     )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Translate all of the datasets with a single Marian process, and compute the "
+        "metrics while the translations stream in.",
+    )
 
     # Add Weight & Biases CLI args when module is loaded
     if WANDB_AVAILABLE:
@@ -152,22 +646,19 @@ def main(args_list: Optional[list[str]] = None) -> None:
 
     args = parser.parse_args(args_list)
 
-    src = args.src
-    trg = args.trg
-    dataset_prefix = args.dataset_prefix
-    artifacts_prefix = args.artifacts_prefix
-
-    artifacts_dir = os.path.dirname(artifacts_prefix)
-    source_file_compressed = f"{dataset_prefix}.{src}.zst"
-    source_file = f"{artifacts_prefix}.{src}"
-    target_file_compressed = f"{dataset_prefix}.{trg}.zst"
-    target_file = f"{artifacts_prefix}.{trg}"
-    target_ref_file = f"{artifacts_prefix}.{trg}.ref"
+    if len(args.dataset_prefix) != len(args.artifacts_prefix):
+        raise Exception("There must be an --artifacts_prefix for each --dataset_prefix")
+    datasets = [
+        Dataset(dataset_prefix, artifacts_prefix, args.src, args.trg)
+        for dataset_prefix, artifacts_prefix in zip(args.dataset_prefix, args.artifacts_prefix)
+    ]
+    if WANDB_AVAILABLE and args.wandb_publication and len(datasets) > 1:
+        # The published metrics are attributed to the dataset of the task label.
+        raise Exception("Multiple datasets can't be evaluated when publishing to W&B")
+
+    artifacts_dirs = sorted({os.path.dirname(dataset.artifacts_prefix) for dataset in datasets})
     marian_decoder = f'"{args.marian}"/marian-decoder'
-    marian_log_file = f"{artifacts_prefix}.log"
-    language_pair = f"{src}-{trg}"
-    metrics_file = f"{artifacts_prefix}.metrics"
-    metrics_json = f"{artifacts_prefix}.metrics.json"
+    language_pair = f"{args.src}-{args.trg}"
 
     # Configure Marian for the different model variants.
     marian_extra_args = []
@@ -195,155 +686,42 @@ def main(args_list: Optional[list[str]] = None) -> None:
         marian_extra_args = marian_extra_args + ["--shortlist", args.shortlist]
 
     logger.info("The eval script is configured with the following:")
-    logger.info(f" >          artifacts_dir: {artifacts_dir}")
-    logger.info(f" > source_file_compressed: {source_file_compressed}")
-    logger.info(f" >            source_file: {source_file}")
-    logger.info(f" >            target_file: {target_file}")
-    logger.info(f" >        target_ref_file: {target_ref_file}")
+    logger.info(f" >          artifacts_dir: {', '.join(artifacts_dirs)}")
+    for dataset in datasets:
+        logger.info(f" > source_file_compressed: {dataset.source_file_compressed}")
+        logger.info(f" >            source_file: {dataset.source_file}")
+        logger.info(f" >            target_file: {dataset.target_file}")
+        logger.info(f" >        target_ref_file: {dataset.target_ref_file}")
+        logger.info(f" >        marian_log_file: {dataset.marian_log_file}")
+        logger.info(f" >           metrics_file: {dataset.metrics_file}")
+        logger.info(f" >           metrics_json: {dataset.metrics_json}")
     logger.info(f" >         marian_decoder: {marian_decoder}")
-    logger.info(f" >        marian_log_file: {marian_log_file}")
     logger.info(f" >          language_pair: {language_pair}")
-    logger.info(f" >           metrics_file: {metrics_file}")
-    logger.info(f" >           metrics_json: {metrics_json}")
     logger.info(f" >      marian_extra_args: {marian_extra_args}")
     logger.info(f" >                   gpus: {args.gpus}")
+    logger.info(f" >              streaming: {args.streaming}")
 
     logger.info("Ensure that the artifacts directory exists.")
-    os.makedirs(artifacts_dir, exist_ok=True)
-
-    logger.info("Save the original target sentences to the artifacts")
+    for artifacts_dir in artifacts_dirs:
+        os.makedirs(artifacts_dir, exist_ok=True)
 
     assert_gpus_available(logger)
 
-    decompress_file(target_file_compressed, keep_original=False, decompressed_path=target_ref_file)
-
-    run_bash_oneliner(
-        f"""
-        # Decompress the source file, e.g. $fetches/wmt09.en.zst
-        zstdmt -dc "{source_file_compressed}"
-
-        # Tee the source file into the artifacts directory, e.g. $artifacts/wmt09.en
-        | tee "{source_file}"
-
-        # Take the source and pipe it in to be decoded (translated) by Marian.
-        | {marian_decoder}
-            --models {args.models}
-            --config {args.marian_config}
-            --quiet
-            --quiet-translation
-            --log {marian_log_file}
-            {" ".join(marian_extra_args)}
-
-        # The translations be "tee"ed out to the artifacts, e.g. $artifacts/wmt09.ca
-        | tee "{target_file}"
-        """
-    )
-
-    with open(target_ref_file, "r") as file:
-        target_ref_lines = file.readlines()
-    with open(target_file, "r") as file:
-        target_lines = file.readlines()
-    with open(source_file, "r") as file:
-        source_lines = file.readlines()
-
-    compute_bleu = BLEU(trg_lang=trg)
-    compute_chrf = CHRF()
-
-    logger.info("Computing the BLEU score.")
-    bleu_score: BLEUScore = compute_bleu.corpus_score(target_lines, [target_ref_lines])
-    bleu_details = json.loads(
-        bleu_score.format(signature=compute_bleu.get_signature().format(), is_json=True)
-    )
-
-    logger.info("Computing the chrF score.")
-    chrf_score: CHRFScore = compute_chrf.corpus_score(target_lines, [target_ref_lines])
-    chrf_details = json.loads(
-        chrf_score.format(signature=compute_chrf.get_signature().format(), is_json=True)
-    )
-
-    # The default comet model.
-    # It should match the model used in https://github.com/mozilla/firefox-translations-models/
-    comet_model_name = "Unbabel/wmt22-comet-da"
-
-    if os.environ.get("COMET_SKIP"):
-        comet_score = "skipped"
+    comet_skip = bool(os.environ.get("COMET_SKIP"))
+    if comet_skip:
         print("COMET_SKIP was set, so the COMET score will not be computed.")
-    else:
-        logger.info("Loading COMET")
-        import comet
 
-        # COMET_MODEL_DIR allows tests to place the model in a data directory
-        comet_checkpoint = comet.download_model(
-            comet_model_name, saving_directory=os.environ.get("COMET_MODEL_DIR")
-        )
-        comet_model = comet.load_from_checkpoint(comet_checkpoint)
-        comet_data = []
-        for source, target, target_ref in zip(source_lines, target_lines, target_ref_lines):
-            comet_data.append({"src": source, "mt": target, "ref": target_ref})
-        # GPU information comes in the form of a list of numbers, e.g. "0 1 2 3". Split these to
-        # get the GPU count.
-        gpu_count = len(args.gpus.split(" "))
-        if os.environ.get("COMET_CPU"):
-            gpu_count = 0  # Let tests override the CPU count.
-        comet_mode = "cpu" if gpu_count == 0 else "gpu"
-        logger.info(f'Computing the COMET score with "{comet_model_name}" using the {comet_mode}')
-
-        comet_results = comet_model.predict(comet_data, gpus=gpu_count)
-        # Reduce the precision.
-        comet_score = round(comet_results.system_score, 4)
-
-    metrics = {
-        "bleu": {
-            "score": bleu_details["score"],
-            # Example details:
-            # {
-            #     "name": "BLEU",
-            #     "score": 0.4,
-            #     "signature": "nrefs:1|case:mixed|eff:no|tok:13a|smooth:exp|version:2.0.0",
-            #     "verbose_score": "15.6/0.3/0.2/0.1 (BP = 0.823 ratio = 0.837 hyp_len = 180 ref_len = 215)",
-            #     "nrefs": "1",
-            #     "case": "mixed",
-            #     "eff": "no",
-            #     "tok": "13a",
-            #     "smooth": "exp",
-            #     "version": "2.0.0"
-            # }
-            "details": bleu_details,
-        },
-        "chrf": {
-            "score": chrf_details["score"],
-            # Example details:
-            # {
-            #     "name": "chrF2",
-            #     "score": 0.64,
-            #     "signature": "nrefs:1|case:mixed|eff:yes|nc:6|nw:0|space:no|version:2.0.0",
-            #     "nrefs": "1",
-            #     "case": "mixed",
-            #     "eff": "yes",
-            #     "nc": "6",
-            #     "nw": "0",
-            #     "space": "no",
-            #     "version": "2.0.0"
-            # }
-            "details": chrf_details,
-        },
-        "comet": {
-            "score": comet_score,
-            "details": {
-                "model": comet_model_name,
-                "score": comet_score,
-            },
-        },
-    }
+    evaluate = evaluate_streaming if args.streaming else evaluate_sequentially
+    results = evaluate(datasets, marian_decoder, args, marian_extra_args, comet_skip)
 
-    logger.info(f"Writing {metrics_json}")
-    with open(metrics_json, "w") as file:
-        file.write(json.dumps(metrics, indent=2))
+    for dataset, (bleu_details, chrf_details, comet_score) in zip(datasets, results):
+        write_metrics(dataset, bleu_details, chrf_details, comet_score)
 
-    logger.info(f'Writing the metrics in the older "text" format: {metrics_file}')
-    with open(metrics_file, "w") as file:
-        file.write(f"{bleu_details['score']}\n" f"{chrf_details['score']}\n" f"{comet_score}\n")
+    if WANDB_AVAILABLE and len(datasets) > 1:
+        # Multiple datasets are only evaluated when the W&B publication is disabled.
+        return
 
+    bleu_details, chrf_details, comet_score = results[0]
     if WANDB_AVAILABLE:
         metric = metric_from_tc_context(
             chrf=chrf_details["score"], bleu=bleu_details["score"], comet=comet_score
@@ -1,24 +1,53 @@
 """
 Run an LLM to evaluate a repo.
+
+The translations are sent in batches to the API. The batches are sized from an estimate of their
+prompt tokens, and are evaluated concurrently while staying under a tokens per minute budget.
+Each evaluated batch is checkpointed to the artifacts, so that an interrupted run can be resumed
+without paying for the same batches again.
+
+With a --cache_dir, the scores of each example are also cached across runs, see llm_cache.py.
+Only the examples that aren't in the cache are sent to the API.
+
+Example:
+    python pipeline/eval/llm.py \\
+        --corpus_src data/wmt24.en.zst \\
+        --corpus_trg data/wmt24.ru.zst \\
+        --corpus_ref data/wmt24.ref.zst \\
+        --model_service mozilla --artifacts artifacts --src en --trg ru \\
+        --concurrency 8 --tokens_per_minute 200000
 """
 
 import argparse
+import asyncio
+import hashlib
 import time
 import json
 import taskcluster
 import json5
 import os
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Optional
-from openai import OpenAI
+from typing import Any, Iterable, Optional
+from openai import AsyncOpenAI
 from pipeline.common.downloads import read_lines
 from pipeline.common.logging import get_logger
+from pipeline.eval.llm_cache import ScoreCache
 
 logger = get_logger(__file__)
 
+# A rough estimate of the bytes per token, to size the batches and reserve the rate limit before
+# the actual usage is known.
+BYTES_PER_TOKEN = 4
+# The expected output tokens of the evaluation of a single example, and of the batch summary.
+OUTPUT_TOKENS_PER_EXAMPLE = 150
+OUTPUT_TOKENS_PER_SUMMARY = 300
+# The client retries rate limited and failed requests with an exponential backoff.
+API_MAX_RETRIES = 5
+
 
 class Config:
-    def __init__(self) -> None:
+    def __init__(self, args_list: Optional[list[str]] = None) -> None:
         parser = argparse.ArgumentParser(
             description=__doc__,
             # Preserves whitespace in the help text.
@@ -68,13 +97,45 @@ class Config:
             "--max_count", default=None, type=int, help="The maximum sentences to use"
         )
         parser.add_argument(
-            "--api_batch_size", default=10, type=int, help="How many sentences to send in per call"
+            "--api_batch_size",
+            default=10,
+            type=int,
+            help="The maximum number of sentences to send in per call",
+        )
+        parser.add_argument(
+            "--max_batch_tokens",
+            default=2_000,
+            type=int,
+            help="The estimated prompt tokens of a batch, before the instructions. Batches of long "
+            "sentences are made smaller to stay under this budget.",
+        )
+        parser.add_argument(
+            "--concurrency", default=8, type=int, help="How many calls are made concurrently"
+        )
+        parser.add_argument(
+            "--tokens_per_minute",
+            default=200_000,
+            type=int,
+            help="The budget of input and output tokens per minute for the API calls",
+        )
+        parser.add_argument(
+            "--base_url",
+            default=None,
+            type=str,
+            help="An OpenAI compatible API to use instead of the default one",
+        )
+        parser.add_argument(
+            "--cache_dir",
+            default=os.environ.get("LLM_EVAL_CACHE_DIR"),
+            type=Path,
+            help="A directory to cache the scores of each example in, so that re-runs only "
+            "evaluate the new examples. Defaults to $LLM_EVAL_CACHE_DIR.",
         )
         parser.add_argument(
             "--mini", action="store_true", help="Use the mini model for faster results"
         )
 
-        args = parser.parse_args()
+        args = parser.parse_args(args_list)
 
         self.corpus_src = args.corpus_src
         self.corpus_trg = args.corpus_trg
@@ -85,19 +146,29 @@ class Config:
         self.mini: str = args.mini
         self.max_count: Optional[int] = args.max_count
         self.api_batch_size: Optional[int] = args.api_batch_size
+        self.max_batch_tokens: int = args.max_batch_tokens
+        self.concurrency: int = args.concurrency
+        self.tokens_per_minute: int = args.tokens_per_minute
+        self.base_url: Optional[str] = args.base_url
+        self.checkpoint_path: Path = self.artifacts / "checkpoint.jsonl"
+        self.cache_dir: Optional[Path] = args.cache_dir
 
         # https://platform.openai.com/docs/pricing
         if args.mini:
-            self.input_cost = 2.50 / 1_000_000
-            self.output_cost = 10.00 / 1_000_000
+            self.input_cost = 0.15 / 1_000_000
+            self.output_cost = 0.60 / 1_000_000
             self.model = "gpt-4o-mini"
         else:
-            self.input_cost = 0.15 / 1_000_000
-            self.output_cost = 10.60 / 1_000_000
+            self.input_cost = 2.50 / 1_000_000
+            self.output_cost = 10.00 / 1_000_000
             self.model = "gpt-4o"
 
 
-def yield_batched_translations(config: Config):
+def estimate_tokens(text: str) -> int:
+    return len(text.encode("utf-8")) // BYTES_PER_TOKEN + 1
+
+
+def read_translations(config: Config) -> list[dict[str, str]]:
     translations: list[dict[str, str]] = []
 
     with (
@@ -105,7 +176,6 @@ def yield_batched_translations(config: Config):
         read_lines(config.corpus_trg) as corpus_trg,
         read_lines(config.corpus_ref) as corpus_ref,
     ):
-        batch_size = 0
         for i, (src_line, trg_line, ref_line) in enumerate(
             zip(corpus_src, corpus_trg, corpus_ref)
         ):
@@ -120,14 +190,32 @@ def yield_batched_translations(config: Config):
                 }
             )
 
-            batch_size += 1
-            if batch_size == config.api_batch_size:
-                yield translations
-                translations = []
-                batch_size = 0
+    return translations
+
+
+def yield_batched_translations(config: Config, translations: Iterable[dict[str, str]]):
+    """
+    Batch the translations up to the api_batch_size, closing a batch early when adding another
+    example would go over the max_batch_tokens estimate.
+    """
+    batch: list[dict[str, str]] = []
+    batch_tokens = 0
+    for translation in translations:
+        tokens = estimate_tokens(translations_batch_to_text([translation]))
+        if batch and batch_tokens + tokens > config.max_batch_tokens:
+            yield batch
+            batch = []
+            batch_tokens = 0
+
+        batch.append(translation)
+        batch_tokens += tokens
+        if len(batch) == config.api_batch_size:
+            yield batch
+            batch = []
+            batch_tokens = 0
 
-        if translations:
-            yield translations
+    if batch:
+        yield batch
 
 
 def translations_batch_to_text(translations: list[dict[str, str]]) -> str:
@@ -148,23 +236,128 @@ def translations_batch_to_text(translations: list[dict[str, str]]) -> str:
     return input
 
 
-def run_eval_batch_prompt(
-    client: OpenAI,
+class TokenRateLimiter:
+    """
+    A token bucket of the API tokens per minute, shared by the concurrent calls. The tokens of a
+    call are reserved from an estimate, and the reservation is corrected with the actual usage.
+    """
+
+    def __init__(self, tokens_per_minute: int) -> None:
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: int) -> None:
+        # A call larger than the whole budget waits for a full bucket rather than forever.
+        tokens = min(tokens, self.capacity)
+        # The lock makes the calls wait in turn, so that large calls aren't starved.
+        async with self.lock:
+            self._refill()
+            while self.available < tokens:
+                await asyncio.sleep((tokens - self.available) / self.rate)
+                self._refill()
+            self.available -= tokens
+
+    def correct(self, reserved: int, used: int) -> None:
+        self._refill()
+        self.available = min(self.capacity, self.available + reserved - used)
+
+
+@dataclass
+class BatchResult:
+    translations: list[dict[str, str]]
+    eval_batch: Optional[dict]
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+
+class Checkpoint:
+    """
+    Record the evaluated batches in a JSON lines file, keyed on the digest of the model, the
+    instructions and the translations of the batch. Only successful evaluations are recorded,
+    so failed batches are retried when resuming.
+    """
+
+    def __init__(self, path: Path, model: str, instructions: str) -> None:
+        self.path = path
+        self.model = model
+        self.instructions = instructions
+        self.batches: dict[str, dict] = {}
+        if path.exists():
+            with path.open("r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last line can be truncated when the run was interrupted.
+                        continue
+                    self.batches[entry["key"]] = entry
+            logger.info(f"Resuming from {len(self.batches)} checkpointed batches in {path}")
+
+    def key(self, translations: list[dict[str, str]]) -> str:
+        digest = hashlib.sha256()
+        for part in (self.model, self.instructions, json.dumps(translations, sort_keys=True)):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, translations: list[dict[str, str]]) -> Optional[dict]:
+        entry = self.batches.get(self.key(translations))
+        return entry["eval_batch"] if entry else None
+
+    def add(self, result: BatchResult) -> None:
+        entry = {
+            "key": self.key(result.translations),
+            "eval_batch": result.eval_batch,
+            "input_tokens": result.input_tokens,
+            "output_tokens": result.output_tokens,
+        }
+        self.batches[entry["key"]] = entry
+        with self.path.open("a", encoding="utf-8") as file:
+            file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def clean_output_text(output_text: str) -> str:
+    """
+    Do any string cleanup for LLM output that doesn't quite match our specification.
+    """
+    if output_text.startswith("```json\n"):
+        start = len("```json\n")
+        end = len("\n```")
+        output_text = output_text[start:-end]
+    return output_text
+
+
+async def run_eval_batch_prompt(
+    client: AsyncOpenAI,
     translations: list[dict[str, str]],
     config: Config,
     instructions: str,
     batch_index: int,
-):
-    start = time.time()
+    rate_limiter: TokenRateLimiter,
+) -> BatchResult:
     input = translations_batch_to_text(translations)
     retry_count = 5
+    result = BatchResult(translations, eval_batch=None)
 
     # Attempt to pares the JSON evaluations.
     eval_batch: dict | None = None
     output_text = ""
     output_text_raw = ""
 
-    usages = []
+    reserved_tokens = (
+        estimate_tokens(instructions)
+        + estimate_tokens(input)
+        + OUTPUT_TOKENS_PER_EXAMPLE * len(translations)
+        + OUTPUT_TOKENS_PER_SUMMARY
+    )
 
     for attempt in range(retry_count):
         if attempt == 0:
@@ -177,9 +370,14 @@ def run_eval_batch_prompt(
             # Increase the temperature so that the results will be varied on the second
             # attempt.
             temperature = 0.5
-            logger.info(f"Retry {attempt+1}/{retry_count}: The last query failed to parse.")
+            logger.info(
+                f"Batch {batch_index} retry {attempt+1}/{retry_count}: "
+                "The last query failed to parse."
+            )
 
-        response = client.responses.create(
+        await rate_limiter.acquire(reserved_tokens)
+        start = time.time()
+        response = await client.responses.create(
             model=config.model,
             instructions=instructions,
             input=input,
@@ -190,19 +388,19 @@ def run_eval_batch_prompt(
 
         usage = response.usage
         if usage:
-            usages.append(usage)
-            logger.info(f" ├─ Input tokens: {usage.input_tokens}")
-            logger.info(f" ├─ Output tokens: {usage.output_tokens}")
-        logger.info(f" └─ Query took {call_time:.2f} seconds")
+            rate_limiter.correct(reserved_tokens, usage.input_tokens + usage.output_tokens)
+            result.input_tokens += usage.input_tokens
+            result.output_tokens += usage.output_tokens
+            logger.info(
+                f"Batch {batch_index} took {call_time:.2f} seconds, "
+                f"{usage.input_tokens} input tokens, {usage.output_tokens} output tokens"
+            )
+        else:
+            logger.info(f"Batch {batch_index} took {call_time:.2f} seconds")
 
         output_text = response.output_text.strip()
         output_text_raw = output_text
-
-        # Do any string cleanup for LLM output that doesn't quite match our specification.
-        if output_text.startswith("```json\n"):
-            start = len("```json\n")
-            end = len("\n```")
-            output_text = output_text[start:-end]
+        output_text = clean_output_text(output_text)
 
         try:
             # Parse with json5 as the content can have trailing commas which will not parse
@@ -241,16 +439,58 @@ def run_eval_batch_prompt(
                     json.dump(eval_batch, file, indent=2)
             eval_batch = None
 
-    return eval_batch, usages
+    result.eval_batch = eval_batch
+    return result
 
 
-def run_eval_final_summary(
-    client: OpenAI, config: Config, instructions: str, summaries: list[dict]
+async def run_eval_batches(
+    client: AsyncOpenAI,
+    batches: Iterable[list[dict[str, str]]],
+    config: Config,
+    instructions: str,
+    checkpoint: Checkpoint,
+    rate_limiter: TokenRateLimiter,
+) -> list[BatchResult]:
+    """
+    Evaluate the batches with a bounded number of concurrent calls. The results are returned
+    in the order of the batches.
+    """
+    semaphore = asyncio.Semaphore(config.concurrency)
+
+    async def run_batch(batch_index: int, translations: list[dict[str, str]]) -> BatchResult:
+        eval_batch = checkpoint.get(translations)
+        if eval_batch:
+            logger.info(f"Batch {batch_index} was restored from the checkpoint.")
+            return BatchResult(translations, eval_batch)
+
+        async with semaphore:
+            result = await run_eval_batch_prompt(
+                client, translations, config, instructions, batch_index, rate_limiter
+            )
+        if result.eval_batch:
+            checkpoint.add(result)
+        return result
+
+    return await asyncio.gather(
+        *(run_batch(batch_index, translations) for batch_index, translations in enumerate(batches))
+    )
+
+
+async def run_eval_final_summary(
+    client: AsyncOpenAI,
+    config: Config,
+    instructions: str,
+    summaries: list[dict],
+    rate_limiter: TokenRateLimiter,
 ):
-    start = time.time()
     logger.info(f"Querying {config.model} for the final evaluation summary.")
     input = json.dumps(summaries, indent=2)
-    response = client.responses.create(
+    reserved_tokens = (
+        estimate_tokens(instructions) + estimate_tokens(input) + OUTPUT_TOKENS_PER_SUMMARY
+    )
+    await rate_limiter.acquire(reserved_tokens)
+    start = time.time()
+    response = await client.responses.create(
         model=config.model,
         instructions=instructions,
         input=input,
@@ -259,12 +499,7 @@ def run_eval_final_summary(
     call_time = time.time() - start
     output_text = response.output_text.strip()
     output_text_raw = output_text
-
-    # Do any string cleanup for LLM output that doesn't quite match our specification.
-    if output_text.startswith("```json\n"):
-        start = len("```json\n")
-        end = len("\n```")
-        output_text = output_text[start:-end]
+    output_text = clean_output_text(output_text)
 
     # Attempt to pares the evalulation.
     summary: dict | None = None
@@ -289,6 +524,7 @@ def run_eval_final_summary(
 
     usage = response.usage
     if usage:
+        rate_limiter.correct(reserved_tokens, usage.input_tokens + usage.output_tokens)
         logger.info(f" ├─ Input tokens: {usage.input_tokens}")
         logger.info(f" ├─ Output tokens: {usage.output_tokens}")
     logger.info(f" └─ Query took {call_time:.2f} seconds")
@@ -317,10 +553,11 @@ def get_open_ai_key() -> str:
         raise Exception(f"Could not retrieve the OpenAI secret key: {e}")
 
 
-def main() -> None:
-    config = Config()
-
-    client = OpenAI(api_key=get_open_ai_key())
+async def evaluate(config: Config) -> None:
+    client = AsyncOpenAI(
+        api_key=get_open_ai_key(), base_url=config.base_url, max_retries=API_MAX_RETRIES
+    )
+    rate_limiter = TokenRateLimiter(config.tokens_per_minute)
 
     config.artifacts.mkdir(exist_ok=True)
 
@@ -330,37 +567,99 @@ def main() -> None:
     with open(Path(__file__).parent / "eval-final-summary.md", "r") as file:
         eval_final_summary = file.read().format(src=config.src, trg=config.trg)
 
-    score_results: list[dict] = []
+    translations = read_translations(config)
+
+    # Look up the examples in the score cache, only the other ones are evaluated.
+    score_cache = (
+        ScoreCache(config.cache_dir, config.model, eval_batch_instructions)
+        if config.cache_dir
+        else None
+    )
+    cached_entries: dict[int, dict] = {}
+    if score_cache:
+        for index, translation in enumerate(translations):
+            entry = score_cache.get(translation)
+            if entry:
+                cached_entries[index] = entry
+    uncached = [
+        translation
+        for index, translation in enumerate(translations)
+        if index not in cached_entries
+    ]
+
+    checkpoint = Checkpoint(config.checkpoint_path, config.model, eval_batch_instructions)
+    results = await run_eval_batches(
+        client,
+        yield_batched_translations(config, uncached),
+        config,
+        eval_batch_instructions,
+        checkpoint,
+        rate_limiter,
+    )
+
+    # The scores of the evaluated examples, in the order of the uncached examples. The
+    # examples of a batch that failed to parse are None, and are left out of the scores,
+    # while the examples of a batch that returned fewer scores are kept with no scores.
+    evaluated_scores: list[Optional[dict[str, Optional[dict]]]] = []
     summaries: list[dict] = []
     input_tokens = 0
     output_tokens = 0
-    for batch_index, translations in enumerate(yield_batched_translations(config)):
-        eval_batch, usages = run_eval_batch_prompt(
-            client, translations, config, eval_batch_instructions, batch_index
-        )
-
-        for usage in usages:
-            input_tokens += usage.input_tokens
-            output_tokens += usage.output_tokens
+    for result in results:
+        input_tokens += result.input_tokens
+        output_tokens += result.output_tokens
 
+        eval_batch = result.eval_batch
         if eval_batch:
             summaries.append(eval_batch["summary"])
             scores_list = eval_batch["scores"]
-            for i, translation in enumerate(translations):
-                scores = scores_list[i] if i < len(scores_list) else None
-                score_results.append(
-                    {
-                        "translation": translation,
-                        "scores": scores,
-                    }
+            evaluated_scores.extend(
+                {"scores": scores_list[i] if i < len(scores_list) else None}
+                for i in range(len(result.translations))
+            )
+            if score_cache:
+                score_cache.store(
+                    result.translations, eval_batch, result.input_tokens, result.output_tokens
                 )
+        else:
+            # The examples of a batch that failed to parse are left out of the scores.
+            evaluated_scores.extend([None] * len(result.translations))
+
+    score_results: list[dict] = []
+    cached_batches: list[str] = []
+    evaluated_iter = iter(evaluated_scores)
+    for index, translation in enumerate(translations):
+        entry = cached_entries.get(index)
+        if entry:
+            scores = entry["scores"]
+            if entry["batch"] not in cached_batches:
+                cached_batches.append(entry["batch"])
+        else:
+            evaluated = next(evaluated_iter)
+            if evaluated is None:
+                continue
+            scores = evaluated["scores"]
+        score_results.append(
+            {
+                "translation": translation,
+                "scores": scores,
+            }
+        )
+
+    # The final summary is built from the summaries of the cached batches too.
+    if score_cache:
+        for batch_key in cached_batches:
+            batch_summary = score_cache.get_summary(batch_key)
+            if batch_summary:
+                summaries.append(batch_summary)
 
     scores_path = config.artifacts / "scores.json"
     logger.info(f"Outputing the scores to {scores_path}")
     with scores_path.open("w") as outfile:
         json.dump(score_results, outfile, ensure_ascii=False, indent=2)
 
-    summary, usage = run_eval_final_summary(client, config, eval_final_summary, summaries)
+    summary, usage = await run_eval_final_summary(
+        client, config, eval_final_summary, summaries, rate_limiter
+    )
     if usage:
         input_tokens += usage.input_tokens
         output_tokens += usage.output_tokens
@@ -376,6 +675,13 @@ def main() -> None:
     logger.info(f" ├─ Input cost: ${config.input_cost * input_tokens:.2f}")
     logger.info(f" └─ Output cost: ${config.output_cost * output_tokens:.2f}")
 
+    if score_cache:
+        score_cache.log_stats(config.input_cost, config.output_cost)
+
+
+def main(args: Optional[list[str]] = None) -> None:
+    asyncio.run(evaluate(Config(args)))
+
 
 if __name__ == "__main__":
     main()
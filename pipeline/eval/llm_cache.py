@@ -0,0 +1,157 @@
+"""
+A content-addressed cache of the LLM evaluation scores.
+
+The LLM evaluation can be re-run on the same translations, for instance after a change to the
+final summary prompt. This cache stores the scores of each example keyed on the model, the
+digest of the batch instructions and the example itself (src, trg, ref), so that only the
+examples that weren't evaluated yet are sent to the API.
+
+cache_dir
+├── examples
+│   └── 3f
+│       └── 3f1c5a...e9.json
+└── summaries
+    └── 8ab02d...17.json
+
+An example entry holds the scores, the key of the batch it was evaluated in, and its share of
+the tokens of that batch, which is used to report the saved cost:
+
+    {
+      "scores": {"adequacy": [5, ""], ...},
+      "batch": "8ab02d...17",
+      "input_tokens": 120.5,
+      "output_tokens": 80.25
+    }
+
+The summaries are the per-batch summaries returned by the LLM, which are needed to build the
+final summary when all the examples of a batch come from the cache.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Optional, Union
+
+from pipeline.common.logging import get_logger
+
+logger = get_logger(__file__)
+
+# Bump this to invalidate all of the existing cache entries, for instance when the format of
+# the scores changes in a way that the instructions digest doesn't capture.
+CACHE_FORMAT_VERSION = 1
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ScoreCache:
+    """
+    Store and retrieve the scores of the evaluated examples from a directory on disk.
+
+    Usage:
+
+        cache = ScoreCache("/path/to/cache", "gpt-4o", instructions)
+        scores = [cache.get(translation) for translation in translations]
+        ...
+        cache.store(batch_translations, eval_batch, input_tokens, output_tokens)
+        cache.log_stats(input_cost, output_cost)
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], model: str, instructions: str) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.model = model
+        self.instructions_digest = hash_text(instructions)
+        self.hits = 0
+        self.misses = 0
+        self.saved_input_tokens = 0.0
+        self.saved_output_tokens = 0.0
+
+    def get_key(self, translation: dict[str, str]) -> str:
+        return hash_text(
+            json.dumps(
+                [
+                    CACHE_FORMAT_VERSION,
+                    self.model,
+                    self.instructions_digest,
+                    translation["src"],
+                    translation["trg"],
+                    translation["ref"],
+                ],
+                ensure_ascii=False,
+            )
+        )
+
+    def example_path(self, key: str) -> Path:
+        return self.cache_dir / "examples" / key[:2] / f"{key}.json"
+
+    def summary_path(self, batch_key: str) -> Path:
+        return self.cache_dir / "summaries" / f"{batch_key}.json"
+
+    def get(self, translation: dict[str, str]) -> Optional[dict[str, Any]]:
+        """
+        Look up the cached entry of an example, and count the hit or miss.
+        """
+        path = self.example_path(self.get_key(translation))
+        try:
+            with path.open("r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.saved_input_tokens += entry["input_tokens"]
+        self.saved_output_tokens += entry["output_tokens"]
+        return entry
+
+    def get_summary(self, batch_key: str) -> Optional[dict]:
+        path = self.summary_path(batch_key)
+        if not path.exists():
+            return None
+        with path.open("r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def store(
+        self,
+        translations: list[dict[str, str]],
+        eval_batch: dict,
+        input_tokens: int,
+        output_tokens: int,
+    ) -> None:
+        """
+        Add the scores of an evaluated batch. The tokens of the batch are split evenly between
+        its examples.
+        """
+        keys = [self.get_key(translation) for translation in translations]
+        batch_key = hash_text("\n".join(keys))
+        self._write(self.summary_path(batch_key), eval_batch["summary"])
+        for key, scores in zip(keys, eval_batch["scores"]):
+            self._write(
+                self.example_path(key),
+                {
+                    "scores": scores,
+                    "batch": batch_key,
+                    "input_tokens": input_tokens / len(keys),
+                    "output_tokens": output_tokens / len(keys),
+                },
+            )
+
+    def _write(self, path: Path, data: Any) -> None:
+        # Write atomically so that concurrent or killed runs don't leave corrupted entries.
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".json.{os.getpid()}.tmp")
+        with tmp_path.open("w", encoding="utf-8") as file:
+            json.dump(data, file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def log_stats(self, input_cost: float, output_cost: float) -> None:
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        saved_cost = input_cost * self.saved_input_tokens + output_cost * self.saved_output_tokens
+        logger.info("Summary of the score cache")
+        logger.info(f" ├─ Cache hits: {self.hits}/{total} ({hit_rate:.1%})")
+        logger.info(f" ├─ Saved input tokens: {self.saved_input_tokens:.0f}")
+        logger.info(f" ├─ Saved output tokens: {self.saved_output_tokens:.0f}")
+        logger.info(f" └─ Saved cost: ${saved_cost:.2f}")
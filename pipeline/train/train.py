@@ -3,16 +3,21 @@ Run training using Marian and OpusTrainer.
 """
 
 import argparse
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 import filecmp
-from contextlib import ExitStack
+from contextlib import ExitStack, closing
 from enum import Enum
+from itertools import islice
 import json
 import os
 from pathlib import Path
+from queue import Empty, Queue
 import random
 import shutil
 import tempfile
-from typing import Any, Generator, Optional
+import time
+from threading import Event, Thread
+from typing import Any, Generator, Iterable, Optional
 
 import yaml
 
@@ -66,17 +71,133 @@ class BestModelMetric(Enum):
     #   bleu_segmented = "bleu-segmented"
 
 
+# The number of lines that are formatted at a time when building a TSV.
+TSV_BATCH_LINES = 10_000
+# The number of examples of empty alignments that are logged.
+EMPTY_ALIGNMENTS_SAMPLE_SIZE = 50
+
+
+class TsvCompression(Enum):
+    none = "none"
+    gzip = "gzip"
+
+
+class Reservoir:
+    """
+    Keeps a uniform random sample of a bounded size from a stream of items of unknown length.
+    """
+
+    def __init__(self, size: int, rng: Optional[random.Random] = None) -> None:
+        self.size = size
+        self.rng = rng or random.Random()
+        self.count = 0
+        self.items: list[Any] = []
+
+    def add(self, item: Any) -> None:
+        self.count += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+            return
+        index = self.rng.randrange(self.count)
+        if index < self.size:
+            self.items[index] = item
+
+
+def format_tsv_batches(
+    src_lines: Iterable[str],
+    trg_lines: Iterable[str],
+    aln_lines: Optional[Iterable[str]],
+    empty_alignments: Reservoir,
+    batch_lines: int = TSV_BATCH_LINES,
+) -> Generator[str, None, None]:
+    """
+    Join the datasets into TSV lines, yielding the text of a batch of lines at a time. Lines with
+    empty alignments are not written, but are sampled into the reservoir.
+    """
+    if aln_lines is None:
+        rows = zip(src_lines, trg_lines)
+    else:
+        rows = zip(src_lines, trg_lines, aln_lines)
+
+    while batch := list(islice(rows, batch_lines)):
+        if aln_lines is None:
+            yield "".join([f"{src.strip()}\t{trg.strip()}\n" for src, trg in batch])
+            continue
+
+        tsv_lines = []
+        for src_line, trg_line, aln_line in batch:
+            alignment = aln_line.strip()
+            if alignment:
+                tsv_lines.append(f"{src_line.strip()}\t{trg_line.strip()}\t{alignment}\n")
+            else:
+                # do not write lines with empty alignments to TSV, Marian will complain and skip those
+                empty_alignments.add((src_line, trg_line))
+        yield "".join(tsv_lines)
+
+
+def iterate_in_thread(iterable: Iterable[Any], max_queued: int = 8) -> Generator[Any, None, None]:
+    """
+    Consume an iterable in a worker thread, so that producing the items overlaps with the work
+    done on them by the caller. Exceptions from the worker are re-raised to the caller.
+    """
+    items: Queue = Queue(maxsize=max_queued)
+    done = object()
+    stop = Event()
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                items.put(item)
+            items.put(done)
+        except BaseException as exception:
+            items.put(exception)
+
+    thread = Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while (item := items.get()) is not done:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Unblock the worker if it is waiting on a full queue.
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except Empty:
+                pass
+        thread.join()
+
+
+def get_dataset_tsv_path(
+    dataset_prefix: str, src: str, trg: str, compression: TsvCompression = TsvCompression.none
+) -> Path:
+    # OpusTrainer supports only tsv and gzip
+    if compression == TsvCompression.gzip:
+        return Path(f"{dataset_prefix}.{src}{trg}.tsv.gz")
+    return Path(f"{dataset_prefix}.{src}{trg}.tsv")
+
+
 def build_dataset_tsv(
     dataset_prefix: str,
     src: str,
     trg: str,
     alignments_file: Optional[Path] = None,
+    compression: TsvCompression = TsvCompression.none,
+    threads: Optional[int] = None,
 ) -> Path:
     """
     Takes as input a dataset prefix, and combines the datasets into a TSV, removing
     the original files. If an alignments file is provided, any empty alignments will
     be discarded.
 
+    The lines are decompressed and formatted in batches on a worker thread while the main
+    thread writes them out. With gzip compression the output is compressed with multiple
+    threads in-process, as pigz is not installed on the generic Taskcluster worker.
+
     For instance:
         Prefix:
           - path/to/corpus
@@ -87,49 +208,46 @@ def build_dataset_tsv(
           - path/to/corpus.aln.zst
 
         And then builds:
-          - path/to/corpus.enfr.tsv
+          - path/to/corpus.enfr.tsv (or path/to/corpus.enfr.tsv.gz)
     """
+    start_time = time.monotonic()
     src_path = Path(f"{dataset_prefix}.{src}.zst")
     trg_path = Path(f"{dataset_prefix}.{trg}.zst")
-    # OpusTrainer supports only tsv and gzip
-    # TODO: pigz is not installed on the generic Taskcluster worker, so we use datasets in decompressed mode for now
-    tsv_path = Path(f"{dataset_prefix}.{src}{trg}.tsv")  # .gz
+    tsv_path = get_dataset_tsv_path(dataset_prefix, src, trg, compression)
+    # The TSV is moved into place once it's complete, so that a failed build never leaves a
+    # truncated dataset behind.
+    partial_tsv_path = tsv_path.with_name(f"partial.{tsv_path.name}")
+    if compression == TsvCompression.gzip:
+        threads = threads or os.cpu_count()
+
+    empty_alignments = Reservoir(EMPTY_ALIGNMENTS_SAMPLE_SIZE)
 
     with ExitStack() as stack:
-        tsv_outfile = stack.enter_context(write_lines(tsv_path))
+        tsv_outfile = stack.enter_context(write_lines(partial_tsv_path, threads=threads))
         src_lines: Generator[str, Any, Any] = stack.enter_context(read_lines(src_path))
         trg_lines: Generator[str, Any, Any] = stack.enter_context(read_lines(trg_path))
+        aln_lines: Optional[Generator[str, Any, Any]] = None
 
         logger.info(f"Generating tsv dataset: {tsv_path}")
 
         if alignments_file:
             logger.info(f"Using alignments file: {alignments_file}")
+            aln_lines = stack.enter_context(read_lines(f"{alignments_file}"))
 
-            aln_lines: Generator[str, Any, Any] = stack.enter_context(
-                read_lines(f"{alignments_file}")
-            )
-            empty_alignments = []
-
-            for src_line, trg_line, aln_line in zip(src_lines, trg_lines, aln_lines):
-                if aln_line.strip():
-                    tsv_outfile.write(
-                        f"{src_line.strip()}\t{trg_line.strip()}\t{aln_line.strip()}\n"
-                    )
-                else:
-                    # do not write lines with empty alignments to TSV, Marian will complain and skip those
-                    empty_alignments.append((src_line, trg_line))
-
-            if empty_alignments:
-                logger.info(f"Number of empty alignments is {len(empty_alignments)}")
-                logger.info("Sample of empty alignments:")
-                random.shuffle(empty_alignments)
-                for src_line, trg_line in empty_alignments[:50]:
-                    logger.info(f"  src: {src_line.strip()}")
-                    logger.info(f"  trg: {trg_line.strip()}")
+        batches = format_tsv_batches(src_lines, trg_lines, aln_lines, empty_alignments)
+        # Close the worker thread before the files it reads from are closed.
+        for batch in stack.enter_context(closing(iterate_in_thread(batches))):
+            tsv_outfile.write(batch)
 
-        else:
-            for src_line, trg_line in zip(src_lines, trg_lines):
-                tsv_outfile.write(f"{src_line.strip()}\t{trg_line.strip()}\n")
+    if empty_alignments.count:
+        logger.info(f"Number of empty alignments is {empty_alignments.count}")
+        logger.info("Sample of empty alignments:")
+        for src_line, trg_line in empty_alignments.items:
+            logger.info(f"  src: {src_line.strip()}")
+            logger.info(f"  trg: {trg_line.strip()}")
+
+    os.replace(partial_tsv_path, tsv_path)
+    logger.info(f"Built {tsv_path} in {time.monotonic() - start_time:.1f}s")
 
     logger.info("Freeing up disk space after TSV merge.")
     logger.info(f"Removing {src_path}")
@@ -288,6 +406,12 @@ class TrainCLI:
         self.marian_bin = args.marian_dir / "marian"
         self.gpus = args.gpus
         self.workspace = args.workspace
+        self.tsv_compression: TsvCompression = args.tsv_compression
+        self.dataset_processes: Optional[int] = args.dataset_processes
+        self.dataset_executor: Optional[ProcessPoolExecutor] = None
+        # Maps the pending dataset builds to the TSV they produce.
+        self.pending_datasets: dict[Future[Path], Path] = {}
+        self.datasets_start_time = 0.0
         self.config_variables: dict[str, str | int | Path] = {
             "vocab_src": self.src_vocab,
             "vocab_trg": self.trg_vocab,
@@ -318,6 +442,8 @@ class TrainCLI:
         logger.info(f" - marian_bin: {self.marian_bin}")
         logger.info(f" - gpus: {self.gpus}")
         logger.info(f" - workspace: {self.workspace}")
+        logger.info(f" - tsv_compression: {self.tsv_compression.value}")
+        logger.info(f" - dataset_processes: {self.dataset_processes}")
         logger.info(f" - opustrainer_config: {self.opustrainer_config}")
 
     def validate_args(self) -> None:
@@ -339,6 +465,11 @@ class TrainCLI:
                 raise Exception(f"Alignment file could not be found {alignment_file}")
 
     def build_datasets(self) -> None:
+        """
+        Start building the datasets concurrently in a process pool. The TSV paths are known
+        up front, so the OpusTrainer config can be generated while they build. Call
+        `wait_for_datasets` before training.
+        """
         # Start by building the training datasets, e.g.
         #
         #  corpus.enfr.tsv from:
@@ -350,25 +481,69 @@ class TrainCLI:
         #   - fetches/mono.en.zst
         #   - fetches/mono.fr.zst
         #   - fetches/mono.aln.zst
-
-        for index, dataset_prefix in enumerate(self.train_set_prefixes):
-            alignments = None
-            if self.alignments_files:
-                alignments = self.alignments_files[index]
-                self.config_variables[f"dataset{index}"] = build_dataset_tsv(
-                    dataset_prefix, self.src, self.trg, alignments
-                )
-            else:
-                self.config_variables[f"dataset{index}"] = build_dataset_tsv(
-                    dataset_prefix, self.src, self.trg
-                )
-
+        #
         # Then build out the validation set, for instance:
         #
         # devset.enfr.tsv from:
         #  - fetches/devset.en.zst
         #  - fetches/devset.fr.zst
-        self.validation_set = build_dataset_tsv(self.validation_set_prefix, self.src, self.trg)
+        datasets: list[tuple[str, Optional[Path]]] = []
+        for index, dataset_prefix in enumerate(self.train_set_prefixes):
+            alignments = None
+            if self.alignments_files:
+                alignments = self.alignments_files[index]
+            datasets.append((dataset_prefix, alignments))
+            self.config_variables[f"dataset{index}"] = get_dataset_tsv_path(
+                dataset_prefix, self.src, self.trg, self.tsv_compression
+            )
+        datasets.append((self.validation_set_prefix, None))
+        self.validation_set = get_dataset_tsv_path(
+            self.validation_set_prefix, self.src, self.trg, self.tsv_compression
+        )
+
+        processes = self.dataset_processes or len(datasets)
+        # Split the compression threads between the datasets that are built at the same time.
+        threads = max(1, (os.cpu_count() or 1) // processes)
+        logger.info(f"Building {len(datasets)} datasets with {processes} processes")
+
+        self.datasets_start_time = time.monotonic()
+        self.dataset_executor = ProcessPoolExecutor(max_workers=processes)
+        for dataset_prefix, alignments in datasets:
+            future = self.dataset_executor.submit(
+                build_dataset_tsv,
+                dataset_prefix,
+                self.src,
+                self.trg,
+                alignments,
+                self.tsv_compression,
+                threads,
+            )
+            self.pending_datasets[future] = get_dataset_tsv_path(
+                dataset_prefix, self.src, self.trg, self.tsv_compression
+            )
+
+    def wait_for_datasets(self) -> None:
+        """
+        Wait for all of the datasets to be built, and re-raise the first build error.
+        """
+        try:
+            while self.pending_datasets:
+                done, _ = wait(self.pending_datasets, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tsv_path = self.pending_datasets.pop(future)
+                    # Re-raise any errors from the build.
+                    future.result()
+                    elapsed = time.monotonic() - self.datasets_start_time
+                    logger.info(f"Dataset {tsv_path.name} is ready after {elapsed:.1f}s")
+        finally:
+            if self.dataset_executor:
+                # Don't leave the other builds running after an error.
+                self.dataset_executor.shutdown(cancel_futures=True)
+                self.dataset_executor = None
+
+        logger.info(
+            f"All datasets were built in {time.monotonic() - self.datasets_start_time:.1f}s"
+        )
 
     def generate_opustrainer_config(self) -> None:
         # Pass through the TrainCLI values to the function. This makes it easy to unit
@@ -557,12 +732,26 @@ def main() -> None:
         help="Comma separated alignment paths corresponding to each training dataset, or 'None' to train without alignments",
     )
     parser.add_argument("--seed", type=int, help="Random seed")
+    parser.add_argument(
+        "--tsv_compression",
+        type=TsvCompression,
+        choices=TsvCompression,
+        default=TsvCompression(os.environ.get("TSV_COMPRESSION", TsvCompression.none.value)),
+        help="Compress the training TSVs with multiple threads to save disk space. "
+        "Defaults to $TSV_COMPRESSION or none.",
+    )
     parser.add_argument(
         "--teacher_mode",
         type=TeacherMode,
         choices=TeacherMode,
         help="Teacher mode",
     )
+    parser.add_argument(
+        "--dataset_processes",
+        type=int,
+        default=None,
+        help="The number of datasets that are built concurrently. Defaults to all of them.",
+    )
     parser.add_argument(
         "extra_marian_args",
         nargs=argparse.REMAINDER,
@@ -577,6 +766,7 @@ def main() -> None:
         train_cli.validate_args()
         train_cli.build_datasets()
         train_cli.generate_opustrainer_config()
+        train_cli.wait_for_datasets()
         train_cli.run_training()
 
 
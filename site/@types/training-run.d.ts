@@ -45,7 +45,8 @@ export interface ModelConfig {
 
 export interface ModelRun {
   date: string;
-  config: ModelConfig;
+  // The config is left out of the models/index.json, and is loaded from the training run JSON.
+  config?: ModelConfig;
   task_group_id: string;
   task_id: string;
   task_name: string;
@@ -84,6 +85,9 @@ export interface TrainingRun {
   student_exported?: ModelRun;
 
   teacher_ensemble_flores: null;
+
+  // The path of the full training run JSON, only set in the models/index.json.
+  json?: string;
 }
 
 export type ModelName =
@@ -797,10 +797,27 @@ class ModelCardOverlay {
       children: "Training Config",
     });
 
-    create.pre({
+    const { config } = this.modelRun;
+    const pre = create.pre({
       parent: elements.overlayContent,
-      children: jsonToYAML(this.modelRun.config),
+      children: config ? jsonToYAML(config) : "Loading…",
     });
+
+    if (!config && this.trainingRun.json) {
+      // The config isn't part of the index, load it from the full training run.
+      const { modelName } = this.modelReference;
+      fetchJSON(`${STORAGE_URL}/${this.trainingRun.json}`).then(
+        (/** @type {TrainingRun} */ fullTrainingRun) => {
+          const modelConfig = fullTrainingRun[modelName]?.config;
+          this.modelRun.config = modelConfig;
+          pre.innerText = modelConfig ? jsonToYAML(modelConfig) : "";
+        },
+        (error) => {
+          pre.innerText = "The training config could not be loaded.";
+          console.error(error);
+        }
+      );
+    }
   }
 }
 
@@ -819,25 +836,45 @@ async function fetchJSON(url) {
 }
 
 /**
- * Fetches and displays the training runs list.
+ * Builds a table row for a training run.
+ * @param {TrainingRun} trainingRun
+ */
+function buildTrainingRunRow(trainingRun) {
+  try {
+    const row = new TrainingRunRow(trainingRun);
+    row.build();
+  } catch (error) {
+    elements.error.style.display = "block";
+    elements.error.innerText = "Error building training run row.";
+    console.error(error);
+  }
+}
+
+/**
+ * Fetches and displays the training runs list. The compact index has all of the
+ * training runs in a single file, otherwise fall back to fetching each training run.
  * @returns {Promise<TrainingRun[]>}
  */
 async function loadTrainingRuns() {
-  /** @type {TrainingRun[]} */
+  try {
+    /** @type {TrainingRun[]} */
+    const trainingRuns = await fetchJSON(`${STORAGE_URL}/models/index.json`);
+    for (const trainingRun of trainingRuns) {
+      buildTrainingRunRow(trainingRun);
+    }
+    return trainingRuns;
+  } catch (error) {
+    console.warn("Could not load the index, loading every training run", error);
+  }
+
+  /** @type {string[]} */
   const trainingRunListing = await fetchJSON(
     `${STORAGE_URL}/models/listing.json`
   );
   const promises = trainingRunListing.map(async (filename) => {
     /** @type {TrainingRun} */
     const trainingRun = await fetchJSON(`${STORAGE_URL}/${filename}`);
-    try {
-      const row = new TrainingRunRow(trainingRun);
-      row.build();
-    } catch (error) {
-      elements.error.style.display = "block";
-      elements.error.innerText = "Error building training run row.";
-      console.error(error);
-    }
+    buildTrainingRunRow(trainingRun);
     return trainingRun;
   });
   const results = await Promise.allSettled(promises);
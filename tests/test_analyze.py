@@ -1,7 +1,15 @@
+import io
+import json
 import os
+import random
+from collections import Counter
 
+import pytest
+import zstandard
 from fixtures import DataDir, en_sample, ru_sample
 
+from pipeline.data import analyze
+
 
 def test_analyze_mono():
     data_dir = DataDir("test_analyze_mono")
@@ -34,3 +42,131 @@ def test_analyze_corpus():
     assert os.path.isfile(data_dir.join("artifacts/Books_v1.en.distribution-codepoints.png"))
     assert os.path.isfile(data_dir.join("artifacts/Books_v1.ru.distribution-words.png"))
     assert os.path.isfile(data_dir.join("artifacts/Books_v1.ru.distribution-codepoints.png"))
+
+
+def read_histogram(data_dir: DataDir, name: str) -> dict[int, int]:
+    histogram = json.loads(data_dir.read_text(name))
+    assert sum(histogram["bin_counts"]) <= histogram["lines"]
+    return dict(zip(histogram["values"], histogram["counts"]))
+
+
+@pytest.mark.parametrize("processes", [0, 2])
+def test_analyze_histograms(monkeypatch, processes):
+    data_dir = DataDir("test_analyze_histograms")
+    data_dir.mkdir("artifacts")
+    # Add lines that are empty, or that are split on unicode whitespace.
+    extra_lines = "\n\u3000\nno\xa0break\u2028space\n\x1c\x1dfile separators \n\n"
+    en_text = en_sample * 3 + extra_lines
+    ru_text = extra_lines + ru_sample
+    data_dir.create_zst("Books_v1.en.zst", en_text)
+    data_dir.create_file("Books_v1.ru.txt", ru_text)
+
+    # Use small blocks, so that the lines are counted over many of them.
+    monkeypatch.setattr(analyze, "BLOCK_LINES", 17)
+    analyze.main(
+        [
+            "--file_location", data_dir.join("Books_v1.en.zst"),
+            "--output_dir", data_dir.join("artifacts"),
+            "--dataset", "opus_Books/v1",
+            "--language", "en",
+            "--processes", str(processes),
+            "--",
+            "--file_location", data_dir.join("Books_v1.ru.txt"),
+            "--output_dir", data_dir.join("artifacts"),
+            "--dataset", "opus_Books/v1",
+            "--language", "ru",
+        ]  # fmt: skip
+    )
+
+    for language, text in (("en", en_text), ("ru", ru_text)):
+        # The lines are only split on "\n", and include it.
+        lines = io.StringIO(text).readlines()
+        assert read_histogram(
+            data_dir, f"artifacts/Books_v1.{language}.distribution-codepoints.json"
+        ) == Counter(len(line) for line in lines)
+        assert read_histogram(
+            data_dir, f"artifacts/Books_v1.{language}.distribution-words.json"
+        ) == Counter(len(line.split()) for line in lines)
+        assert os.path.isfile(
+            data_dir.join(f"artifacts/Books_v1.{language}.distribution-words.png")
+        )
+
+
+def write_zstd_frames(path: str, text: str, frame_bytes: int) -> None:
+    """Write the text in many zstd frames, like pzstd, with a skippable frame at the start."""
+    data = text.encode("utf-8")
+    compressor = zstandard.ZstdCompressor(write_checksum=True)
+    with open(path, "wb") as file:
+        file.write((0x184D2A50).to_bytes(4, "little") + (3).to_bytes(4, "little") + b"abc")
+        for start in range(0, len(data), frame_bytes):
+            file.write(compressor.compress(data[start : start + frame_bytes]))
+
+
+@pytest.mark.parametrize("cut", [1, 4, 300, 538])
+def test_find_zstd_frames_truncated(cut):
+    data_dir = DataDir("test_find_zstd_frames_truncated")
+    path = data_dir.join("frames.en.zst")
+    write_zstd_frames(path, en_sample * 100, frame_bytes=30_000)
+    with open(path, "rb") as file:
+        data = file.read()
+    # Cut the last frame in its checksum, after its last block, in a block and in its header.
+    with open(path, "wb") as file:
+        file.write(data[: len(data) - cut])
+
+    with pytest.raises(ValueError, match="Truncated zstd frame"):
+        analyze.find_zstd_frames(path)
+
+
+@pytest.mark.parametrize("file_name", ["corpus.en.txt", "corpus.en.zst", "frames.en.zst"])
+def test_analyze_sampled_histograms(file_name):
+    data_dir = DataDir("test_analyze_sampled_histograms")
+    data_dir.mkdir("exact")
+    data_dir.mkdir("sampled")
+    # Vary the lengths of the lines of the samples.
+    rng = random.Random(0)
+    sample_lines = io.StringIO(en_sample + ru_sample).readlines()
+    lines = []
+    for _ in range(40_000):
+        line = rng.choice(sample_lines).rstrip("\n")
+        lines.append(line[: rng.randint(0, len(line))] + "\n")
+    text = "".join(lines)
+    data_dir.create_file("corpus.en.txt", text)
+    data_dir.create_zst("corpus.en.zst", text)
+    write_zstd_frames(data_dir.join("frames.en.zst"), text, frame_bytes=30_000)
+
+    def analyze_file(file_name: str, output_dir: str, *args: str) -> None:
+        analyze.main(
+            [
+                "--file_location", data_dir.join(file_name),
+                "--output_dir", data_dir.join(output_dir),
+                "--dataset", "opus_Books/v1",
+                "--language", "en",
+                *args,
+            ]  # fmt: skip
+        )
+
+    analyze_file("corpus.en.txt", "exact")
+    analyze_file(file_name, "sampled", "--sample_lines", "5000", "--seed", "1")
+
+    for unit in ("codepoints", "words"):
+        name = f"Books_v1.en.distribution-{unit}.json"
+        exact = json.loads(data_dir.read_text(f"exact/{name}"))
+        sampled = json.loads(data_dir.read_text(f"sampled/{name}"))
+        assert "sampled" not in exact
+        assert sampled["lines"] == pytest.approx(len(lines), rel=0.05)
+
+        # The exact fractions of the lines in the bins are within the 95% confidence bounds,
+        # except for a few bins by chance.
+        exact_fractions = [count / exact["lines"] for count in exact["bin_counts"]]
+        bounds = zip(
+            sampled["sampled"]["bin_fractions_low"], sampled["sampled"]["bin_fractions_high"]
+        )
+        outside = [
+            fraction
+            for fraction, (low, high) in zip(exact_fractions, bounds)
+            if not low <= fraction <= high
+        ]
+        assert len(outside) <= 2
+        assert sum(sampled["sampled"]["bin_fractions"]) == pytest.approx(
+            sum(exact_fractions), abs=0.01
+        )
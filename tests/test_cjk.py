@@ -1,9 +1,17 @@
 import json
+import random
 from pathlib import Path
 
+import hanzidentifier
 import pytest
 
-from pipeline.data.cjk import ChineseType, handle_chinese_mono, handle_chinese_parallel
+from pipeline.data.cjk import (
+    ChineseConverter,
+    ChineseType,
+    detect_lines,
+    handle_chinese_mono,
+    handle_chinese_parallel,
+)
 from fixtures import DataDir
 
 traditional = "中文簡繁轉換開源項目，支持詞彙級別的轉換"
@@ -206,3 +214,103 @@ def test_filter_parallel_src(data_dir: DataDir):
     out_texts_en = out_text_en.strip().split("\n")
     assert len(out_texts_en) == 5
     assert texts_en == out_texts_en
+
+
+mixed_lines = [
+    simplified,
+    traditional,
+    non_chinese,
+    traditional + non_chinese,
+    "",
+    simplified + traditional,
+    traditional,
+]
+
+
+@pytest.mark.parametrize("processes", [0, 2])
+@pytest.mark.parametrize("type", [ChineseType.simplified, ChineseType.traditional])
+def test_convert_file_chunks(processes: int, type: ChineseType, data_dir: DataDir):
+    # The last line has no newline.
+    path = data_dir.create_zst("cjk_test.txt.zst", "\n".join(mixed_lines * 3))
+    output_path = Path(data_dir.join("cjk_test.converted.zst"))
+
+    stats = ChineseConverter(processes=processes, chunk_lines=4).convert_file(
+        Path(path), output_path, type
+    )
+
+    # The lines are converted the same way as one by one.
+    converter = ChineseConverter()
+    expected = [
+        line
+        if converter._detect(line) in (ChineseType.none, type)
+        else converter._convert_line(line, type)
+        for line in mixed_lines * 3
+    ]
+    assert data_dir.read_text(output_path) == "\n".join(expected)
+    assert stats.script_conversion.visited == 21
+    assert stats.script_conversion.converted == sum(
+        1 for old, new in zip(mixed_lines * 3, expected) if old != new
+    )
+
+
+@pytest.mark.parametrize("processes", [0, 2])
+def test_filter_parallel_corpus_chunks(processes: int, data_dir: DataDir):
+    zh_path = data_dir.create_zst("cjk_test.zh.zst", "\n".join(mixed_lines * 3) + "\n")
+    en_lines = [f"{non_chinese} {i}" for i in range(21)]
+    en_path = data_dir.create_zst("cjk_test.en.zst", "\n".join(en_lines) + "\n")
+
+    stats = ChineseConverter(processes=processes, chunk_lines=2).filter_parallel_corpus(
+        zh_path=Path(zh_path),
+        other_path=Path(en_path),
+        zh_output_path=Path(data_dir.join("cjk_test.filtered.zh.zst")),
+        other_output_path=Path(data_dir.join("cjk_test.filtered.en.zst")),
+        variant=ChineseType.traditional,
+    )
+
+    # The pairs stay aligned, and in order.
+    zh_lines = mixed_lines * 3
+    kept = [
+        i for i in range(21) if ChineseConverter._detect(zh_lines[i]) == ChineseType.traditional
+    ]
+    assert len(kept) == 9
+    assert data_dir.read_text("cjk_test.filtered.zh.zst").splitlines() == [
+        zh_lines[i] for i in kept
+    ]
+    assert data_dir.read_text("cjk_test.filtered.en.zst").splitlines() == [
+        en_lines[i] for i in kept
+    ]
+    assert stats.script_conversion.visited == 21
+    assert stats.script_conversion.filtered == 12
+
+
+def identify(text: str) -> ChineseType:
+    result = hanzidentifier.identify(text)
+    if result == hanzidentifier.SIMPLIFIED:
+        return ChineseType.simplified
+    if result == hanzidentifier.TRADITIONAL:
+        return ChineseType.traditional
+    if result in (hanzidentifier.BOTH, hanzidentifier.MIXED):
+        return ChineseType.traditional | ChineseType.simplified
+    return ChineseType.none
+
+
+def test_detect_lines_matches_hanzidentifier():
+    rng = random.Random(0)
+    # Chinese characters of the dictionary, other characters, and characters outside of the
+    # Basic Multilingual Plane.
+    characters = [
+        *hanzidentifier.helpers.ALL_CHARACTERS,
+        *"abc ,.\n。○",
+        "\U00020000",
+        "\U0001F600",
+    ]
+    lines = [
+        "".join(rng.choice(characters) for _ in range(rng.randint(0, 8))) for _ in range(5000)
+    ]
+    lines += [*mixed_lines, "", "\n", ""]
+
+    assert detect_lines(lines) == [identify(line) for line in lines]
+    assert [ChineseConverter._detect(line) for line in lines[:100]] == [
+        identify(line) for line in lines[:100]
+    ]
+    assert detect_lines([]) == []
@@ -1,15 +1,32 @@
 import gzip
 import io
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+import os
+import random
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import HTTPServer, SimpleHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from threading import Thread
-from typing import Literal
+from typing import Literal, Optional
 
 import pytest
 import zstandard
 from fixtures import DataDir
 
-from pipeline.common.downloads import compress_file, decompress_file, read_lines, write_lines
+from pipeline.common import downloads
+from pipeline.common.downloads import (
+    DownloadChunkStreamer,
+    ParallelGzipWriter,
+    PartialDownload,
+    RemoteFileInfo,
+    compress_file,
+    decompress_file,
+    location_exists,
+    read_lines,
+    stream_download_to_file,
+    write_lines,
+)
 
 # Content to serve
 line_fixtures = [
@@ -29,6 +46,14 @@ def write_test_content(output_path: str) -> str:
     return output_path
 
 
+@pytest.fixture(autouse=True)
+def new_session(monkeypatch):
+    # The ports of the test servers can be reused, so don't share the cached HEAD requests, nor
+    # the connection pools.
+    monkeypatch.setattr(downloads, "_session", None)
+    monkeypatch.setattr(downloads, "_remote_file_infos", OrderedDict())
+
+
 class CustomHTTPRequestHandler(SimpleHTTPRequestHandler):
     """
     This test fixture serves files locally for easy http request testing.
@@ -211,3 +236,298 @@ def test_decompress_file(compression: str, keep_original: bool):
     data_dir.print_tree()
     assert Path(compressed_file).exists() == keep_original
     assert_matches_test_content(text_file)
+
+
+@pytest.mark.parametrize("lines_count", [0, 1, 100_000])
+def test_write_lines_parallel_gzip(lines_count: int):
+    data_dir = DataDir("test_write_lines_parallel_gzip")
+    file_path = data_dir.join("lines.txt.gz")
+    lines = [f"line {i}\n" for i in range(lines_count)]
+
+    with write_lines(file_path, threads=4) as outfile:
+        for line in lines:
+            outfile.write(line)
+
+    # The file is made of multiple gzip members, which standard readers handle.
+    with gzip.open(file_path, "rt", encoding="utf-8") as file:
+        assert file.read() == "".join(lines)
+    with read_lines(file_path) as read:
+        assert list(read) == lines
+
+
+def test_parallel_gzip_writer_blocks():
+    data_dir = DataDir("test_parallel_gzip_writer_blocks")
+    file_path = data_dir.join("blocks.gz")
+    data = "".join(f"line {i}\n" for i in range(10_000)).encode("utf-8")
+
+    with open(file_path, "wb") as file:
+        # Use a small block size so the data is split into many members.
+        with ParallelGzipWriter(file, threads=3, block_bytes=1000) as writer:
+            for i in range(0, len(data), 777):
+                writer.write(data[i : i + 777])
+        assert writer.blocks_written == -(-len(data) // 1000)
+
+    with gzip.open(file_path, "rb") as file:
+        assert file.read() == data
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the files of a directory, with the support of range requests when enabled, and
+    records the ranges that are requested.
+    """
+
+    supports_ranges = True
+    requested_ranges: list[Optional[str]] = []
+
+    def send_head(self):
+        range_header = self.headers.get("Range")
+        if self.command == "GET":
+            self.requested_ranges.append(range_header)
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+
+        size = os.path.getsize(path)
+        start, end = 0, size
+        if range_header and self.supports_ranges:
+            first, last = range_header.removeprefix("bytes=").split("-")
+            start, end = int(first), int(last) + 1 if last else size
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return io.BytesIO()
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+        else:
+            self.send_response(200)
+        if self.supports_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Last-Modified", "Mon, 05 Oct 2026 10:00:00 GMT")
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+
+        file = open(path, "rb")
+        file.seek(start)
+        return io.BytesIO(file.read(end - start))
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def range_server(monkeypatch):
+    monkeypatch.setattr(downloads, "RANGE_DOWNLOAD_MIN_BYTES", 100_000)
+    monkeypatch.setattr(downloads, "RANGE_DOWNLOAD_PART_BYTES", 30_000)
+    data_dir = DataDir("test_range_download")
+    with open(data_dir.join("archive.zip"), "wb") as file:
+        file.write(random.Random(0).randbytes(250_000))
+
+    RangeRequestHandler.requested_ranges = []
+    handler = partial(RangeRequestHandler, directory=data_dir.path)
+    httpd = ThreadingHTTPServer(("localhost", 0), handler)
+    thread = Thread(target=httpd.serve_forever)
+    thread.start()
+    yield data_dir, f"http://localhost:{httpd.server_address[1]}"
+    httpd.shutdown()
+    thread.join()
+
+
+@pytest.mark.parametrize("supports_ranges", [True, False])
+def test_stream_download_to_file_ranges(range_server, monkeypatch, supports_ranges):
+    data_dir, url = range_server
+    monkeypatch.setattr(RangeRequestHandler, "supports_ranges", supports_ranges)
+    destination = data_dir.join("downloaded.zip")
+
+    stream_download_to_file(f"{url}/archive.zip", destination, connections=3)
+
+    assert Path(destination).read_bytes() == Path(data_dir.join("archive.zip")).read_bytes()
+    if supports_ranges:
+        assert sorted(RangeRequestHandler.requested_ranges) == sorted(
+            f"bytes={start}-{min(start + 30_000, 250_000) - 1}"
+            for start in range(0, 250_000, 30_000)
+        )
+    else:
+        # The server doesn't support ranges, so the file is downloaded in one request.
+        assert RangeRequestHandler.requested_ranges == [None]
+
+
+def test_stream_download_to_file_resumes(range_server):
+    data_dir, url = range_server
+    destination = data_dir.join("downloaded.zip")
+    content = Path(data_dir.join("archive.zip")).read_bytes()
+
+    # A download that was killed after 100,000 bytes.
+    remote_file = RemoteFileInfo(len(content), True, "Mon, 05 Oct 2026 10:00:00 GMT")
+    partial_download = PartialDownload(f"{url}/archive.zip", destination, remote_file, False)
+    partial_download.path.write_bytes(content[:100_000])
+
+    stream_download_to_file(f"{url}/archive.zip", destination)
+
+    assert Path(destination).read_bytes() == content
+    assert RangeRequestHandler.requested_ranges == ["bytes=100000-"]
+    assert not partial_download.path.exists()
+    assert not partial_download.state_path.exists()
+
+
+def test_stream_download_to_file_completes_written_partial(range_server):
+    data_dir, url = range_server
+    destination = data_dir.join("downloaded.zip")
+    content = Path(data_dir.join("archive.zip")).read_bytes()
+
+    # A download that was killed after it was fully written, but before it was completed.
+    remote_file = RemoteFileInfo(len(content), True, "Mon, 05 Oct 2026 10:00:00 GMT")
+    partial_download = PartialDownload(f"{url}/archive.zip", destination, remote_file, False)
+    partial_download.path.write_bytes(content)
+
+    stream_download_to_file(f"{url}/archive.zip", destination)
+
+    assert Path(destination).read_bytes() == content
+    assert RangeRequestHandler.requested_ranges == [], "Nothing was downloaded"
+    assert not partial_download.path.exists()
+    assert not partial_download.state_path.exists()
+
+
+def test_stream_download_to_file_restarts_unsatisfiable_range(range_server):
+    data_dir, url = range_server
+    destination = data_dir.join("downloaded.zip")
+    content = Path(data_dir.join("archive.zip")).read_bytes()
+
+    # The partial download is larger than the remote file, so its range can't be resumed.
+    remote_file = RemoteFileInfo(len(content), True, "Mon, 05 Oct 2026 10:00:00 GMT")
+    partial_download = PartialDownload(f"{url}/archive.zip", destination, remote_file, False)
+    partial_download.path.write_bytes(content + bytes(10))
+
+    stream_download_to_file(f"{url}/archive.zip", destination)
+
+    assert Path(destination).read_bytes() == content
+    assert RangeRequestHandler.requested_ranges == [f"bytes={len(content) + 10}-", None]
+    assert not partial_download.path.exists()
+    assert not partial_download.state_path.exists()
+
+
+def test_stream_download_to_file_resumes_ranges(range_server):
+    data_dir, url = range_server
+    destination = data_dir.join("downloaded.zip")
+    content = Path(data_dir.join("archive.zip")).read_bytes()
+
+    # A download in ranges that was killed after completing the first and the third parts.
+    remote_file = RemoteFileInfo(len(content), True, "Mon, 05 Oct 2026 10:00:00 GMT")
+    partial_download = PartialDownload(f"{url}/archive.zip", destination, remote_file, True)
+    partial_download.path.write_bytes(content[:30_000] + bytes(30_000) + content[60_000:90_000])
+    partial_download.complete_range((0, 30_000))
+    partial_download.complete_range((60_000, 90_000))
+
+    stream_download_to_file(f"{url}/archive.zip", destination, connections=3)
+
+    assert Path(destination).read_bytes() == content
+    assert sorted(RangeRequestHandler.requested_ranges) == sorted(
+        f"bytes={start}-{min(start + 30_000, 250_000) - 1}"
+        for start in range(30_000, 250_000, 30_000)
+        if start != 60_000
+    )
+
+
+def test_stream_download_to_file_restarts_changed_file(range_server):
+    data_dir, url = range_server
+    destination = data_dir.join("downloaded.zip")
+    content = Path(data_dir.join("archive.zip")).read_bytes()
+
+    # The partial download is of a previous version of the file, which is not resumed.
+    remote_file = RemoteFileInfo(len(content), True, "Thu, 01 Jan 2026 00:00:00 GMT")
+    partial_download = PartialDownload(f"{url}/archive.zip", destination, remote_file, False)
+    partial_download.path.write_bytes(bytes(100_000))
+
+    stream_download_to_file(f"{url}/archive.zip", destination)
+
+    assert Path(destination).read_bytes() == content
+    assert RangeRequestHandler.requested_ranges == [None]
+
+
+def test_download_chunk_streamer_reads(range_server, monkeypatch):
+    data_dir, url = range_server
+    monkeypatch.setattr(downloads, "MIN_CHUNK_BYTES", 1_000)
+    content = Path(data_dir.join("archive.zip")).read_bytes()
+
+    with DownloadChunkStreamer(f"{url}/archive.zip") as streamer:
+        # Reads that are smaller, and larger, than the chunks.
+        data = streamer.read(10) + streamer.read(5_000)
+        buffer = bytearray(40_000)
+        assert streamer.readinto(buffer) == len(buffer)
+        data += buffer + streamer.read(3)
+        data += streamer.read()
+
+    assert data == content
+    assert streamer.read(10) == b""
+
+
+def test_download_chunk_streamer_adapts_chunk_bytes():
+    streamer = DownloadChunkStreamer("http://localhost/file")
+    assert streamer.chunk_bytes == downloads.MIN_CHUNK_BYTES
+
+    # Fast chunks grow up to the maximum size.
+    for _ in range(20):
+        streamer.adapt_chunk_bytes(0.0)
+    assert streamer.chunk_bytes == downloads.MAX_CHUNK_BYTES
+
+    # Chunks that arrive on time keep their size, and slow chunks shrink.
+    streamer.adapt_chunk_bytes(downloads.CHUNK_TARGET_SEC)
+    assert streamer.chunk_bytes == downloads.MAX_CHUNK_BYTES
+    streamer.adapt_chunk_bytes(downloads.CHUNK_TARGET_SEC * 3)
+    assert streamer.chunk_bytes == downloads.MAX_CHUNK_BYTES // 2
+    for _ in range(20):
+        streamer.adapt_chunk_bytes(10.0)
+    assert streamer.chunk_bytes == downloads.MIN_CHUNK_BYTES
+
+
+def test_read_lines_remote_reuses_connections(range_server, monkeypatch):
+    data_dir, url = range_server
+    # Keep the connections alive.
+    monkeypatch.setattr(RangeRequestHandler, "protocol_version", "HTTP/1.1")
+    urls = []
+    for file_name in ["lines.txt.gz", "lines.txt.zst", "lines.txt"]:
+        write_test_content(data_dir.join(file_name))
+        urls.append(f"{url}/{file_name}")
+    http_stats = downloads.get_http_stats()
+
+    assert location_exists(urls[0])
+    with read_lines(urls) as lines:
+        assert list(lines) == line_fixtures * 3
+
+    # The HEAD request of the first file is cached, and all the requests share a connection.
+    stats = downloads.get_http_stats() - http_stats
+    assert stats.head_requests == 3
+    assert stats.cached_head_requests == 1
+    assert stats.requests == 6
+    assert stats.connections == 1
+
+
+def test_http_stats_concurrent_requests(range_server, monkeypatch):
+    data_dir, url = range_server
+    # Keep the connections alive.
+    monkeypatch.setattr(RangeRequestHandler, "protocol_version", "HTTP/1.1")
+    write_test_content(data_dir.join("lines.txt"))
+    http_stats = downloads.get_http_stats()
+
+    def get(_) -> None:
+        response = downloads.get_session().get(f"{url}/lines.txt")
+        assert response.content == line_fixtures_bytes
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(get, range(20)))
+
+    stats = downloads.get_http_stats() - http_stats
+    assert stats.requests == 20
+    assert 1 <= stats.connections <= 4
+
+    # The counts don't depend on the connection pools, which can be evicted.
+    for adapter in set(downloads.get_session().adapters.values()):
+        adapter.poolmanager.clear()
+    get(None)
+
+    stats = downloads.get_http_stats() - http_stats
+    assert stats.requests == 21
+    assert 2 <= stats.connections <= 5
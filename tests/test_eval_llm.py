@@ -0,0 +1,331 @@
+import asyncio
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+from fixtures import DataDir
+
+from pipeline.eval import llm
+from pipeline.eval.llm_cache import ScoreCache
+
+"""
+Tests the LLM evaluation against a mock OpenAI compatible server.
+"""
+
+EXAMPLE_RE = re.compile(r"^example (\d+) \{$", re.MULTILINE)
+SCORES = {
+    "adequacy": [5, ""],
+    "fluency": [4, "Slightly awkward."],
+    "terminology": [5, ""],
+    "hallucination": [5, ""],
+    "punctuation": [5, ""],
+}
+
+
+class MockOpenAI:
+    """
+    Serve the responses API. The batch evaluations return a score per example of the input,
+    and the final summary returns a fixed summary.
+    """
+
+    def __init__(self, delay: float = 0.05) -> None:
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.batch_inputs: list[str] = []
+        self.summary_requests = 0
+        # The number of malformed responses to return before the valid ones.
+        self.malformed = 0
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                assert self.path == "/v1/responses"
+                with mock.lock:
+                    mock.in_flight += 1
+                    mock.max_in_flight = max(mock.max_in_flight, mock.in_flight)
+                time.sleep(mock.delay)
+                text = mock.respond(request["input"])
+                with mock.lock:
+                    mock.in_flight -= 1
+
+                body = json.dumps(
+                    {
+                        "id": "resp_1",
+                        "object": "response",
+                        "created_at": 0,
+                        "model": request["model"],
+                        "status": "completed",
+                        "output": [
+                            {
+                                "type": "message",
+                                "id": "msg_1",
+                                "role": "assistant",
+                                "status": "completed",
+                                "content": [
+                                    {"type": "output_text", "text": text, "annotations": []}
+                                ],
+                            }
+                        ],
+                        "parallel_tool_calls": True,
+                        "tool_choice": "auto",
+                        "tools": [],
+                        "usage": {
+                            "input_tokens": 100,
+                            "output_tokens": 50,
+                            "total_tokens": 150,
+                            "input_tokens_details": {"cached_tokens": 0},
+                            "output_tokens_details": {"reasoning_tokens": 0},
+                        },
+                    }
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def respond(self, input: str) -> str:
+        examples = EXAMPLE_RE.findall(input)
+        with self.lock:
+            if not examples:
+                self.summary_requests += 1
+                return json.dumps({"adequacy": "Good overall."})
+            self.batch_inputs.append(input)
+            if self.malformed:
+                self.malformed -= 1
+                return "This isn't JSON."
+        summary = {"adequacy": f"Batch of {len(examples)}"}
+        # The output is wrapped in a code block, which is cleaned up.
+        return (
+            "```json\n"
+            + json.dumps({"scores": [SCORES] * len(examples), "summary": summary})
+            + "\n```"
+        )
+
+
+@pytest.fixture
+def mock_openai(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    mock = MockOpenAI()
+    thread = threading.Thread(target=mock.server.serve_forever, daemon=True)
+    thread.start()
+    yield mock
+    mock.server.shutdown()
+    mock.server.server_close()
+
+
+def create_corpus(data_dir: DataDir, count: int) -> list[str]:
+    return [
+        data_dir.create_file("corpus.src.txt", [f"Source sentence {i}" for i in range(count)]),
+        data_dir.create_file("corpus.trg.txt", [f"Phrase cible {i}" for i in range(count)]),
+        data_dir.create_file("corpus.ref.txt", [f"Phrase de référence {i}" for i in range(count)]),
+    ]
+
+
+def run_llm_eval(data_dir: DataDir, mock: MockOpenAI, corpus: list[str], *extra_args: str):
+    src, trg, ref = corpus
+    llm.main(
+        [
+            "--corpus_src", src,
+            "--corpus_trg", trg,
+            "--corpus_ref", ref,
+            "--model_service", "mozilla",
+            "--artifacts", data_dir.join("artifacts"),
+            "--src", "en",
+            "--trg", "fr",
+            "--api_batch_size", "4",
+            "--concurrency", "4",
+            "--base_url", mock.base_url,
+            *extra_args,
+        ]
+    )  # fmt: skip
+
+
+def test_llm_eval_concurrent_batches(mock_openai):
+    data_dir = DataDir("test_llm_eval_concurrent_batches")
+    corpus = create_corpus(data_dir, 30)
+    run_llm_eval(data_dir, mock_openai, corpus)
+
+    assert len(mock_openai.batch_inputs) == 8
+    assert mock_openai.max_in_flight > 1
+    assert mock_openai.max_in_flight <= 4
+    assert mock_openai.summary_requests == 1
+
+    # The scores are written in the order of the corpus.
+    scores = json.loads(data_dir.read_text("artifacts/scores.json"))
+    assert [score["translation"]["src"] for score in scores] == [
+        f"Source sentence {i}" for i in range(30)
+    ]
+    assert scores[0]["scores"] == SCORES
+    assert json.loads(data_dir.read_text("artifacts/summary.json")) == {
+        "adequacy": "Good overall."
+    }
+
+
+def test_llm_eval_resumes_from_checkpoint(mock_openai):
+    data_dir = DataDir("test_llm_eval_resumes_from_checkpoint")
+    corpus = create_corpus(data_dir, 12)
+    # The first batch fails to parse on every attempt.
+    mock_openai.malformed = 5
+    mock_openai.delay = 0.0
+    run_llm_eval(data_dir, mock_openai, corpus, "--concurrency", "1")
+
+    assert len(mock_openai.batch_inputs) == 5 + 2
+    assert len(json.loads(data_dir.read_text("artifacts/scores.json"))) == 8
+    checkpoint = data_dir.read_text("artifacts/checkpoint.jsonl").splitlines()
+    assert len(checkpoint) == 2
+
+    # Only the failed batch is sent again.
+    mock_openai.batch_inputs.clear()
+    run_llm_eval(data_dir, mock_openai, corpus)
+
+    assert len(mock_openai.batch_inputs) == 1
+    assert "Source sentence 0" in mock_openai.batch_inputs[0]
+    assert len(json.loads(data_dir.read_text("artifacts/scores.json"))) == 12
+
+
+def test_llm_eval_missing_scores(mock_openai):
+    data_dir = DataDir("test_llm_eval_missing_scores")
+    corpus = create_corpus(data_dir, 6)
+    # The first batch was parsed with 3 scores for its 4 examples.
+    translations = [
+        {
+            "src": f"Source sentence {i}",
+            "trg": f"Phrase cible {i}",
+            "ref": f"Phrase de référence {i}",
+        }
+        for i in range(4)
+    ]
+    Path(data_dir.join("artifacts")).mkdir()
+    instructions = (Path(llm.__file__).parent / "eval-batch-instructions.md").read_text()
+    llm.Checkpoint(
+        Path(data_dir.join("artifacts/checkpoint.jsonl")),
+        "gpt-4o",
+        instructions.format(src="en", trg="fr"),
+    ).add(llm.BatchResult(translations, {"scores": [SCORES] * 3, "summary": {}}))
+
+    run_llm_eval(data_dir, mock_openai, corpus)
+    assert len(mock_openai.batch_inputs) == 1
+
+    # The example without a score is kept.
+    scores = json.loads(data_dir.read_text("artifacts/scores.json"))
+    assert [score["translation"]["src"] for score in scores] == [
+        f"Source sentence {i}" for i in range(6)
+    ]
+    assert [score["scores"] for score in scores] == [SCORES] * 3 + [None] + [SCORES] * 2
+
+
+def test_llm_eval_score_cache(mock_openai, caplog):
+    data_dir = DataDir("test_llm_eval_score_cache")
+    cache_dir = data_dir.join("cache")
+    corpus = create_corpus(data_dir, 10)
+    run_llm_eval(data_dir, mock_openai, corpus, "--cache_dir", cache_dir)
+    assert len(mock_openai.batch_inputs) == 3
+    first_scores = json.loads(data_dir.read_text("artifacts/scores.json"))
+
+    # Re-run in a new artifacts folder, with 4 new examples at the end of the corpus.
+    mock_openai.batch_inputs.clear()
+    mock_openai.summary_requests = 0
+    rerun_dir = DataDir("test_llm_eval_score_cache_rerun")
+    corpus = create_corpus(rerun_dir, 14)
+    run_llm_eval(rerun_dir, mock_openai, corpus, "--cache_dir", cache_dir)
+
+    # Only the new examples are sent, but the final summary is built again.
+    assert len(mock_openai.batch_inputs) == 1
+    assert "Source sentence 10" in mock_openai.batch_inputs[0]
+    assert "Source sentence 9" not in mock_openai.batch_inputs[0]
+    assert mock_openai.summary_requests == 1
+
+    scores = json.loads(rerun_dir.read_text("artifacts/scores.json"))
+    assert scores[:10] == first_scores
+    assert [score["translation"]["src"] for score in scores] == [
+        f"Source sentence {i}" for i in range(14)
+    ]
+    assert "Cache hits: 10/14 (71.4%)" in caplog.text
+    # The 3 cached batches cost 100 input and 50 output tokens each with the mock.
+    assert "Saved input tokens: 300" in caplog.text
+
+
+def test_score_cache_key():
+    data_dir = DataDir("test_score_cache_key")
+    translation = {"src": "a", "trg": "b", "ref": "c"}
+    cache = ScoreCache(data_dir.path, "gpt-4o", "instructions")
+    cache.store([translation], {"scores": [SCORES], "summary": {"adequacy": "Good"}}, 10, 20)
+
+    entry = ScoreCache(data_dir.path, "gpt-4o", "instructions").get(translation)
+    assert entry["scores"] == SCORES
+    assert entry["input_tokens"] == 10
+    assert cache.get_summary(entry["batch"]) == {"adequacy": "Good"}
+
+    # The model, the instructions and every field of the example are part of the key.
+    assert ScoreCache(data_dir.path, "gpt-4o-mini", "instructions").get(translation) is None
+    assert ScoreCache(data_dir.path, "gpt-4o", "new instructions").get(translation) is None
+    assert cache.get({**translation, "ref": "d"}) is None
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_batches_are_sized_from_token_estimates():
+    data_dir = DataDir("test_batches_are_sized_from_token_estimates")
+    long_sentence = "A long sentence. " * 100
+    src = data_dir.create_file("src.txt", ["Short", long_sentence, "Short", "Short"])
+    trg = data_dir.create_file("trg.txt", ["Court"] * 4)
+    ref = data_dir.create_file("ref.txt", ["Court"] * 4)
+    config = llm.Config(
+        [
+            "--corpus_src", src,
+            "--corpus_trg", trg,
+            "--corpus_ref", ref,
+            "--model_service", "mozilla",
+            "--artifacts", data_dir.path,
+            "--src", "en",
+            "--trg", "fr",
+            "--max_batch_tokens", "200",
+        ]
+    )  # fmt: skip
+
+    batches = list(llm.yield_batched_translations(config, llm.read_translations(config)))
+
+    # The long sentence doesn't fit with the previous one, and gets its own batch.
+    assert [len(batch) for batch in batches] == [1, 1, 2]
+
+
+def test_token_rate_limiter():
+    async def acquire_all() -> float:
+        # 6,000 tokens per minute is 100 tokens per second.
+        limiter = llm.TokenRateLimiter(tokens_per_minute=6_000)
+        limiter.available = 0
+        start = time.monotonic()
+        await asyncio.gather(limiter.acquire(10), limiter.acquire(10))
+        return time.monotonic() - start
+
+    assert 0.15 <= asyncio.run(acquire_all()) < 1.0
+
+
+def test_checkpoint_ignores_truncated_lines():
+    data_dir = DataDir("test_checkpoint_ignores_truncated_lines")
+    path = Path(data_dir.join("checkpoint.jsonl"))
+    translations = [{"src": "a", "trg": "b", "ref": "c"}]
+    checkpoint = llm.Checkpoint(path, "gpt-4o", "instructions")
+    checkpoint.add(llm.BatchResult(translations, {"scores": [SCORES], "summary": {}}))
+    with path.open("a") as file:
+        file.write('{"key": "trunc')
+
+    assert llm.Checkpoint(path, "gpt-4o", "instructions").get(translations) == {
+        "scores": [SCORES],
+        "summary": {},
+    }
+    # A change of the instructions invalidates the checkpoint.
+    assert llm.Checkpoint(path, "gpt-4o", "new instructions").get(translations) is None
@@ -0,0 +1,179 @@
+"""
+Tests the streaming mode of the evaluation, running the eval script directly with the mocked
+marian-decoder.
+"""
+
+import json
+import os
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+from fixtures import DataDir, en_sample, ru_sample
+from sacrebleu.metrics.bleu import BLEU
+from sacrebleu.metrics.chrf import CHRF
+
+from pipeline.eval import eval as eval_module
+from pipeline.eval.eval import CometWorker, IncrementalMetric, get_score_details, main
+
+current_folder = os.path.dirname(os.path.abspath(__file__))
+fixtures_path = os.path.join(current_folder, "fixtures")
+
+ru_fake_translated = "\n".join([line.upper() for line in en_sample.split("\n")])
+
+
+@pytest.fixture
+def eval_env(monkeypatch):
+    data_dir = DataDir("test_eval_streaming")
+    monkeypatch.setenv("TEST_ARTIFACTS", data_dir.path)
+    monkeypatch.setenv("COMET_SKIP", "1")
+    monkeypatch.setenv("USE_CPU", "1")
+    return data_dir
+
+
+def run_eval(data_dir: DataDir, datasets: list[str], *extra_args: str) -> None:
+    main(
+        [
+            "--src", "en",
+            "--trg", "ru",
+            "--marian", fixtures_path,
+            "--marian_config", data_dir.join("decoder.yml"),
+            "--models", data_dir.join("model.npz"),
+            "--dataset_prefix", *[data_dir.join(dataset) for dataset in datasets],
+            "--artifacts_prefix", *[data_dir.join("artifacts", dataset) for dataset in datasets],
+            "--model_variant", "cpu",
+            *extra_args,
+        ]
+    )  # fmt: skip
+
+
+@pytest.mark.parametrize("chunk_lines", [1, 3, 1000])
+def test_incremental_metric_matches_corpus_score(chunk_lines):
+    hypotheses = ru_fake_translated.splitlines()
+    references = ru_sample.splitlines()
+    for metric in (BLEU(trg_lang="ru"), CHRF()):
+        incremental = IncrementalMetric(metric)
+        for start in range(0, len(hypotheses), chunk_lines):
+            incremental.update(
+                hypotheses[start : start + chunk_lines], references[start : start + chunk_lines]
+            )
+        expected = get_score_details(metric, metric.corpus_score(hypotheses, [references]))
+        assert incremental.details() == expected
+
+
+def test_eval_streaming_multiple_datasets(eval_env):
+    data_dir = eval_env
+    data_dir.create_file("decoder.yml", "{}")
+    data_dir.create_zst("wmt09.en.zst", en_sample)
+    data_dir.create_zst("wmt09.ru.zst", ru_sample)
+    # The second dataset is the first half of the sample.
+    half = len(en_sample.splitlines()) // 2
+    data_dir.create_zst("flores.en.zst", "\n".join(en_sample.splitlines()[:half]) + "\n")
+    data_dir.create_zst("flores.ru.zst", "\n".join(ru_sample.splitlines()[:half]) + "\n")
+
+    run_eval(data_dir, ["wmt09", "flores"], "--streaming")
+
+    assert data_dir.read_text("artifacts/wmt09.en") == en_sample
+    assert data_dir.read_text("artifacts/wmt09.ru.ref") == ru_sample
+    assert data_dir.read_text("artifacts/wmt09.ru") == ru_fake_translated
+    assert data_dir.read_text("artifacts/flores.ru").splitlines() == (
+        ru_fake_translated.splitlines()[:half]
+    )
+
+    # The metrics match the ones of the non-streaming mode.
+    assert "0.4\n0.64\nskipped\n" in data_dir.read_text("artifacts/wmt09.metrics")
+    for dataset, lines in (("wmt09", None), ("flores", half)):
+        metrics = json.loads(data_dir.read_text(f"artifacts/{dataset}.metrics.json"))
+        hypotheses = ru_fake_translated.splitlines()[:lines]
+        references = ru_sample.splitlines()[:lines]
+        bleu = BLEU(trg_lang="ru")
+        assert metrics["bleu"]["details"] == get_score_details(
+            bleu, bleu.corpus_score(hypotheses, [references])
+        )
+        assert metrics["comet"]["score"] == "skipped"
+
+    # A single Marian process translated both datasets, and its log is written for both.
+    marian_args = json.loads(data_dir.read_text("marian-decoder.args.txt"))
+    assert marian_args[marian_args.index("--log") + 1] == data_dir.join("artifacts/wmt09.log")
+    assert data_dir.read_text("artifacts/wmt09.log") == "[marian-decoder] Translating\n"
+    assert data_dir.read_text("artifacts/flores.log") == "[marian-decoder] Translating\n"
+
+
+class FakeCometModel:
+    def __init__(self) -> None:
+        self.chunks: list[int] = []
+
+    def predict(self, data, gpus, progress_bar):
+        self.chunks.append(len(data))
+        return SimpleNamespace(scores=[len(item["mt"]) / 100 for item in data])
+
+
+def test_comet_worker_scores_chunks():
+    model = FakeCometModel()
+    worker = CometWorker(lambda: model, gpu_count=0)
+    worker.start()
+    worker.submit(0, [{"src": "a", "mt": "x" * 10, "ref": "b"}] * 3)
+    worker.submit(1, [{"src": "a", "mt": "x" * 40, "ref": "b"}])
+    worker.submit(0, [{"src": "a", "mt": "x" * 30, "ref": "b"}])
+
+    # The system score is the mean of the segment scores of each dataset.
+    assert worker.finish() == {0: 0.15, 1: 0.4}
+    assert model.chunks == [3, 1, 1]
+
+
+def test_comet_worker_errors():
+    def load_model():
+        raise RuntimeError("No model")
+
+    worker = CometWorker(load_model, gpu_count=0)
+    worker.start()
+    worker.submit(0, [{"src": "a", "mt": "b", "ref": "c"}])
+    with pytest.raises(RuntimeError, match="No model"):
+        worker.finish()
+
+
+def test_eval_streaming_marian_error(eval_env):
+    """The error of Marian is raised, rather than an error of the scoring of no translations."""
+    data_dir = eval_env
+    # The missing decoder.yml fails the mocked marian-decoder.
+    data_dir.create_zst("wmt09.en.zst", en_sample)
+    data_dir.create_zst("wmt09.ru.zst", ru_sample)
+
+    with pytest.raises(subprocess.CalledProcessError):
+        run_eval(data_dir, ["wmt09"], "--streaming")
+
+
+def test_eval_streaming_fewer_translations(eval_env):
+    data_dir = eval_env
+    data_dir.create_file("decoder.yml", "{}")
+    lines = en_sample.splitlines()
+    data_dir.create_zst("wmt09.en.zst", "\n".join(lines[:-2]) + "\n")
+    data_dir.create_zst("wmt09.ru.zst", ru_sample)
+
+    with pytest.raises(
+        Exception, match=rf"Marian produced {len(lines) - 2} translations for the {len(lines)} "
+    ):
+        run_eval(data_dir, ["wmt09"], "--streaming")
+
+
+def test_eval_streaming_misaligned_datasets(eval_env):
+    data_dir = eval_env
+    data_dir.create_file("decoder.yml", "{}")
+    # The first dataset has more source sentences than references.
+    data_dir.create_zst("wmt09.en.zst", en_sample)
+    data_dir.create_zst("wmt09.ru.zst", "\n".join(ru_sample.splitlines()[:-1]) + "\n")
+    data_dir.create_zst("flores.en.zst", en_sample)
+    data_dir.create_zst("flores.ru.zst", ru_sample)
+
+    with pytest.raises(Exception, match=r"sentences of .*wmt09 don't have the same number"):
+        run_eval(data_dir, ["wmt09", "flores"], "--streaming")
+
+
+def test_eval_streaming_refuses_wandb_with_multiple_datasets(eval_env, monkeypatch):
+    """The W&B metrics are attributed to the dataset of the task, so they can't be lost."""
+    data_dir = eval_env
+    monkeypatch.setattr(eval_module, "WANDB_AVAILABLE", True)
+    monkeypatch.setenv("WANDB_PUBLICATION", "true")
+
+    with pytest.raises(Exception, match="Multiple datasets can't be evaluated"):
+        run_eval(data_dir, ["wmt09", "flores"], "--streaming")
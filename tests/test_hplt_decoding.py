@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from pipeline.common.downloads import read_lines
+from pipeline.data.hplt import decode_document, decode_document_header
+from fixtures import get_mocked_downloads
+
+"""
+Tests the fast decoding of the HPLT documents.
+"""
+
+
+@pytest.mark.parametrize("shard", ["hplt-en_100.jsonl.zst", "hplt-ru_10.jsonl.zst"])
+def test_decode_document_header_matches_json(shard):
+    shard_path = next(
+        path for path in json.loads(get_mocked_downloads()).values() if path.endswith(shard)
+    )
+    with read_lines(shard_path) as lines:
+        for document_json in lines:
+            document = json.loads(document_json)
+            assert decode_document_header(document_json) == (
+                document["doc_scores"][0],
+                document["lang"][0],
+            )
+
+
+def test_decode_document_header_ignores_the_text():
+    # The keys that appear in the text are escaped, and are not matched.
+    document_json = json.dumps(
+        {
+            "lang": ["eng_Latn", "fra_Latn"],
+            "text": 'A "lang": ["fra_Latn"] and "doc_scores": [1.0] quote\nSecond line',
+            "seg_langs": ["eng_Latn", "eng_Latn"],
+            "doc_scores": [7.5e0, 10, 4],
+        }
+    )
+    assert decode_document_header(document_json) == (7.5, "eng_Latn")
+
+    document = decode_document(document_json)
+    assert document.lines == [
+        'A "lang": ["fra_Latn"] and "doc_scores": [1.0] quote',
+        "Second line",
+    ]
+    assert document.seg_langs == ["eng_Latn", "eng_Latn"]
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        {"lang": ["eng_Latn"], "text": "", "seg_langs": []},
+        {"lang": [], "text": "", "seg_langs": [], "doc_scores": [8]},
+        {"lang": ["eng\\u005fLatn"], "text": "", "seg_langs": [], "doc_scores": [8]},
+    ],
+)
+def test_decode_document_header_fallback(document):
+    # The document needs to be fully decoded when the fields can't be extracted.
+    assert decode_document_header(json.dumps(document)) is None
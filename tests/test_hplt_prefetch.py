@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+from collections import Counter
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import zstandard as zstd
+from fixtures import DataDir, get_mocked_downloads
+
+from pipeline.common.downloads import read_lines
+from pipeline.data.hplt import HpltDownloader, ShardPrefetcher
+
+"""
+Tests the prefetching of the HPLT shards, with the mocked downloads and a local HTTP server.
+"""
+
+
+def run_hplt(data_dir: DataDir, name: str, prefetch_shards: int, **kwargs) -> Path:
+    destination = Path(data_dir.join(f"{name}.zst"))
+    HpltDownloader(
+        file_destination=destination,
+        hplt_min_doc_score=5.0,
+        prefetch_shards=prefetch_shards,
+        **kwargs,
+    ).download()
+    return destination
+
+
+@pytest.mark.parametrize(
+    "language,max_lines,max_characters,merge_lines",
+    [("en", 500, 600, True), ("ru", 200, 500, False)],
+)
+def test_hplt_prefetch_matches_sequential(
+    monkeypatch, language, max_lines, max_characters, merge_lines
+):
+    monkeypatch.setenv("MOCKED_DOWNLOADS", get_mocked_downloads())
+    data_dir = DataDir("test_hplt_prefetch_matches_sequential")
+    kwargs = dict(
+        language=language,
+        max_lines=max_lines,
+        max_characters=max_characters,
+        merge_lines=merge_lines,
+    )
+
+    sequential = run_hplt(data_dir, f"sequential.{language}", prefetch_shards=0, **kwargs)
+    prefetched = run_hplt(data_dir, f"prefetched.{language}", prefetch_shards=3, **kwargs)
+
+    assert prefetched.read_bytes() == sequential.read_bytes()
+    assert json.loads(data_dir.read_text(f"prefetched.{language}.stats.json")) == json.loads(
+        data_dir.read_text(f"sequential.{language}.stats.json")
+    )
+
+
+class ShardServer:
+    """
+    Serve the shards from a directory, and count the requests made for each of them.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.requests: Counter[str] = Counter()
+        server = self
+
+        class Handler(SimpleHTTPRequestHandler):
+            def do_GET(self) -> None:
+                server.requests[self.path] += 1
+                super().do_GET()
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), partial(Handler, directory=directory))
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+
+@pytest.fixture
+def shards(monkeypatch):
+    monkeypatch.delenv("MOCKED_DOWNLOADS", raising=False)
+    data_dir = DataDir("test_hplt_prefetch_shards")
+    # Large enough shards so that they span many prefetched chunks.
+    for shard in range(6):
+        lines = "".join(f"shard {shard} line {line}\n" for line in range(1000))
+        with open(data_dir.join(f"shard_{shard}.jsonl.zst"), "wb") as file:
+            file.write(zstd.ZstdCompressor().compress(lines.encode()))
+
+    server = ShardServer(data_dir.path)
+    thread = threading.Thread(target=server.server.serve_forever, daemon=True)
+    thread.start()
+    yield server, [f"{server.url}/shard_{shard}.jsonl.zst" for shard in range(6)]
+    server.server.shutdown()
+    server.server.server_close()
+
+
+def test_shard_prefetcher_keeps_the_order(shards):
+    _server, urls = shards
+    entered = []
+    with ShardPrefetcher(urls, prefetch_shards=2, on_enter_location=entered.append) as lines:
+        prefetched = list(lines)
+
+    with read_lines(urls) as lines:
+        assert prefetched == list(lines)
+    assert entered == urls
+
+
+def test_shard_prefetcher_stops_early(shards):
+    server, urls = shards
+    entered = []
+    with ShardPrefetcher(urls, prefetch_shards=2, on_enter_location=entered.append) as lines:
+        for index, _line in enumerate(lines):
+            if index == 10:
+                break
+
+    assert entered == urls[:1]
+    # Only the shard being read and the prefetched ones were requested.
+    requested = {os.path.basename(path) for path in server.requests}
+    assert requested == {"shard_0.jsonl.zst", "shard_1.jsonl.zst", "shard_2.jsonl.zst"}
+
+
+def test_shard_prefetcher_errors(shards, tmp_path):
+    _server, urls = shards
+    # A missing local shard fails right away, rather than retrying the download.
+    urls = [urls[0], str(tmp_path / "missing.jsonl.zst")]
+    with pytest.raises(FileNotFoundError):
+        with ShardPrefetcher(urls, prefetch_shards=1) as lines:
+            list(lines)
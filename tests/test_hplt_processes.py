@@ -0,0 +1,84 @@
+import json
+from pathlib import Path
+
+import pytest
+from fixtures import DataDir, get_mocked_downloads
+
+from pipeline.data.hplt import (
+    LINE_FILTERED_LOCALE,
+    LINE_FILTERED_TOO_LONG,
+    LINE_KEPT,
+    DocumentFilter,
+    HpltDownloader,
+)
+
+"""
+Tests the filtering of the HPLT documents in a pool of processes.
+"""
+
+
+def run_hplt(data_dir: DataDir, name: str, **kwargs) -> tuple[bytes, dict]:
+    destination = Path(data_dir.join(f"{name}.zst"))
+    HpltDownloader(file_destination=destination, hplt_min_doc_score=5.0, **kwargs).download()
+    return destination.read_bytes(), json.loads(data_dir.read_text(f"{name}.stats.json"))
+
+
+@pytest.mark.parametrize("language", ["en", "ru"])
+@pytest.mark.parametrize("merge_lines", [True, False])
+# The small max_lines stop in the middle of documents, or right after their last segment.
+@pytest.mark.parametrize("max_lines", [7, 37, 43, 500])
+def test_hplt_processes_match_in_process(monkeypatch, language, merge_lines, max_lines):
+    monkeypatch.setenv("MOCKED_DOWNLOADS", get_mocked_downloads())
+    data_dir = DataDir("test_hplt_processes_match_in_process")
+    kwargs = dict(
+        language=language,
+        max_lines=max_lines,
+        max_characters=600 if merge_lines else 100,
+        merge_lines=merge_lines,
+    )
+
+    output, stats = run_hplt(data_dir, "in_process", prefetch_shards=0, processes=0, **kwargs)
+    pool_output, pool_stats = run_hplt(data_dir, "pool", processes=2, **kwargs)
+
+    assert pool_output == output
+    assert pool_stats == stats
+    assert stats["final_lines"]["value"] == max_lines
+
+
+def test_document_filter():
+    document_filter = DocumentFilter(
+        "eng_Latn", hplt_min_doc_score=5.0, max_characters=20, merge_lines=True
+    )
+
+    def filter_document(lines: list[tuple[str, str]], doc_score=8.0, doc_lang="eng_Latn"):
+        return document_filter.filter(
+            json.dumps(
+                {
+                    "lang": [doc_lang],
+                    "text": "\n".join(line for _, line in lines),
+                    "seg_langs": [locale for locale, _ in lines],
+                    "doc_scores": [doc_score],
+                }
+            )
+        )
+
+    assert filter_document([], doc_score=4.0).filtered_by == "doc_score"
+    assert filter_document([], doc_lang="fra_Latn").filtered_by == "doc_locale"
+
+    filtered = filter_document(
+        [
+            ("eng_Latn", "One."),
+            ("eng_Latn", "Two."),
+            ("fra_Latn", "Trois."),
+            ("eng_Latn", "A line that is too long."),
+            ("eng_Latn", "Three, four."),
+            ("eng_Latn", "Five, six."),
+        ]
+    )
+    assert filtered.filtered_by is None
+    assert filtered.line_outcomes == (
+        LINE_KEPT * 2 + LINE_FILTERED_LOCALE + LINE_FILTERED_TOO_LONG + LINE_KEPT * 2
+    )
+    # The segments are completed by the filtered lines, by a line that doesn't fit, and by the
+    # end of the document.
+    assert filtered.segments == [(2, "One. Two."), (5, "Three, four."), (6, "Five, six.")]
@@ -0,0 +1,371 @@
+import json
+import os
+import shelve
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import fields
+from datetime import timedelta
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+from utils import model_registry
+from utils.model_registry import ExpiringCache, RateLimiter, TrainingRun
+
+"""
+Tests the `utils/model_registry.py` script, with stub GCS and Taskcluster clients.
+"""
+
+
+class StubBlob:
+    def __init__(self, bucket: "StubBucket", name: str) -> None:
+        self.bucket = bucket
+        self.name = name
+
+    def exists(self) -> bool:
+        return self.name in self.bucket.blobs
+
+    def download_as_text(self) -> str:
+        return self.bucket.blobs[self.name]
+
+    def download_as_string(self) -> str:
+        return self.bucket.blobs[self.name]
+
+    def upload_from_string(self, text: str) -> None:
+        self.bucket.uploads.append(self.name)
+        self.bucket.blobs[self.name] = text
+
+
+class StubPage:
+    def __init__(self, prefixes: set[str]) -> None:
+        self.prefixes = prefixes
+
+
+class StubListing:
+    def __init__(self, prefixes: set[str]) -> None:
+        self.pages = [StubPage(prefixes)]
+
+
+class StubBucket:
+    """A GCS bucket that lists the subdirectories of the blobs, and stores the uploads."""
+
+    def __init__(self, blobs: dict[str, str], delays: dict[str, float]) -> None:
+        self.blobs = blobs
+        self.uploads: list[str] = []
+        # The delay of the listing of a prefix, which makes the requests finish out of order.
+        self.delays = delays
+
+    def blob(self, name: str) -> StubBlob:
+        return StubBlob(self, name)
+
+    def get_blob(self, name: str) -> Optional[StubBlob]:
+        return StubBlob(self, name) if name in self.blobs else None
+
+    def list_blobs(self, prefix: str, delimiter: Optional[str] = None):
+        time.sleep(self.delays.get(prefix, 0.0))
+        names = [name for name in self.blobs if name.startswith(prefix)]
+        if delimiter is None:
+            return [StubBlob(self, name) for name in names]
+        return StubListing(
+            {
+                prefix + name[len(prefix) :].split(delimiter)[0] + delimiter
+                for name in names
+                if delimiter in name[len(prefix) :]
+            }
+        )
+
+
+class StubQueue:
+    """A Taskcluster queue that returns the tasks of the task groups."""
+
+    def __init__(self, tasks_by_group: dict[str, list[dict]], delays: dict[str, float]) -> None:
+        self.tasks_by_group = tasks_by_group
+        self.delays = delays
+        self.calls: list[str] = []
+
+    def listTaskGroup(self, task_group_id: str, continuationToken=None) -> dict:
+        self.calls.append(task_group_id)
+        time.sleep(self.delays.get(task_group_id, 0.0))
+        return {"tasks": self.tasks_by_group[task_group_id]}
+
+
+def make_task(task_id: str, task_group_id: str, name: str) -> dict:
+    return {
+        "task": {"metadata": {"name": name}, "created": "2024-05-01T10:00:00.000Z"},
+        "status": {
+            "taskId": task_id,
+            "taskGroupId": task_group_id,
+            "state": "completed",
+            "runs": [{"state": "completed", "resolved": "2024-05-01T12:00:00.000Z"}],
+        },
+    }
+
+
+# Task group IDs are 22 characters long.
+TASK_GROUP_IDS = {
+    "en-ca": "AAAAAAAAAAAAAAAAAAAAAA",
+    "en-fi": "BBBBBBBBBBBBBBBBBBBBBB",
+    "en-lt": "CCCCCCCCCCCCCCCCCCCCCC",
+    "fi-en": "DDDDDDDDDDDDDDDDDDDDDD",
+}
+
+
+@pytest.fixture
+def registry(monkeypatch, tmp_path: Path):
+    """
+    Replace the GCS bucket and the Taskcluster queue with stubs, and write the training runs
+    to a temporary directory. The tasks of the later task groups are returned first.
+    """
+    blobs = {
+        f"models/{langpair}/spring-2024_{task_group_id}/vocab/vocab.spm": ""
+        for langpair, task_group_id in TASK_GROUP_IDS.items()
+    }
+    bucket = StubBucket(
+        blobs,
+        delays={
+            f"models/{langpair}/": 0.01 * (len(TASK_GROUP_IDS) - index)
+            for index, langpair in enumerate(TASK_GROUP_IDS)
+        },
+    )
+    queue = StubQueue(
+        {
+            task_group_id: [
+                make_task(f"{task_group_id[0]}-clean", task_group_id, f"clean-corpus-{langpair}")
+            ]
+            for langpair, task_group_id in TASK_GROUP_IDS.items()
+        },
+        delays={
+            task_group_id: 0.01 * (len(TASK_GROUP_IDS) - index)
+            for index, task_group_id in enumerate(TASK_GROUP_IDS.values())
+        },
+    )
+
+    monkeypatch.setattr(model_registry, "_bucket", bucket)
+    monkeypatch.setattr(model_registry.taskcluster, "Queue", lambda options: queue)
+    monkeypatch.setattr(model_registry, "fetch_json", lambda url: {})
+    monkeypatch.setattr(model_registry, "rate_limiter", RateLimiter(0))
+    monkeypatch.setattr(model_registry, "MODEL_REGISTRY_DIR", tmp_path)
+    monkeypatch.setattr(model_registry, "TRAINING_RUNS_DIR", tmp_path / "training-runs")
+
+    return bucket, queue
+
+
+def test_rate_limiter_spaces_requests():
+    rate_limiter = RateLimiter(max_requests_per_second=50)
+    request_times: list[float] = []
+
+    def request(_):
+        rate_limiter.wait()
+        request_times.append(time.monotonic())
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(request, range(10)))
+
+    # The first request is immediate, and the rest are spaced by 20ms across the threads.
+    request_times.sort()
+    assert request_times[-1] - start >= 9 * 0.02 - 0.005
+    gaps = [later - earlier for earlier, later in zip(request_times, request_times[1:])]
+    assert min(gaps) >= 0.02 - 0.005
+
+
+def test_rate_limiter_disabled():
+    rate_limiter = RateLimiter(max_requests_per_second=0)
+    start = time.monotonic()
+    for _ in range(1000):
+        rate_limiter.wait()
+    assert time.monotonic() - start < 0.1
+
+
+def test_expiring_cache(monkeypatch, tmp_path: Path):
+    now = 1_000_000.0
+    monkeypatch.setattr(model_registry.time, "time", lambda: now)
+
+    with shelve.open(str(tmp_path / "cache.pickle")) as shelf:
+        # An entry of an older version of the script, without an expiry.
+        shelf["old-entry"] = ["task"]
+        cache = ExpiringCache(shelf)
+
+        cache.set("entry", ["task"], timedelta(hours=1))
+        assert cache.get("entry") == ["task"]
+        assert cache.get("old-entry") is None, "Entries without an expiry are fetched again"
+        assert cache.get("missing") is None
+
+        now += timedelta(minutes=59).total_seconds()
+        assert cache.get("entry") == ["task"]
+
+        now += timedelta(minutes=2).total_seconds()
+        assert cache.get("entry") is None, "The entry expired"
+
+        cache.set("entry", ["task", "task"], timedelta(hours=1))
+        assert cache.get("entry") == ["task", "task"], "The expired entry was replaced"
+
+        cache.clear()
+        assert cache.get("entry") is None
+
+
+def test_task_group_ttl():
+    running_task = make_task("running", TASK_GROUP_IDS["en-ca"], "train-student-en-ca")
+    running_task["status"]["state"] = "running"
+    resolved_task = make_task("resolved", TASK_GROUP_IDS["en-ca"], "clean-corpus-en-ca")
+
+    assert model_registry.get_task_group_ttl([resolved_task]) == (
+        model_registry.RESOLVED_TASK_GROUP_TTL
+    )
+    assert model_registry.get_task_group_ttl([resolved_task, running_task]) == (
+        model_registry.RUNNING_TASK_GROUP_TTL
+    )
+
+
+def test_training_runs_by_langpair_order(registry):
+    """The listings finish out of order, but every language pair gets its own training runs."""
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        runs_by_langpair = model_registry.get_training_runs_by_langpair(None, executor)
+
+    assert {
+        langpair: [(run.name, run.task_group_ids) for run in training_runs]
+        for langpair, training_runs in runs_by_langpair.items()
+    } == {
+        langpair: [("spring-2024", [task_group_id])]
+        for langpair, task_group_id in TASK_GROUP_IDS.items()
+    }
+
+
+def test_build_json_for_training_runs_order(registry):
+    """The tasks are fetched out of order, but the JSON is returned in the training run order."""
+    _, queue = registry
+    runs_by_langpair = {
+        langpair: [TrainingRun.create("spring-2024", [task_group_id], langpair)]
+        for langpair, task_group_id in TASK_GROUP_IDS.items()
+    }
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        run_jsons = model_registry.build_json_for_training_runs(
+            runs_by_langpair,
+            overwrite_runs=False,
+            incremental=False,
+            upload=False,
+            cache=None,
+            executor=executor,
+        )
+
+    assert sorted(queue.calls) == sorted(TASK_GROUP_IDS.values())
+    assert [(run_json["langpair"], run_json["task_group_ids"]) for run_json in run_jsons] == [
+        (langpair, [task_group_id]) for langpair, task_group_id in TASK_GROUP_IDS.items()
+    ]
+    for run_json in run_jsons:
+        assert run_json["date_started"] == "2024-05-01T10:00:00"
+        path = model_registry.TRAINING_RUNS_DIR / f"spring-2024-{run_json['langpair']}.json"
+        assert path.exists()
+
+
+def build_training_runs(incremental: bool, upload: bool) -> list[dict]:
+    runs_by_langpair = {
+        langpair: [TrainingRun.create("spring-2024", [task_group_id], langpair)]
+        for langpair, task_group_id in TASK_GROUP_IDS.items()
+    }
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        return model_registry.build_json_for_training_runs(
+            runs_by_langpair,
+            overwrite_runs=False,
+            incremental=incremental,
+            upload=upload,
+            cache=None,
+            executor=executor,
+        )
+
+
+def test_incremental_build_unchanged(registry, capsys):
+    """A second build with the same tasks and evaluations rewrites nothing."""
+    run_jsons = build_training_runs(incremental=True, upload=False)
+    paths = sorted(model_registry.TRAINING_RUNS_DIR.iterdir())
+    assert len(paths) == len(TASK_GROUP_IDS)
+    modified_times = [path.stat().st_mtime_ns for path in paths]
+    capsys.readouterr()
+
+    assert build_training_runs(incremental=True, upload=False) == run_jsons
+    assert [path.stat().st_mtime_ns for path in paths] == modified_times
+    assert capsys.readouterr().out.count("Unchanged") == len(TASK_GROUP_IDS)
+
+
+def test_incremental_build_unchanged_upload(registry):
+    """With --upload, a second build with the same inputs uploads nothing."""
+    bucket, queue = registry
+    run_jsons = build_training_runs(incremental=True, upload=True)
+    assert sorted(bucket.uploads) == sorted(
+        [f"models/{langpair}/spring-2024.json" for langpair in TASK_GROUP_IDS]
+        + [
+            f"models/{langpair}/spring-2024_{task_group_id}/tasks.json"
+            for langpair, task_group_id in TASK_GROUP_IDS.items()
+        ]
+    )
+    bucket.uploads.clear()
+    queue.calls.clear()
+
+    assert build_training_runs(incremental=True, upload=True) == run_jsons
+    assert bucket.uploads == []
+    assert queue.calls == [], "The tasks were read from GCS"
+
+
+def test_incremental_build_changed_tasks(registry, capsys):
+    """Only the training run whose tasks changed is rewritten."""
+    _, queue = registry
+    run_jsons = build_training_runs(incremental=True, upload=False)
+    paths = {
+        langpair: model_registry.TRAINING_RUNS_DIR / f"spring-2024-{langpair}.json"
+        for langpair in TASK_GROUP_IDS
+    }
+    for path in paths.values():
+        os.utime(path, (0, 0))
+
+    # Re-run the task of en-fi.
+    task = queue.tasks_by_group[TASK_GROUP_IDS["en-fi"]][0]
+    task["status"]["runs"].append({"state": "completed", "resolved": "2024-05-02T12:00:00.000Z"})
+    capsys.readouterr()
+
+    new_run_jsons = build_training_runs(incremental=True, upload=False)
+    assert capsys.readouterr().out.count("Unchanged") == len(TASK_GROUP_IDS) - 1
+    for langpair, path in paths.items():
+        rewritten = path.stat().st_mtime != 0
+        assert rewritten == (langpair == "en-fi"), langpair
+
+    changed = [run_json["langpair"] for run_json in new_run_jsons if run_json not in run_jsons]
+    assert changed == ["en-fi"]
+
+
+def test_save_training_run_index(registry):
+    bucket, _ = registry
+    run_jsons = build_training_runs(incremental=True, upload=False)
+    # Add a model with a config, which is only in the full training run JSON.
+    student = {
+        "date": "2024-05-01T12:00:00",
+        "config": {"marian": {"after": "40e"}},
+        "task_group_id": TASK_GROUP_IDS["en-ca"],
+        "task_id": "A-student",
+        "task_name": "train-student-en-ca",
+        "flores": {"chrf": 60.1, "bleu": 35.2, "comet": 0.85},
+        "artifact_folder": None,
+        "artifact_urls": [],
+    }
+    run_jsons[0]["student"] = student
+    # The index is sorted, whatever the order of the training runs.
+    run_jsons.reverse()
+
+    model_registry.save_training_run_index(run_jsons, upload=True)
+
+    index_path = model_registry.MODEL_REGISTRY_DIR / "index.json"
+    index_text = index_path.read_text()
+    assert bucket.blobs["models/index.json"] == index_text
+    index = json.loads(index_text)
+
+    assert [(entry["langpair"], entry["name"]) for entry in index] == [
+        (langpair, "spring-2024") for langpair in sorted(TASK_GROUP_IDS)
+    ]
+    training_run_fields = {field.name for field in fields(TrainingRun)}
+    for entry in index:
+        assert set(entry) == training_run_fields - {"input_digests"} | {"json"}
+        assert entry["json"] == f"models/{entry['langpair']}/spring-2024.json"
+
+    assert index[0]["student"] == {key: value for key, value in student.items() if key != "config"}
+    assert index[1]["student"] is None
@@ -0,0 +1,33 @@
+import zipfile
+from pathlib import Path
+
+from fixtures import DataDir, get_mocked_downloads
+
+from pipeline.common.downloads import read_lines
+from pipeline.data.parallel_downloaders import opus
+
+"""
+Tests the downloaders of the parallel datasets.
+"""
+
+
+def test_opus_streams_the_archive_into_zstd(monkeypatch):
+    monkeypatch.setenv("MOCKED_DOWNLOADS", get_mocked_downloads())
+    data_dir = DataDir("test_opus_streams_the_archive_into_zstd")
+    output_prefix = Path(data_dir.join("NeuLab-TedTalks_v1"))
+
+    opus("en", "zh", "NeuLab-TedTalks/v1", output_prefix)
+
+    with zipfile.ZipFile(Path(__file__).parent / "data/corpus_samples/en-zh.txt.zip") as archive:
+        for lang in ("en", "zh"):
+            expected = archive.read(f"NeuLab-TedTalks.en-zh.{lang}").decode("utf-8")
+            with read_lines(output_prefix.with_suffix(f".{lang}.zst")) as lines:
+                assert "".join(lines) == expected
+
+    # Nothing was extracted, and the temporary directory of the archive was removed.
+    assert sorted(path.name for path in Path(data_dir.path).iterdir()) == [
+        "NeuLab-TedTalks_v1.en.zst",
+        "NeuLab-TedTalks_v1.zh.zst",
+        "opus",
+    ]
+    assert not list(Path(data_dir.join("opus")).iterdir())
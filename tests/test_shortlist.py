@@ -0,0 +1,224 @@
+import io
+import random
+import shutil
+from collections import defaultdict
+
+import pytest
+import sentencepiece as spm
+from fixtures import DataDir, en_sample, ru_sample
+
+from pipeline.alignments.lexical_shortlist import LexicalShortlist
+from pipeline.alignments.lexical_shortlist import main as lexical_shortlist_main
+from pipeline.alignments.prune_shortlist import main as prune_shortlist_main
+from pipeline.alignments.prune_shortlist import LINE_END_TOKEN, prune, split_lines
+from pipeline.alignments.spm_encode import main as spm_encode_main
+from pipeline.alignments.tokenization_cache import TokenizationCache
+
+
+def prune_reference(max_candidates: int, top_words: list[str], lines: list[str]) -> list[str]:
+    """
+    The original dict based implementation of the pruning, which is used to verify the output.
+    """
+    tops = top_words[: max_candidates + 2]
+    vocab_src = []
+    pairs = {}
+    for line in lines:
+        try:
+            trg, src, prob = line.strip().split()
+        except ValueError:
+            continue
+        if trg == "NULL" or src == "NULL":
+            continue
+        vocab_src.append(src)
+        pairs.setdefault(src, {})[trg] = float(prob)
+
+    output = []
+    for src in dict.fromkeys(vocab_src):
+        d = pairs[src]
+        top_src = list(sorted(d, key=d.get, reverse=True)[:max_candidates])
+        for trg in top_src + tops:
+            if trg in d:
+                output.append("{} {} {:.8f}".format(trg, src, d[trg]))
+    return output
+
+
+def group_by_src(lines: list[str]) -> dict[str, list[str]]:
+    """The source words can be written in any order, but the candidates are ordered."""
+    groups = defaultdict(list)
+    for line in lines:
+        groups[line.split()[1]].append(line)
+    return dict(groups)
+
+
+def generate_lex_table(seed: int, lines_count: int) -> tuple[list[str], list[str]]:
+    rng = random.Random(seed)
+    src_words = [f"s{i}" for i in range(200)]
+    trg_words = [f"t{i}" for i in range(300)]
+    # extract_lex writes each (trg, src) pair once.
+    pairs = rng.sample([(trg, src) for src in src_words for trg in trg_words], lines_count)
+    lines = []
+    for trg, src in pairs:
+        # Use a coarse probability so that there are ties.
+        prob = rng.choice([0.5, 0.25, 0.125, rng.random()])
+        lines.append(f"{trg} {src} {prob:.8f}\n")
+    # Add some lines that should be skipped.
+    lines.insert(10, "NULL s1 0.5\n")
+    lines.insert(20, "t1 NULL 0.5\n")
+    lines.insert(30, " s2 \n")
+    vocab = list(trg_words)
+    rng.shuffle(vocab)
+    return lines, vocab
+
+
+@pytest.mark.parametrize("max_candidates", [1, 5, 100])
+@pytest.mark.parametrize("chunk_lines", [7, 1_000_000])
+def test_prune_matches_reference(max_candidates: int, chunk_lines: int):
+    data_dir = DataDir("test_shortlist")
+    lines, vocab = generate_lex_table(seed=max_candidates, lines_count=5000)
+    vocab_path = data_dir.create_file("vocab.txt", [f"{word}\t-1.0" for word in vocab])
+
+    output = io.StringIO()
+    pruner = prune(max_candidates, vocab_path, lines, output, chunk_lines)
+    pruned_lines = output.getvalue().splitlines()
+
+    expected = prune_reference(max_candidates, vocab, lines)
+    assert group_by_src(pruned_lines) == group_by_src(expected)
+    assert pruner.lines_skipped == 3
+
+
+@pytest.mark.parametrize("null_token", ["", "\x00"])
+def test_split_lines(null_token: str):
+    # Empty items, unicode whitespace, and no final newline. A null in a line can't be told apart
+    # from the line ends, so the lines are split one by one.
+    lines = [
+        "t1 s1 0.5\n",
+        f" s2 {null_token}\n",
+        "\n",
+        "词\u3000s3\xa0\u00a00.25\n",
+        "t4\u2028s4 0.1 extra\n",
+        "\U0001f600 s5 0.2",
+    ]
+    tokens, line_ends = split_lines(lines)
+    line_starts = [0, *(line_ends[:-1] + 1)]
+    assert [tokens[start:end] for start, end in zip(line_starts, line_ends)] == [
+        line.split() for line in lines
+    ]
+    assert [tokens[end] for end in line_ends] == [LINE_END_TOKEN] * len(lines)
+
+
+def test_prune_zst_input_output():
+    data_dir = DataDir("test_shortlist")
+    lines, vocab = generate_lex_table(seed=1, lines_count=1000)
+    lex_path = data_dir.create_zst("lex.s2t.zst", "".join(lines))
+    vocab_path = data_dir.create_file("vocab.txt", [f"{word}\t-1.0" for word in vocab])
+    output_path = data_dir.join("lex.s2t.pruned.zst")
+
+    prune_shortlist_main(["10", vocab_path, "--input", lex_path, "--output", output_path])
+
+    pruned_lines = data_dir.read_text("lex.s2t.pruned.zst").splitlines()
+    assert group_by_src(pruned_lines) == group_by_src(prune_reference(10, vocab, lines))
+
+
+def test_binary_shortlist_round_trip():
+    data_dir = DataDir("test_shortlist")
+    src_vocab = ["<unk>", "<s>", "</s>"] + [f"s{i}" for i in range(200)]
+    trg_vocab = ["<unk>", "<s>", "</s>"] + [f"t{i}" for i in range(300)]
+    lines, vocab = generate_lex_table(seed=2, lines_count=2000)
+    # Add a token that is not in the vocab, which is skipped.
+    lines.append("t1 missing 0.5\n")
+    output = io.StringIO()
+    prune(20, data_dir.create_file("vocab.txt", vocab), lines, output)
+    pruned_text = output.getvalue()
+
+    text_path = data_dir.create_zst("lex.s2t.pruned.zst", pruned_text)
+    src_vocab_path = data_dir.create_file("vocab.src.txt", [f"{p}\t0" for p in src_vocab])
+    trg_vocab_path = data_dir.create_file("vocab.trg.txt", [f"{p}\t0" for p in trg_vocab])
+    binary_path = data_dir.join("lex.s2t.pruned.csr")
+
+    lexical_shortlist_main(
+        [
+            "--input", text_path,
+            "--vocab_src", src_vocab_path,
+            "--vocab_trg", trg_vocab_path,
+            "--output", binary_path,
+        ]
+    )  # fmt: skip
+
+    shortlist = LexicalShortlist(binary_path)
+    assert shortlist.src_vocab_size == len(src_vocab)
+    assert shortlist.trg_vocab_size == len(trg_vocab)
+    # The token that is not in the vocab is skipped.
+    assert len(shortlist) == len(pruned_text.splitlines()) - 1
+
+    # Look up the candidates for a single source token.
+    expected = [line.split() for line in pruned_text.splitlines() if line.split()[1] == "s5"]
+    trg_ids, probs = shortlist.candidates(src_vocab.index("s5"))
+    assert [trg_vocab[i] for i in trg_ids] == [trg for trg, _, _ in expected]
+    assert probs.tolist() == pytest.approx([float(prob) for _, _, prob in expected], rel=1e-6)
+
+    # Write it back out as text, the candidates keep their order for each source token.
+    round_trip = io.StringIO()
+    shortlist.write_text(src_vocab, trg_vocab, round_trip)
+    actual_groups = group_by_src(round_trip.getvalue().splitlines())
+    expected_groups = group_by_src(pruned_text.splitlines())
+    del expected_groups["missing"]
+    assert actual_groups.keys() == expected_groups.keys()
+    for src, expected_lines in expected_groups.items():
+        actual = [line.split() for line in actual_groups[src]]
+        expected = [line.split() for line in expected_lines]
+        assert [fields[:2] for fields in actual] == [fields[:2] for fields in expected]
+        assert [float(fields[2]) for fields in actual] == pytest.approx(
+            [float(fields[2]) for fields in expected], rel=1e-6
+        )
+
+
+def test_binary_shortlist_rejects_other_files():
+    data_dir = DataDir("test_shortlist")
+    path = data_dir.create_file("lex.s2t.pruned", ["t1 s1 0.5"] * 10)
+    with pytest.raises(ValueError, match="not a binary lexical shortlist"):
+        LexicalShortlist(path)
+
+
+def spm_encode_reference(model_path: str, text: str) -> str:
+    processor = spm.SentencePieceProcessor(model_file=model_path)
+    return "".join(
+        " ".join(processor.encode(line, out_type=str)) + "\n" for line in text.splitlines()
+    )
+
+
+def test_spm_encode(monkeypatch):
+    monkeypatch.setenv("SRC", "en")
+    monkeypatch.setenv("TRG", "ru")
+    data_dir = DataDir("test_spm_encode")
+    vocab_path = "tests/data/vocab.spm"
+    corpus_src = data_dir.create_zst("corpus.en.zst", en_sample)
+    corpus_trg = data_dir.create_zst("corpus.ru.zst", ru_sample)
+    cache_dir = data_dir.join("cache")
+
+    args = [
+        "--corpus_src", corpus_src,
+        "--corpus_trg", corpus_trg,
+        "--vocab_src", vocab_path,
+        "--vocab_trg", vocab_path,
+        "--output_dir", data_dir.join("spm"),
+        "--processes", "2",
+        # Use a small chunk size so the order of the chunks is tested.
+        "--chunk_lines", "2",
+        "--tokenization_cache_dir", cache_dir,
+    ]  # fmt: skip
+    spm_encode_main(args)
+
+    assert data_dir.read_text("spm/corpus.spm.en.zst") == spm_encode_reference(
+        vocab_path, en_sample
+    )
+    assert data_dir.read_text("spm/corpus.spm.ru.zst") == spm_encode_reference(
+        vocab_path, ru_sample
+    )
+    assert len(TokenizationCache(cache_dir).entries()) == 2
+
+    # The second run is served from the cache.
+    shutil.rmtree(data_dir.join("spm"))
+    spm_encode_main(args)
+    assert data_dir.read_text("spm/corpus.spm.en.zst") == spm_encode_reference(
+        vocab_path, en_sample
+    )
@@ -1,5 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 
+from pipeline.alignments.align import tokenize_with_cache
+from pipeline.alignments.tokenization_cache import (
+    TokenizationCache,
+    get_tokenizer_version,
+    hash_file,
+)
 from pipeline.alignments.tokenizer import IcuTokenizer, TokenizerType, tokenize
 from fixtures import zh_sample, en_sample, ru_sample, DataDir
 
@@ -72,6 +80,55 @@ def test_tokenizer(lang, sample):
     assert lines[0] == tokenized_first_lines[lang]
 
 
+def test_tokenization_cache():
+    data_dir = DataDir("test_tokenizer")
+    cache = TokenizationCache(data_dir.join("cache"))
+    input_path = data_dir.create_file("input.en.txt", en_sample)
+    output_path = data_dir.join("output.en.txt")
+
+    tokenize_with_cache(input_path, output_path, "en", TokenizerType.icu, cache)
+    assert cache.hits == 0
+    assert cache.misses == 1
+    with open(output_path) as f:
+        first_run = f.read()
+    assert first_run.splitlines()[0] == tokenized_first_lines["en"]
+
+    # The second run is served from the cache.
+    cached_path = data_dir.join("output.cached.en.txt")
+    tokenize_with_cache(input_path, cached_path, "en", TokenizerType.icu, cache)
+    assert cache.hits == 1
+    assert cache.misses == 1
+    with open(cached_path) as f:
+        assert f.read() == first_run
+
+    # The key includes the language and the input digest.
+    digest = hash_file(input_path)
+    entry = cache.get(digest, "icu", "en", get_tokenizer_version("icu"))
+    assert entry
+    assert entry.lines == len(en_sample.splitlines())
+    assert not cache.get(digest, "icu", "ru", get_tokenizer_version("icu"))
+
+    changed_path = data_dir.create_file("changed.en.txt", en_sample + "One more line.\n")
+    assert not cache.get(hash_file(changed_path), "icu", "en", get_tokenizer_version("icu"))
+
+
+def test_tokenization_cache_concurrent_stores():
+    data_dir = DataDir("test_tokenization_cache_concurrent_stores")
+    tokenized_path = data_dir.create_file("tokenized.en.txt", "A ▁ line .\n")
+
+    # The tasks that share a cache directory don't lose each other's entries.
+    def store(index: int) -> None:
+        cache = TokenizationCache(data_dir.join("cache"))
+        cache.store(f"digest-{index}", "icu", "en", "PyICU-test", tokenized_path)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(store, range(32)))
+
+    cache = TokenizationCache(data_dir.join("cache"))
+    assert len(cache.entries()) == 32
+    assert all(cache.get(f"digest-{i}", "icu", "en", "PyICU-test") for i in range(32))
+
+
 @pytest.mark.parametrize(
     "lang,text,expected_tokenized",
     [
@@ -55,6 +55,7 @@ def samples_dir():
         ],
         taskcluster_secret=None,
         publish_group_logs=False,
+        columnar_dir=None,
     ),
 )
 @patch("translations_parser.publishers.wandb")
@@ -102,6 +103,8 @@ def test_taskcluster(wandb_mock, getargs_mock, disable_wandb, caplog, samples_di
     return_value=argparse.Namespace(
         directory=Path(__file__).parent / "data" / "experiments_1_10",
         mode="snakemake",
+        columnar_dir=None,
+        no_wandb=False,
     ),
 )
 @patch("translations_parser.publishers.wandb")
@@ -226,6 +229,8 @@ def test_experiments_marian_1_10(
     return_value=argparse.Namespace(
         directory=Path(__file__).parent / "data" / "experiments_1_12",
         mode="snakemake",
+        columnar_dir=None,
+        no_wandb=False,
     ),
 )
 @patch("translations_parser.publishers.wandb")
@@ -336,6 +341,7 @@ def test_experiments_marian_1_12(
         ],
         taskcluster_secret=None,
         publish_group_logs=False,
+        columnar_dir=None,
     ),
 )
 @patch("translations_parser.publishers.wandb")
@@ -383,6 +389,7 @@ def test_taskcluster_wandb_initialization_failure(
         ],
         taskcluster_secret=None,
         publish_group_logs=False,
+        columnar_dir=None,
     ),
 )
 @patch("translations_parser.publishers.wandb")
@@ -436,6 +443,7 @@ def test_taskcluster_wandb_log_failures(
         ],
         taskcluster_secret=None,
         publish_group_logs=False,
+        columnar_dir=None,
     ),
 )
 @patch("translations_parser.publishers.wandb")
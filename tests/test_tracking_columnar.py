@@ -0,0 +1,103 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from fixtures import DataDir
+from translations_parser import columnar
+from translations_parser.data import Metric
+from translations_parser.parser import TrainingParser
+from translations_parser.publishers import ColumnarExport
+
+"""
+Tests the columnar export of the parsed training logs, and loading it across runs
+"""
+
+taskcluster_log = Path(__file__).parent / "data" / "taskcluster.log"
+
+
+def export_run(output_dir: Path, project: str, group: str, run: str) -> None:
+    with taskcluster_log.open("r") as f:
+        lines = [line.strip() for line in f.readlines()]
+    metrics = [
+        Metric(importer="flores", dataset="devtest", augmentation=None, chrf=50.5, bleu_detok=25.0)
+    ]
+    parser = TrainingParser(
+        lines,
+        metrics=metrics,
+        publishers=[ColumnarExport(output_dir, project=project, group=group, run=run)],
+    )
+    parser.run()
+
+
+def test_columnar_export():
+    output_dir = Path(DataDir("test_columnar_export").path)
+    export_run(output_dir, "en-ru", "group_1", "student")
+
+    path = columnar.get_run_path(output_dir, "en-ru", "group_1", "student")
+    with np.load(path) as run_file:
+        assert run_file["training/up"].dtype == np.int64
+        assert run_file["training/learning_rate"].dtype == np.float64
+        assert run_file["metrics/dataset"].dtype.kind == "U"
+        assert len(run_file["training/up"]) == 102
+        assert len(run_file["validation/chrf"]) == 34
+        # Missing values are stored as NaN
+        assert np.isnan(run_file["metrics/comet"]).all()
+
+
+def test_load_table_across_runs():
+    output_dir = Path(DataDir("test_load_table_across_runs").path)
+    export_run(output_dir, "en-ru", "group_1", "student")
+    export_run(output_dir, "en-ru", "group_2", "teacher-1")
+    export_run(output_dir, "de-en", "group_3", "student")
+
+    validation = columnar.load_table(output_dir, "validation", columns=["up", "chrf"])
+    assert set(validation) == {"project", "group", "run", "up", "chrf"}
+    assert len(validation["up"]) == 3 * 34
+
+    validation = columnar.load_table(output_dir, "validation", columns=["chrf"], project="en-ru")
+    assert len(validation["chrf"]) == 2 * 34
+    assert set(validation["run"]) == {"student", "teacher-1"}
+    assert set(validation["group"]) == {"group_1", "group_2"}
+
+    metrics = columnar.load_table(output_dir, "metrics", group="group_3")
+    assert list(metrics["dataset"]) == ["devtest"]
+    assert list(metrics["chrf"]) == [50.5]
+    assert list(metrics["project"]) == ["de-en"]
+
+    empty = columnar.load_table(output_dir, "training", columns=["up"], project="fr-en")
+    assert len(empty["up"]) == 0
+
+
+def test_load_table_fills_missing_columns():
+    output_dir = Path(DataDir("test_load_table_fills_missing_columns").path)
+    table = columnar.Table("metrics")
+    table.append(
+        Metric(importer="flores", dataset="dev", augmentation=None, chrf=40.0, bleu_detok=20.0)
+    )
+    arrays = table.to_arrays()
+    # Simulate a file written before the comet column was added to the schema
+    del arrays["metrics/comet"]
+    path = columnar.get_run_path(output_dir, "en-ru", "group", "run")
+    path.parent.mkdir(parents=True)
+    np.savez_compressed(
+        path,
+        **arrays,
+        **{
+            "meta/schema_version": np.array(columnar.SCHEMA_VERSION),
+            "meta/project": np.array("en-ru"),
+            "meta/group": np.array("group"),
+            "meta/run": np.array("run"),
+        },
+    )
+
+    metrics = columnar.load_table(output_dir, "metrics", columns=["chrf", "comet"])
+    assert list(metrics["chrf"]) == [40.0]
+    assert len(metrics["comet"]) == 1
+    assert np.isnan(metrics["comet"][0])
+
+
+def test_load_table_unknown_columns():
+    with pytest.raises(ValueError, match="Unknown columns for the validation table: loss"):
+        columnar.load_table(Path("."), "validation", columns=["chrf", "loss"])
+    with pytest.raises(ValueError, match="Unknown table"):
+        columnar.load_table(Path("."), "evaluation")
@@ -0,0 +1,144 @@
+import io
+import logging
+from itertools import chain, islice, repeat
+from pathlib import Path
+
+from fixtures import DataDir
+from translations_parser.data import TrainingEpoch, ValidationEpoch
+from translations_parser.parser import TrainingParser
+from translations_parser.publishers import CSVExport, Publisher
+
+"""
+Tests the tracking parser directly, without the CLI entrypoints
+"""
+
+taskcluster_log = Path(__file__).parent / "data" / "taskcluster.log"
+
+
+class RecordingPublisher(Publisher):
+    def __init__(self) -> None:
+        self.training: list[TrainingEpoch] = []
+        self.validation: list[ValidationEpoch] = []
+
+    def handle_training(self, training: TrainingEpoch) -> None:
+        self.training.append(training)
+
+    def handle_validation(self, validation: ValidationEpoch) -> None:
+        self.validation.append(validation)
+
+
+def read_log_lines() -> list[str]:
+    with taskcluster_log.open("r") as f:
+        return [line.strip() for line in f.readlines()]
+
+
+def test_streaming_matches_full_parsing():
+    full_publisher = RecordingPublisher()
+    full_parser = TrainingParser(read_log_lines(), publishers=[full_publisher])
+    full_parser.run()
+
+    streaming_publisher = RecordingPublisher()
+    streaming_parser = TrainingParser(
+        read_log_lines(), publishers=[streaming_publisher], streaming=True, recent_lines=100
+    )
+    streaming_parser.run()
+
+    # The same entries are forwarded to the publishers.
+    assert len(full_publisher.training) == 102
+    assert len(full_publisher.validation) == 34
+    assert streaming_publisher.training == full_publisher.training
+    assert streaming_publisher.validation == full_publisher.validation
+    assert streaming_parser.config == full_parser.config
+    assert streaming_parser.parsed_lines_count == full_parser.parsed_lines_count
+
+    # Only the recent lines are retained in streaming mode.
+    assert streaming_parser.training == []
+    assert streaming_parser.validation == []
+    assert list(streaming_parser.parsed_logs) == full_parser.parsed_logs[-100:]
+
+
+def test_streaming_memory_is_bounded():
+    lines = read_log_lines()
+    training_line = next(line for line in lines if "Ep. 1 : Up. 1000 :" in line)
+    # Simulate a very long training by repeating a training line after the log.
+    long_log = chain(lines, islice(repeat(training_line), 50_000))
+    publisher = RecordingPublisher()
+    parser = TrainingParser(long_log, publishers=[publisher], streaming=True, recent_lines=50)
+    parser.run()
+
+    assert parser.training_count == 102 + 50_000
+    assert len(parser.parsed_logs) == 50
+    assert parser.training == []
+
+
+class LogsPublisher(Publisher):
+    """Records the full log written by the parser on close, like the W&B publisher."""
+
+    def open(self, parser=None) -> None:
+        self.parser = parser
+
+    def close(self) -> None:
+        self.logs = io.StringIO()
+        self.parser.write_logs(self.logs)
+
+
+def test_streaming_writes_full_logs(caplog):
+    full_parser = TrainingParser(read_log_lines(), publishers=[])
+    full_parser.run()
+
+    publisher = LogsPublisher()
+    parser = TrainingParser(
+        read_log_lines(), publishers=[publisher], streaming=True, recent_lines=100
+    )
+    parser.run()
+
+    # The early lines, with the Marian configuration, are written along the recent ones.
+    assert publisher.logs.getvalue() == "".join(f"{line}\n" for line in full_parser.parsed_logs)
+    assert len(parser.parsed_logs) == 100
+
+    with caplog.at_level(logging.WARNING):
+        assert len(parser.output.logs) == 100
+    assert f"Only the last 100 of {full_parser.parsed_lines_count} log lines" in caplog.text
+
+
+def test_csv_export_streaming():
+    data_dir = DataDir("test_csv_export_streaming")
+    parser = TrainingParser(
+        read_log_lines(), publishers=[CSVExport(Path(data_dir.path))], streaming=True
+    )
+    parser.run()
+
+    training_csv = data_dir.read_text("training.csv").splitlines()
+    validation_csv = data_dir.read_text("validation.csv").splitlines()
+    assert training_csv[0] == ",".join(TrainingEpoch.__annotations__)
+    assert len(training_csv) == 1 + 102
+    assert len(validation_csv) == 1 + 34
+
+
+def test_get_headers_fast_path():
+    parser = TrainingParser([], publishers=[])
+    # Lines that can't contain a header skip the regex.
+    assert parser.get_headers("Ep. 1 : Up. 1000 : Sen. 1 : Cost 1.0") == ([], 0)
+    assert parser.get_headers("[not a header]") == ([], 0)
+    headers, position = parser.get_headers(
+        "[task 2023-09-16T12:28:00.131Z] [2024-01-01 10:00:00] [valid] Ep. 1 : Up. 1000"
+    )
+    assert headers == [
+        ("task", "2023-09-16T12:28:00.131Z"),
+        ("2024-01-01", "10:00:00"),
+        ("valid",),
+    ]
+    assert position == len("[task 2023-09-16T12:28:00.131Z] [2024-01-01 10:00:00] [valid] ")
+
+
+def test_entries_are_dispatched_on_their_prefix():
+    lines = read_log_lines()
+    # Marian lines that aren't training or validation entries are interleaved with the log.
+    noise = "[task 2024-01-01T00:00:00.000Z] [2024-01-01 00:00:00] Saving model to model.npz"
+    noisy_lines = [line for entry in lines for line in (entry, noise)]
+    publisher = RecordingPublisher()
+    parser = TrainingParser(noisy_lines, publishers=[publisher])
+    parser.run()
+
+    assert len(publisher.training) == 102
+    assert len(publisher.validation) == 34
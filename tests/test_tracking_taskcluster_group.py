@@ -0,0 +1,145 @@
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+import pytest
+import taskcluster
+from fixtures import DataDir
+from translations_parser.cli import taskcluster_group
+
+"""
+Tests the Taskcluster group publication against a fake Taskcluster server
+"""
+
+QUEUE = "/api/queue/v1"
+
+
+class FakeTaskcluster:
+    """
+    Serve fixed responses for the queue API. The download URLs of the artifacts are served by
+    the same server, and can fail a number of times before succeeding.
+    """
+
+    def __init__(self) -> None:
+        self.responses: dict[str, tuple[int, bytes]] = {}
+        self.failures: Counter[str] = Counter()
+        self.requests: Counter[str] = Counter()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                path = unquote(urlparse(self.path).path)
+                fake.requests[path] += 1
+                if fake.failures[path] > 0:
+                    fake.failures[path] -= 1
+                    status, body = 500, b"{}"
+                else:
+                    status, body = fake.responses.get(path, (404, b'{"message": "Not found"}'))
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.root_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def add_json(self, path: str, data: dict) -> None:
+        self.responses[QUEUE + path] = (200, json.dumps(data).encode())
+
+    def add_task(self, task_id: str, group_id: str, dependencies: list[str]) -> None:
+        self.add_json(f"/task/{task_id}", {"dependencies": dependencies})
+        self.add_json(f"/task/{task_id}/status", {"status": {"taskGroupId": group_id}})
+
+    def add_artifact(self, task_id: str, run_id: int, name: str, content: bytes) -> str:
+        download_path = f"/downloads/{task_id}/{run_id}/{name}"
+        self.add_json(
+            f"/task/{task_id}/runs/{run_id}/artifact-content/{name}",
+            {"storageType": "s3", "url": self.root_url + download_path},
+        )
+        self.responses[download_path] = (200, content)
+        return download_path
+
+
+@pytest.fixture
+def fake_taskcluster(monkeypatch):
+    fake = FakeTaskcluster()
+    thread = threading.Thread(target=fake.server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(
+        taskcluster_group,
+        "queue",
+        taskcluster.Queue({"rootUrl": fake.root_url, "maxRetries": taskcluster_group.MAX_RETRIES}),
+    )
+    yield fake
+    fake.server.shutdown()
+    fake.server.server_close()
+
+
+def completed_task(task_id: str, run_id: int = 0) -> dict:
+    return {"status": {"taskId": task_id, "runs": [{"runId": run_id}]}}
+
+
+def test_get_logs_retries_and_caches(fake_taskcluster):
+    cache = taskcluster_group.ArtifactCache(Path(DataDir("test_tracking_tc_group").path))
+    download_path = fake_taskcluster.add_artifact(
+        "task1", 1, "public/build/train.log", b"line 1\nline 2"
+    )
+    # The download fails twice before succeeding
+    fake_taskcluster.failures[download_path] = 2
+
+    task = completed_task("task1", run_id=1)
+    assert taskcluster_group.get_logs(task, cache) == ["line 1", "line 2"]
+    assert fake_taskcluster.requests[download_path] == 3
+
+    # The logs are served from the cache when publishing again
+    fake_taskcluster.requests.clear()
+    assert taskcluster_group.get_logs(task, cache) == ["line 1", "line 2"]
+    assert not fake_taskcluster.requests
+
+
+def test_get_logs_missing_artifact(fake_taskcluster):
+    cache = taskcluster_group.ArtifactCache(Path(DataDir("test_tracking_tc_group").path))
+    assert taskcluster_group.get_logs(completed_task("missing"), cache) == []
+    assert not (cache.run_dir("missing", 0) / "artifacts").exists()
+
+
+def test_list_artifacts_caches(fake_taskcluster):
+    cache = taskcluster_group.ArtifactCache(Path(DataDir("test_tracking_tc_group").path))
+    fake_taskcluster.add_json(
+        "/task/eval1/runs/0/artifacts",
+        {
+            "artifacts": [
+                {"name": "public/build/devtest.metrics"},
+                {"name": "public/logs/live.log"},
+            ]
+        },
+    )
+    task = completed_task("eval1")
+    names = [artifact["name"] for artifact in taskcluster_group.list_artifacts(task, cache)]
+    assert names == ["public/build/devtest.metrics", "public/logs/live.log"]
+
+    fake_taskcluster.requests.clear()
+    assert taskcluster_group.list_artifacts(task, cache) == [{"name": name} for name in names]
+    assert not fake_taskcluster.requests
+
+
+def test_list_dependent_group_ids(fake_taskcluster):
+    # train (group A) depends on the backward model (group B) and a task of its own group.
+    # The backward model depends on a dataset task (group C).
+    fake_taskcluster.add_task("train", "A", ["backward", "merge"])
+    fake_taskcluster.add_task("merge", "A", ["merge-deps"])
+    fake_taskcluster.add_task("backward", "B", ["dataset"])
+    fake_taskcluster.add_task("dataset", "C", [])
+
+    group_ids = taskcluster_group.list_dependent_group_ids(["train"], {"A"}, workers=4)
+
+    assert group_ids == {"B", "C"}
+    # Dependencies of the known group are not browsed
+    assert not fake_taskcluster.requests[f"{QUEUE}/task/merge"]
+    assert fake_taskcluster.requests[f"{QUEUE}/task/dataset"] == 1
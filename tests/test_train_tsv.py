@@ -0,0 +1,154 @@
+import argparse
+import gzip
+import os
+import random
+from pathlib import Path
+
+import pytest
+from fixtures import DataDir, en_sample, ru_sample
+
+from pipeline.train.train import (
+    BestModelMetric,
+    ModelType,
+    Reservoir,
+    StudentModel,
+    TeacherMode,
+    TrainCLI,
+    TrainingType,
+    TsvCompression,
+    build_dataset_tsv,
+)
+
+en_lines = en_sample.splitlines()
+ru_lines = ru_sample.splitlines()
+# Every third line has an empty alignment.
+aln_lines = ["" if i % 3 == 0 else f"0-0 {i}-{i}" for i in range(len(en_lines))]
+
+
+def read_tsv(path: str) -> list[str]:
+    if path.endswith(".gz"):
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            return file.read().splitlines()
+    with open(path, "rt", encoding="utf-8") as file:
+        return file.read().splitlines()
+
+
+@pytest.mark.parametrize("compression", list(TsvCompression), ids=lambda c: c.value)
+@pytest.mark.parametrize("with_alignments", [True, False])
+def test_build_dataset_tsv(compression: TsvCompression, with_alignments: bool):
+    data_dir = DataDir("test_build_dataset_tsv")
+    data_dir.create_zst("corpus.en.zst", en_sample)
+    data_dir.create_zst("corpus.ru.zst", ru_sample)
+    alignments_file = None
+    if with_alignments:
+        alignments_file = Path(data_dir.create_zst("corpus.aln.zst", "\n".join(aln_lines) + "\n"))
+
+    tsv_path = build_dataset_tsv(
+        data_dir.join("corpus"),
+        "en",
+        "ru",
+        alignments_file,
+        compression,
+        threads=2,
+    )
+
+    expected_name = (
+        "corpus.enru.tsv.gz" if compression == TsvCompression.gzip else "corpus.enru.tsv"
+    )
+    assert tsv_path.name == expected_name
+    if with_alignments:
+        expected = [
+            f"{en}\t{ru}\t{aln}" for en, ru, aln in zip(en_lines, ru_lines, aln_lines) if aln
+        ]
+    else:
+        expected = [f"{en}\t{ru}" for en, ru in zip(en_lines, ru_lines)]
+    assert read_tsv(str(tsv_path)) == expected
+
+    # The original datasets are removed to free up disk space.
+    data_dir.assert_files([expected_name])
+
+
+def test_reservoir_is_bounded():
+    reservoir = Reservoir(size=10, rng=random.Random(1))
+    for i in range(10_000):
+        reservoir.add(i)
+
+    assert reservoir.count == 10_000
+    assert len(reservoir.items) == 10
+    assert len(set(reservoir.items)) == 10
+    # The sample is spread across the stream rather than the first items.
+    assert max(reservoir.items) > 1000
+
+
+def get_train_cli(data_dir: DataDir, **kwargs) -> TrainCLI:
+    for prefix in ["corpus", "mono", "devset"]:
+        data_dir.create_zst(f"{prefix}.en.zst", en_sample)
+        data_dir.create_zst(f"{prefix}.ru.zst", ru_sample)
+    for prefix in ["corpus", "mono"]:
+        data_dir.create_zst(f"{prefix}.aln.zst", "\n".join(aln_lines) + "\n")
+
+    args = argparse.Namespace(
+        src_vocab=Path("tests/data/vocab.spm"),
+        trg_vocab=Path("tests/data/vocab.spm"),
+        src="en",
+        trg="ru",
+        seed=1,
+        train_set_prefixes=f"{data_dir.join('corpus')},{data_dir.join('mono')}",
+        alignments=f"{data_dir.join('corpus.aln.zst')},{data_dir.join('mono.aln.zst')}",
+        validation_set_prefix=data_dir.join("devset"),
+        artifacts=Path(data_dir.path),
+        model_type=ModelType.teacher,
+        student_model=StudentModel.none,
+        teacher_mode=TeacherMode.two_stage,
+        training_type=TrainingType.train,
+        best_model_metric=BestModelMetric.chrf,
+        extra_marian_args=[],
+        marian_dir=Path(data_dir.path),
+        gpus="0",
+        workspace="1000",
+        tsv_compression=TsvCompression.none,
+        dataset_processes=None,
+    )
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    return TrainCLI(args, Path(data_dir.path))
+
+
+def test_train_cli_builds_datasets_concurrently():
+    data_dir = DataDir("test_train_cli_builds_datasets_concurrently")
+    train_cli = get_train_cli(data_dir, tsv_compression=TsvCompression.gzip)
+
+    train_cli.build_datasets()
+    train_cli.generate_opustrainer_config()
+    train_cli.wait_for_datasets()
+
+    assert train_cli.config_variables["dataset0"] == Path(data_dir.join("corpus.enru.tsv.gz"))
+    assert train_cli.config_variables["dataset1"] == Path(data_dir.join("mono.enru.tsv.gz"))
+    assert train_cli.validation_set == Path(data_dir.join("devset.enru.tsv.gz"))
+    assert not train_cli.pending_datasets
+    data_dir.assert_files(
+        [
+            "corpus.enru.tsv.gz",
+            "mono.enru.tsv.gz",
+            "devset.enru.tsv.gz",
+            "config.opustrainer.yml",
+        ]
+    )
+    assert read_tsv(data_dir.join("devset.enru.tsv.gz")) == [
+        f"{en}\t{ru}" for en, ru in zip(en_lines, ru_lines)
+    ]
+
+
+def test_train_cli_dataset_build_error():
+    data_dir = DataDir("test_train_cli_dataset_build_error")
+    # The backtranslations are missing, so their build fails.
+    train_cli = get_train_cli(
+        data_dir,
+        train_set_prefixes=f"{data_dir.join('corpus')},{data_dir.join('missing')}",
+    )
+
+    train_cli.build_datasets()
+    with pytest.raises(FileNotFoundError):
+        train_cli.wait_for_datasets()
+    assert not train_cli.dataset_executor
+    assert not os.path.exists(data_dir.join("missing.enru.tsv"))
@@ -4,6 +4,9 @@ Publish multiple experiments to Weight & Biases.
 
 Example:
     parse_experiment_dir -d ./tests/data/experiments
+
+The experiments can also be exported to compact columnar files, see translations_parser.columnar:
+    parse_experiment_dir -d ./tests/data/experiments --columnar-dir ./columnar --no-wandb
 """
 
 import argparse
@@ -15,7 +18,7 @@ from pathlib import Path
 
 from translations_parser.data import Metric
 from translations_parser.parser import TrainingParser
-from translations_parser.publishers import WandB
+from translations_parser.publishers import ColumnarExport, Publisher, WandB
 from translations_parser.utils import parse_task_label, parse_gcp_metric
 
 logger = logging.getLogger(__name__)
@@ -44,6 +47,17 @@ def get_args() -> argparse.Namespace:
         type=Path,
         default=Path(Path(os.getcwd())),
     )
+    parser.add_argument(
+        "--columnar-dir",
+        help="Directory to export the runs as compact columnar files.",
+        type=Path,
+        default=None,
+    )
+    parser.add_argument(
+        "--no-wandb",
+        help="Do not publish the runs to Weight & Biases, e.g. to only export them.",
+        action="store_true",
+    )
     return parser.parse_args()
 
 
@@ -56,9 +70,11 @@ def parse_experiment(
     logs_file: Path,
     metrics_dir: Path | None = None,
     mode=ExperimentMode,
+    columnar_dir: Path | None = None,
+    wandb_publication: bool = True,
 ) -> None:
     """
-    Parse logs from a Taskcluster dump and publish data to W&B.
+    Parse logs from a Taskcluster dump and publish data to W&B and/or a columnar export.
     If a metrics directory is set, initially read and publish each `.metrics` values.
     """
     metrics = []
@@ -78,19 +94,27 @@ def parse_experiment(
                     )
                 )
 
-    with logs_file.open("r") as f:
-        lines = (line.strip() for line in f.readlines())
-    parser = TrainingParser(
-        lines,
-        metrics=metrics,
-        publishers=[
+    publishers: list[Publisher] = []
+    if wandb_publication:
+        publishers.append(
             WandB(
                 project=project,
                 group=group,
                 name=name,
                 suffix=suffix,
             )
-        ],
+        )
+    if columnar_dir:
+        publishers.append(
+            ColumnarExport(columnar_dir, project=project, group=group, run=f"{name}{suffix}")
+        )
+
+    with logs_file.open("r") as f:
+        lines = (line.strip() for line in f.readlines())
+    parser = TrainingParser(
+        lines,
+        metrics=metrics,
+        publishers=publishers,
     )
     parser.run()
 
@@ -157,12 +181,17 @@ def main() -> None:
                     logs_file=file,
                     metrics_dir=metrics_dir,
                     mode=mode,
+                    columnar_dir=args.columnar_dir,
+                    wandb_publication=not args.no_wandb,
                 )
             except Exception as e:
                 logger.error(f"An exception occured parsing training file {file}: {e}")
             else:
                 published_runs.append(name)
 
+        if args.no_wandb:
+            continue
+
         # Try to publish related log files to the group on a last run named "group_logs"
         logger.info(
             f"Publishing '{project}/{group}' evaluation metrics and files (fake run 'group_logs')"
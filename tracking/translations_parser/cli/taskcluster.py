@@ -22,7 +22,7 @@ from pathlib import Path
 
 import taskcluster
 from translations_parser.parser import TrainingParser, logger
-from translations_parser.publishers import CSVExport, Publisher
+from translations_parser.publishers import ColumnarExport, CSVExport, Publisher
 from translations_parser.utils import (
     publish_group_logs_from_tasks,
     suffix_from_group,
@@ -58,6 +58,15 @@ def get_args() -> argparse.Namespace:
         type=Path,
         default=Path(__file__).parent.parent / "output",
     )
+    parser.add_argument(
+        "--columnar-dir",
+        help=(
+            "Directory to export the training and validation data and the metrics of the run "
+            "as a compact columnar file, to be loaded across runs with translations_parser.columnar."
+        ),
+        type=Path,
+        default=None,
+    )
     parser.add_argument(
         "--verbose",
         "-v",
@@ -128,6 +137,18 @@ def boot() -> None:
         artifacts=args.wandb_artifacts,
         publication=args.wandb_publication,
     )
+    if args.columnar_dir:
+        if wandb_publisher:
+            names = (wandb_publisher.project, wandb_publisher.group, wandb_publisher.run)
+        else:
+            names = (args.wandb_project, args.wandb_group, args.wandb_run_name)
+        project, group, run = names
+        if not (project and group and run):
+            raise Exception(
+                "The columnar export requires the --wandb-project, --wandb-group "
+                "and --wandb-run-name names."
+            )
+        publishers.append(ColumnarExport(args.columnar_dir, project=project, group=group, run=run))
     if wandb_publisher:
         publishers.append(wandb_publisher)
     elif args.publish_group_logs:
@@ -161,6 +182,8 @@ def boot() -> None:
         lines,
         publishers=publishers,
         log_filter=log_filter,
+        # Keep the memory flat when following a live training, which can run for days
+        streaming=args.from_stream,
     )
     parser.run()
 
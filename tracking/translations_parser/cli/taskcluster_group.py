@@ -2,15 +2,22 @@
 """
 Track training experiments from a Taskcluster group and publish them to Weight and Biases.
 
+Logs and metrics are downloaded concurrently, and cached on disk by task and run ID, so that
+publishing a group again doesn't download the artifacts again.
+
 Example:
     track_tc_group --group-id=<group_id>
 """
 
 import argparse
+import json
 import logging
+import os
 import tempfile
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterable
 
 import wandb
 
@@ -28,7 +35,16 @@ from translations_parser.utils import (
 )
 
 KIND_TAG_TARGET = ("train", "finetune")
-queue = taskcluster.Queue({"rootUrl": "https://firefox-ci-tc.services.mozilla.com"})
+ROOT_URL = "https://firefox-ci-tc.services.mozilla.com"
+# The Taskcluster client retries failed API calls and downloads with an exponential backoff
+MAX_RETRIES = 5
+# Number of concurrent requests to Taskcluster
+FETCH_WORKERS = 8
+DEFAULT_CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "translations_parser"
+)
+
+queue = taskcluster.Queue({"rootUrl": ROOT_URL, "maxRetries": MAX_RETRIES})
 
 
 def get_args() -> argparse.Namespace:
@@ -49,6 +65,23 @@ def get_args() -> argparse.Namespace:
         help="Override runs on Weight & Biases.",
         action="store_true",
     )
+    parser.add_argument(
+        "--workers",
+        help="Number of concurrent requests to Taskcluster.",
+        type=int,
+        default=FETCH_WORKERS,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory where the artifacts of completed tasks are cached.",
+        type=Path,
+        default=DEFAULT_CACHE_DIR,
+    )
+    parser.add_argument(
+        "--no-cache",
+        help="Always download the artifacts from Taskcluster.",
+        action="store_true",
+    )
     parser.add_argument(
         "--verbose",
         "-v",
@@ -60,27 +93,117 @@ def get_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def get_logs(task: dict) -> list[str]:
+class ArtifactCache:
+    """
+    Cache the artifacts of completed tasks on disk. The artifacts of a task run can't change
+    once it is completed, so they are stored by task and run ID without any expiration:
+
+    cache_dir
+    └── <task_id>
+        └── <run_id>
+            ├── artifacts.json
+            └── artifacts
+                └── public/build/train.log
+    """
+
+    def __init__(self, cache_dir: Path) -> None:
+        self.cache_dir = cache_dir
+
+    def run_dir(self, task_id: str, run_id: int) -> Path:
+        return self.cache_dir / task_id / str(run_id)
+
+    def read(self, path: Path) -> bytes | None:
+        if not path.exists():
+            return None
+        return path.read_bytes()
+
+    def write(self, path: Path, content: bytes) -> None:
+        # Write atomically so that an interrupted download doesn't leave a partial artifact
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, path)
+
+    def get_artifact(self, task_id: str, run_id: int, name: str) -> bytes | None:
+        return self.read(self.run_dir(task_id, run_id) / "artifacts" / name)
+
+    def set_artifact(self, task_id: str, run_id: int, name: str, content: bytes) -> None:
+        self.write(self.run_dir(task_id, run_id) / "artifacts" / name, content)
+
+    def get_artifacts_list(self, task_id: str, run_id: int) -> list[dict] | None:
+        content = self.read(self.run_dir(task_id, run_id) / "artifacts.json")
+        return None if content is None else json.loads(content)
+
+    def set_artifacts_list(self, task_id: str, run_id: int, artifacts: list[dict]) -> None:
+        self.write(
+            self.run_dir(task_id, run_id) / "artifacts.json",
+            json.dumps(artifacts).encode(),
+        )
+
+
+def get_run_id(task: dict) -> int:
+    """The last run of a completed task is the one that completed"""
+    return task["status"]["runs"][-1]["runId"]
+
+
+def download_artifact(task: dict, name: str, cache: ArtifactCache | None) -> bytes:
+    task_id = task["status"]["taskId"]
+    run_id = get_run_id(task)
+    if cache and (content := cache.get_artifact(task_id, run_id, name)) is not None:
+        logger.debug(f"Using cached artifact {name} for task {task_id}")
+        return content
+
+    buffer, _ = downloadArtifactToBuf(
+        taskId=task_id,
+        runId=run_id,
+        name=name,
+        queueService=queue,
+        maxRetries=MAX_RETRIES,
+    )
+    content = buffer.tobytes()
+    if cache:
+        cache.set_artifact(task_id, run_id, name, content)
+    return content
+
+
+def list_artifacts(task: dict, cache: ArtifactCache | None) -> list[dict]:
+    task_id = task["status"]["taskId"]
+    run_id = get_run_id(task)
+    if cache and (artifacts := cache.get_artifacts_list(task_id, run_id)) is not None:
+        return artifacts
+
+    response = queue.listArtifacts(task_id, run_id)
+    artifacts = response["artifacts"]
+    while continuation_token := response.get("continuationToken"):
+        response = queue.listArtifacts(task_id, run_id, {"continuationToken": continuation_token})
+        artifacts.extend(response["artifacts"])
+    if cache:
+        cache.set_artifacts_list(task_id, run_id, artifacts)
+    return artifacts
+
+
+def get_logs(task: dict, cache: ArtifactCache | None = None) -> list[str]:
     """Retrieve training logs from Taskcluster"""
     task_id = task["status"]["taskId"]
 
     logger.info(f"Downloading logs for task {task_id}")
     try:
-        log, _ = downloadArtifactToBuf(
-            taskId=task_id,
-            name="public/build/train.log",
-            queueService=queue,
-        )
+        log = download_artifact(task, "public/build/train.log", cache)
     except Exception as e:
         logger.error(f"Could not retrieve logs: {e}")
         return []
-    return log.tobytes().decode().split("\n")
+    return log.decode().split("\n")
 
 
 def publish_task(
-    *, project: str, group: str, name: str, suffix: str, task: dict, metrics: list[Metric]
+    *,
+    project: str,
+    group: str,
+    name: str,
+    suffix: str,
+    logs: list[str],
+    metrics: list[Metric],
 ) -> None:
-    logs = get_logs(task)
     if not logs:
         logger.warning(f"Skipping publication of training task {name}")
         return
@@ -100,21 +223,17 @@ def publish_task(
     parser.run()
 
 
-def get_metrics_from_task(task: dict) -> list[Metric]:
+def get_metrics_from_task(task: dict, cache: ArtifactCache | None = None) -> list[Metric]:
     task_id = task["status"]["taskId"]
 
     logger.info(f"Retrieving artifacts from evaluation task {task_id}")
 
     metrics = []
-    for artifact in queue.listLatestArtifacts(task_id)["artifacts"]:
+    for artifact in list_artifacts(task, cache):
         if not artifact["name"].endswith(".metrics"):
             continue
 
-        log, _ = downloadArtifactToBuf(
-            taskId=task_id,
-            name=artifact["name"],
-            queueService=queue,
-        )
+        log = download_artifact(task, artifact["name"], cache)
 
         tag = task["task"]["tags"]["label"]
         # Remove eventual slashes (e.g. <task_tag>-1/2) that cannot be written to the filesystem
@@ -123,7 +242,7 @@ def get_metrics_from_task(task: dict) -> list[Metric]:
         with tempfile.TemporaryDirectory() as temp_dir:
             file = Path(temp_dir) / f"{tag}.txt"
             with file.open("wb") as log_file:
-                log_file.write(log.tobytes())
+                log_file.write(log)
                 log_file.flush()
                 metrics.append(Metric.from_file(Path(log_file.name)))
 
@@ -146,7 +265,8 @@ def filter_task(task: dict) -> tuple[str, dict] | tuple[None, None]:
 
 def list_training_tasks(group_id: str, grouped_tasks: dict[str, list[dict]]) -> list[list[dict]]:
     training_tasks = sum(
-        [tasks for key, tasks in grouped_tasks.items() if key in KIND_TAG_TARGET], start=[]
+        [tasks for key, tasks in grouped_tasks.items() if key in KIND_TAG_TARGET],
+        start=[],
     )
 
     if not training_tasks:
@@ -192,7 +312,12 @@ def list_completed_tasks(group_id: str) -> dict[str, list[dict]]:
     return grouped_tasks
 
 
-def publish_task_group(group_id: str, override: bool = False) -> None:
+def publish_task_group(
+    group_id: str,
+    override: bool = False,
+    cache: ArtifactCache | None = None,
+    workers: int = FETCH_WORKERS,
+) -> None:
     logger.info(f"Retrieving task group {group_id}")
 
     # Ensure task group is readable
@@ -231,9 +356,9 @@ def publish_task_group(group_id: str, override: bool = False) -> None:
             logger.warning(f"Deleting existing run {run.display_name}.")
             run.delete()
 
-    # Publish training tasks as runs
+    # Associate metrics to each runs (evaluate tasks that depends on the training task)
+    runs_metrics_tasks = []
     for training_task in training_tasks:
-        # Associate metrics to each runs (evaluate tasks that depends on the training task)
         dependent_tasks = []
         for eval_id, eval_task in metrics_tasks.items():
             eval_label = eval_task["task"]["tags"].get("label", "")
@@ -249,23 +374,31 @@ def publish_task_group(group_id: str, override: bool = False) -> None:
                 and model_name == training_task["name"]
             ):
                 dependent_tasks.append(eval_id)
-
-        metrics = sum(
-            [
-                get_metrics_from_task(metrics_tasks.pop(dependent_task_id))
-                for dependent_task_id in dependent_tasks
-            ],
-            start=[],
+        runs_metrics_tasks.append(
+            [metrics_tasks.pop(dependent_task_id) for dependent_task_id in dependent_tasks]
         )
 
-        publish_task(
-            project=project_name,
-            group=group_name,
-            suffix=suffix,
-            name=training_task["name"],
-            task=training_task,
-            metrics=metrics,
-        )
+    # Download all the logs and metrics concurrently, publication to W&B is sequential
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        logs_futures = [executor.submit(get_logs, task, cache) for task in training_tasks]
+        metrics_futures = [
+            [executor.submit(get_metrics_from_task, task, cache) for task in dependent_tasks]
+            for dependent_tasks in runs_metrics_tasks
+        ]
+
+        # Publish training tasks as runs
+        for training_task, logs_future, run_metrics_futures in zip(
+            training_tasks, logs_futures, metrics_futures
+        ):
+            metrics = sum([future.result() for future in run_metrics_futures], start=[])
+            publish_task(
+                project=project_name,
+                group=group_name,
+                suffix=suffix,
+                name=training_task["name"],
+                logs=logs_future.result(),
+                metrics=metrics,
+            )
 
     # Group and publish remaining metrics tasks via the logs publication
     publish_group_logs_from_tasks(
@@ -277,22 +410,35 @@ def publish_task_group(group_id: str, override: bool = False) -> None:
     )
 
 
-def list_dependent_group_ids(task_id: str, known: set[str]):
-    task = queue.task(task_id)
-
-    # Browse task dependencies
-    for dependent_task_id in task["dependencies"]:
-        dependent_status = queue.status(dependent_task_id)
-
-        group_id = dependent_status["status"]["taskGroupId"]
-        if group_id in known:
-            continue
-
-        yield group_id
-        known.add(group_id)
+def list_dependent_group_ids(
+    task_ids: Iterable[str], known: set[str], workers: int = FETCH_WORKERS
+) -> set[str]:
+    """
+    Browse the dependencies of the tasks to find the groups they were run in. The dependencies
+    are browsed level by level, querying all the tasks of a level concurrently.
+    """
+    group_ids = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        task_ids = list(task_ids)
+        while task_ids:
+            dependent_task_ids = [
+                dependent_task_id
+                for task in executor.map(queue.task, task_ids)
+                for dependent_task_id in task["dependencies"]
+            ]
+            # Only browse the dependencies of tasks from groups that were not known yet
+            task_ids = []
+            for dependent_task_id, dependent_status in zip(
+                dependent_task_ids, executor.map(queue.status, dependent_task_ids)
+            ):
+                group_id = dependent_status["status"]["taskGroupId"]
+                if group_id in known:
+                    continue
+                known.add(group_id)
+                group_ids.add(group_id)
+                task_ids.append(dependent_task_id)
 
-        # Shared instance of `known` to propagate discovered groups in real time across all recursion branches
-        yield from list_dependent_group_ids(dependent_task_id, known)
+    return group_ids
 
 
 def main() -> None:
@@ -301,17 +447,21 @@ def main() -> None:
     if args.loglevel:
         logger.setLevel(args.loglevel)
 
+    cache = None if args.no_cache else ArtifactCache(args.cache_dir)
+
     groups_ids = {args.group_id}
     if not args.no_recursive_lookup:
         logger.info(f"Retrieving related groups from {args.group_id} training tasks dependencies")
 
         completed_tasks = list_completed_tasks(args.group_id)
         training_tasks = list_training_tasks(args.group_id, completed_tasks)
-        for training_task in training_tasks:
-            dependent_ids = list_dependent_group_ids(
-                training_task["status"]["taskId"], {*groups_ids}
+        groups_ids.update(
+            list_dependent_group_ids(
+                [training_task["status"]["taskId"] for training_task in training_tasks],
+                {*groups_ids},
+                workers=args.workers,
             )
-            groups_ids.update(dependent_ids)
+        )
 
         logger.info(
             f"Found {len(groups_ids) - 1} additional groups to browse for WandB publication"
@@ -322,4 +472,6 @@ def main() -> None:
         )
 
     for group_id in groups_ids:
-        publish_task_group(group_id, override=args.override_runs)
+        publish_task_group(
+            group_id, override=args.override_runs, cache=cache, workers=args.workers
+        )
@@ -0,0 +1,203 @@
+"""
+Compact columnar storage of the parsed training metrics, to build cross-run dashboards
+without going through the W&B history of every run.
+
+Each run is stored in a compressed NumPy `.npz` file, with a column per field of the training
+and validation entries and of the evaluation metrics:
+
+output_dir
+└── <project>                e.g. en-ru
+    └── <group>              e.g. spring-2024_J3av8ewURni5QQqP2u3QRg
+        └── <run>.npz        e.g. student_J3av8.npz
+
+The arrays of a run file are named "<table>/<column>", e.g. "validation/chrf". The dtypes
+are derived from the dataclasses, so the schema is stable:
+ - int fields are stored as int64,
+ - float and optional fields are stored as float64, with NaN for missing values,
+ - str fields are stored as unicode, with "" for missing values.
+
+Example:
+    columns = load_table("output", "validation", columns=["up", "chrf"], project="en-ru")
+    columns["run"], columns["up"], columns["chrf"]
+"""
+
+import logging
+import os
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import NoneType
+from typing import Any, Iterable, Sequence, get_args
+
+import numpy as np
+import numpy.typing as npt
+
+from translations_parser.data import Metric, TrainingEpoch, ValidationEpoch
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+TABLES: dict[str, type] = {
+    "training": TrainingEpoch,
+    "validation": ValidationEpoch,
+    "metrics": Metric,
+}
+# The identifiers of the run, which are added as columns when loading a table
+RUN_COLUMNS = ("project", "group", "run")
+# Number of files read concurrently by the loader
+LOAD_WORKERS = 8
+
+
+def get_dtype(annotation: Any) -> np.dtype:
+    types = set(get_args(annotation)) or {annotation}
+    optional = NoneType in types
+    types.discard(NoneType)
+    if types == {str}:
+        return np.dtype(str)
+    if types == {int} and not optional:
+        return np.dtype(np.int64)
+    return np.dtype(np.float64)
+
+
+SCHEMA: dict[str, dict[str, np.dtype]] = {
+    table: {
+        field: get_dtype(annotation) for field, annotation in dataclass.__annotations__.items()
+    }
+    for table, dataclass in TABLES.items()
+}
+
+
+class Table:
+    """
+    Accumulate the entries of a table column by column. Numeric columns are stored in compact
+    arrays rather than lists of Python objects.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.schema = SCHEMA[name]
+        self.columns: dict[str, array | list[str]] = {
+            column: [] if dtype.kind == "U" else array("q" if dtype.kind == "i" else "d")
+            for column, dtype in self.schema.items()
+        }
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values())))
+
+    def append(self, entry: Any) -> None:
+        for column, value in vars(entry).items():
+            values = self.columns[column]
+            if isinstance(values, list):
+                values.append("" if value is None else str(value))
+            else:
+                values.append(np.nan if value is None else value)
+
+    def to_arrays(self) -> dict[str, npt.NDArray]:
+        return {
+            f"{self.name}/{column}": np.array(values, dtype=self.schema[column])
+            for column, values in self.columns.items()
+        }
+
+
+def get_run_path(output_dir: Path, project: str, group: str, run: str) -> Path:
+    return output_dir / project / group / f"{run}.npz"
+
+
+def write_run(
+    output_dir: Path, project: str, group: str, run: str, tables: Iterable[Table]
+) -> Path:
+    """
+    Write the tables of a run, replacing a previous export of the same run.
+    """
+    path = get_run_path(output_dir, project, group, run)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    arrays: dict[str, npt.NDArray] = {
+        "meta/schema_version": np.array(SCHEMA_VERSION),
+        "meta/project": np.array(project),
+        "meta/group": np.array(group),
+        "meta/run": np.array(run),
+    }
+    for table in tables:
+        arrays.update(table.to_arrays())
+
+    # Write atomically so that the loader never reads a partial file
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+def list_runs(directory: Path, project: str | None = None, group: str | None = None) -> list[Path]:
+    """
+    List the run files, optionally for a single project (language pair) or group.
+    """
+    return sorted(directory.glob(f"{project or '*'}/{group or '*'}/*.npz"))
+
+
+def read_run_table(path: Path, table: str, columns: Sequence[str]) -> dict[str, npt.NDArray]:
+    """
+    Read the columns of a table from a run file. Only the requested columns are decompressed.
+    Columns that are missing from the file, e.g. added to the schema later on, are filled with
+    missing values.
+    """
+    with np.load(path, allow_pickle=False) as run_file:
+        schema_version = int(run_file["meta/schema_version"])
+        if schema_version > SCHEMA_VERSION:
+            raise ValueError(f"Unsupported schema version {schema_version} in {path}")
+
+        length = None
+        result: dict[str, npt.NDArray] = {}
+        for column in columns:
+            key = f"{table}/{column}"
+            if key in run_file.files:
+                result[column] = run_file[key]
+                length = len(result[column])
+        if length is None:
+            # Use any column of the table to find the number of rows
+            key = next((key for key in run_file.files if key.startswith(f"{table}/")), None)
+            length = len(run_file[key]) if key else 0
+
+        for column in columns:
+            if column not in result:
+                dtype = SCHEMA[table][column]
+                missing = "" if dtype.kind == "U" else np.nan
+                result[column] = np.full(length, missing, dtype=dtype)
+        for column in RUN_COLUMNS:
+            result[column] = np.full(length, str(run_file[f"meta/{column}"]))
+    return result
+
+
+def load_table(
+    directory: Path,
+    table: str,
+    columns: Sequence[str] | None = None,
+    project: str | None = None,
+    group: str | None = None,
+    workers: int = LOAD_WORKERS,
+) -> dict[str, npt.NDArray]:
+    """
+    Load a table across all the runs, optionally for a single project (language pair) or group,
+    as a dict of concatenated columns. The "project", "group" and "run" columns identify the
+    run of each row.
+    """
+    if table not in SCHEMA:
+        raise ValueError(f"Unknown table {table}, expected one of {', '.join(SCHEMA)}")
+    columns = list(columns if columns is not None else SCHEMA[table])
+    unknown = set(columns) - set(SCHEMA[table])
+    if unknown:
+        raise ValueError(f"Unknown columns for the {table} table: {', '.join(sorted(unknown))}")
+
+    paths = list_runs(directory, project=project, group=group)
+    logger.info(f"Loading the {table} table from {len(paths)} runs")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        runs = list(executor.map(lambda path: read_run_table(path, table, columns), paths))
+
+    result = {}
+    for column in [*RUN_COLUMNS, *columns]:
+        if runs:
+            result[column] = np.concatenate([run[column] for run in runs])
+        else:
+            dtype = SCHEMA[table].get(column, np.dtype(str))
+            result[column] = np.array([], dtype=dtype)
+    return result
@@ -2,13 +2,15 @@ import logging
 import os
 import re
 import shlex
+import shutil
 import sys
-from collections import defaultdict
-from collections.abc import Iterable, Iterator, Sequence
+import tempfile
+from collections import defaultdict, deque
+from collections.abc import Iterable, Iterator, MutableSequence, Sequence
 from datetime import datetime
-from itertools import tee
+from itertools import chain
 from pathlib import Path
-from typing import Callable, DefaultDict, List
+from typing import Callable, DefaultDict, TextIO
 
 import yaml
 
@@ -41,12 +43,36 @@ TRAINING_RE = re.compile(
     r"([ :]+L.r. (?P<learning_rate>[\d\.e-]+))?"
 )
 
+# Training and validation entries all start with this prefix. Checking it first is a cheap way
+# to skip the detailed regular expressions on the vast majority of the log lines.
+EPOCH_PREFIX = "Ep."
+# Keys that must be parsed from multiple lines to build a complete validation entry
+VALIDATION_EXPECTED_KEYS = frozenset(
+    key
+    for key in ValidationEpoch.__annotations__.keys()
+    if not (
+        # Stalled data are not necessary present on validation entries
+        key.endswith("_stalled")
+        or key in ("epoch", "up", "perplexity")
+    )
+)
+
 # Expected version of Marian for a clean parsing
 SUPPORTED_MARIAN_VERSIONS = [(1, 10), (1, 12)]
 
 MARIAN_ARGS_REGEX = re.compile(r"command line:[\n ]+[\w\/-]+\/marian +(.*)")
 # Last Marian command line argument (not being part of training extra arguments)
 LAST_MARIAN_DECLARED_ARGUMENT = "seed"
+# Number of recent log lines kept in memory by the parser in streaming mode
+STREAMING_RECENT_LINES = 10_000
+
+
+def _join_tags(seq):
+    if not seq:
+        return None
+    if isinstance(seq[0], str):
+        return "_".join([item for item in seq if item is not None])
+    return _join_tags([_join_tags(item) for item in seq if item is not None])
 
 
 class TrainingParser:
@@ -57,6 +83,8 @@ class TrainingParser:
         log_filter: Callable | None = None,
         skip_marian_context: bool = False,
         metrics: Sequence[Metric] | None = None,
+        streaming: bool = False,
+        recent_lines: int = STREAMING_RECENT_LINES,
     ) -> None:
         # Iterable reading logs lines
         self.logs_iter = logs_iter
@@ -65,7 +93,18 @@ class TrainingParser:
         self._current_index = 0
         self.parsed = False
         self.config: dict = {}
-        self.parsed_logs: List[str] = []
+        # In streaming mode, entries are only forwarded to the publishers and a bounded
+        # number of recent lines is kept, so the memory usage is flat over long trainings.
+        # The full log is spooled to a temporary file instead, to be published on close.
+        self.streaming = streaming
+        self.parsed_logs: MutableSequence[str] = deque(maxlen=recent_lines) if streaming else []
+        self._logs_file: TextIO | None = (
+            tempfile.TemporaryFile("w+", encoding="utf-8") if streaming else None
+        )
+        # Counts are kept separately as entries are not stored in streaming mode
+        self.parsed_lines_count = 0
+        self.training_count = 0
+        self.validation_count = 0
         # Optional list of Metric published earlier to the parsing
         self.metrics = metrics
         self.training: list[TrainingEpoch] = []
@@ -88,6 +127,9 @@ class TrainingParser:
         Returns a list of tuples representing all headers of a log line
         and the position of the last character representing the header.
         """
+        # Fast path for lines that can't contain a header
+        if "] " not in line:
+            return ([], 0)
         matches = list(HEADER_RE.finditer(line))
         if not matches:
             return ([], 0)
@@ -136,7 +178,9 @@ class TrainingParser:
             for k, v in values.items()
         }
         training_epoch = TrainingEpoch(**casted_values)
-        self.training.append(training_epoch)
+        self.training_count += 1
+        if not self.streaming:
+            self.training.append(training_epoch)
         for publisher in self.publishers:
             try:
                 publisher.handle_training(training_epoch)
@@ -162,18 +206,11 @@ class TrainingParser:
         if results["stalled"] is not None:
             entry[f"{key}_stalled"] = float(results["stalled"])
         # Build a validation epoch from multiple lines
-        expected_keys = set(
-            key
-            for key in ValidationEpoch.__annotations__.keys()
-            if not (
-                # Stalled data are not necessary present on validation entries
-                key.endswith("_stalled")
-                or key in ("epoch", "up", "perplexity")
-            )
-        )
-        if not (expected_keys - set(entry.keys())):
+        if VALIDATION_EXPECTED_KEYS.issubset(entry.keys()):
             validation_epoch = ValidationEpoch(epoch=epoch, up=up, **entry)
-            self.validation.append(validation_epoch)
+            self.validation_count += 1
+            if not self.streaming:
+                self.validation.append(validation_epoch)
             for publisher in self.publishers:
                 try:
                     publisher.handle_validation(validation_epoch)
@@ -193,9 +230,11 @@ class TrainingParser:
         """
         for line in self.logs_iter:
             # When reading stdin stream, propagate raw lines to stdout
-            # and force flush on stdout to make sure every line gets displayed
+            # and force flush on stdout to make sure every line gets displayed.
+            # Flushing is skipped when reparsing a finished log, as it dominates the run time.
             sys.stdout.buffer.write(line.encode("utf-8"))
-            sys.stdout.buffer.flush()
+            if self.streaming:
+                sys.stdout.buffer.flush()
 
             self._current_index += 1
             headers, position = self.get_headers(line)
@@ -209,23 +248,17 @@ class TrainingParser:
                 self.run_date = self.get_timestamp(headers)
             text = line[position:]
 
-            def _join(seq):
-                if not seq:
-                    return None
-                if isinstance(seq[0], str):
-                    return "_".join([item for item in seq if item is not None])
-                return _join([_join(item) for item in seq if item is not None])
-
             # Record logs depending on Marian headers
             tag = None
             if len(headers) >= 2:
                 # The 2 first headers are ignored (task timestamp, then marian timestamp)
                 _, _, *marian_tags = headers
-                tag = _join(marian_tags)
-            if tag:
-                self.parsed_logs.append(f"[tag] {text}")
-            else:
-                self.parsed_logs.append(text)
+                tag = _join_tags(marian_tags)
+            entry = f"[tag] {text}" if tag else text
+            self.parsed_logs.append(entry)
+            if self._logs_file is not None:
+                self._logs_file.write(f"{entry}\n")
+            self.parsed_lines_count += 1
 
             yield headers, text
 
@@ -379,14 +412,13 @@ class TrainingParser:
         Iterates logs until the end to find training or validation
         data and report incomplete multiline logs.
         """
-        while True:
-            try:
-                headers, text = next(logs_iter)
-                training = self.parse_training_log(text)
-                if not training:
-                    self.parse_validation_log(headers, text)
-            except StopIteration:
-                break
+        for headers, text in logs_iter:
+            # Dispatch on a cheap prefix check before running the detailed regexes
+            if not text.startswith(EPOCH_PREFIX):
+                continue
+            training = self.parse_training_log(text)
+            if not training:
+                self.parse_validation_log(headers, text)
         if self._validation_entries.keys():
             logger.warning(
                 "Some validation data is incomplete with the following epoch/up couples:"
@@ -406,10 +438,18 @@ class TrainingParser:
 
         logger.info("Reading logs stream.")
         if not self.skip_marian_context:
-            # Copy logs iterable so we avoid reading out of context lines.
+            # Record the context entries so they can be read again by the data parser. Unlike
+            # a tee, the remaining entries are then read directly from the logs iterator.
             # This will not affect inner self._current_index, as we stop incrementing after reading the context.
-            logs_iter, copy = tee(logs_iter)
-            self.parse_marian_context(copy)
+            context_entries: list[tuple[list[tuple[str]], str]] = []
+
+            def record_context() -> Iterator[tuple[list[tuple[str]], str]]:
+                for entry in logs_iter:
+                    context_entries.append(entry)
+                    yield entry
+
+            self.parse_marian_context(record_context())
+            logs_iter = chain(context_entries, logs_iter)
 
         for publisher in self.publishers:
             publisher.open(self)
@@ -431,16 +471,44 @@ class TrainingParser:
         for publisher in self.publishers:
             publisher.close()
 
+        if self._logs_file is not None:
+            self._logs_file.close()
+            self._logs_file = None
+
+    def write_logs(self, output: TextIO) -> None:
+        """
+        Writes every parsed log line to the output, one per line. In streaming mode, the lines
+        are read back from the temporary file, so the early lines are written too.
+        """
+        if self._logs_file is None:
+            for line in self.parsed_logs:
+                output.write(f"{line}\n")
+            return
+        self._logs_file.flush()
+        self._logs_file.seek(0)
+        shutil.copyfileobj(self._logs_file, output)
+        self._logs_file.seek(0, os.SEEK_END)
+
     @property
     def output(self) -> TrainingLog:
+        """
+        The parsed training log. In streaming mode, the training and validation entries are
+        not retained and only the recent logs lines are available. The full log is only
+        available to the publishers, through write_logs.
+        """
         if not self.parsed:
             raise Exception("Please run the parser before reading the output")
+        if self.parsed_lines_count > len(self.parsed_logs):
+            logger.warning(
+                f"Only the last {len(self.parsed_logs)} of {self.parsed_lines_count} "
+                "log lines are available in the output"
+            )
         return TrainingLog(
             run_date=self.run_date,
             configuration=self.config,
             training=self.training,
             validation=list(self.validation),
-            logs=self.parsed_logs,
+            logs=list(self.parsed_logs),
         )
 
     def run(self) -> None:
@@ -450,7 +518,6 @@ class TrainingParser:
         except StopIteration:
             raise ValueError("Not all required lines were found from the log file.")
 
-        count = len(self.parsed_logs)
-        logger.info(f"Successfully parsed {count} lines")
-        logger.info(f"Found {len(self.training)} training entries")
-        logger.info(f"Found {len(self.validation)} validation entries")
+        logger.info(f"Successfully parsed {self.parsed_lines_count} lines")
+        logger.info(f"Found {self.training_count} training entries")
+        logger.info(f"Found {self.validation_count} validation entries")
@@ -4,11 +4,12 @@ import sys
 from abc import ABC
 from collections import defaultdict
 from pathlib import Path
-from typing import Sequence
+from typing import Sequence, TextIO
 
 import wandb
 import yaml
 
+from translations_parser import columnar
 from translations_parser.data import Metric, TrainingEpoch, ValidationEpoch
 from translations_parser.utils import parse_task_label, parse_gcp_metric, patch_model_name
 
@@ -46,6 +47,11 @@ class Publisher(ABC):
 
 
 class CSVExport(Publisher):
+    """
+    Export training and validation entries to CSV files. Rows are written as the entries are
+    parsed, so the export works with the streaming mode of the parser.
+    """
+
     def __init__(self, output_dir: Path) -> None:
         from translations_parser.parser import TrainingParser
 
@@ -53,35 +59,75 @@ class CSVExport(Publisher):
             raise ValueError("Output must be a valid directory for the CSV export")
         self.output_dir = output_dir
         self.parser: TrainingParser | None = None
+        self.files: list[TextIO] = []
+        self.writers: dict[type, csv.DictWriter] = {}
+        self.counts: dict[type, int] = defaultdict(int)
 
     def open(self, parser=None) -> None:
         self.parser = parser
-
-    def write_data(
-        self, output: Path, entries: Sequence[TrainingEpoch | ValidationEpoch], dataclass: type
-    ) -> None:
-        if not entries:
-            logger.warning(f"No {dataclass.__name__} entry, skipping.")
-        with open(output, "w") as f:
-            writer = csv.DictWriter(f, fieldnames=dataclass.__annotations__)
+        for name, dataclass in (("training", TrainingEpoch), ("validation", ValidationEpoch)):
+            output = self.output_dir / f"{name}.csv"
+            if output.exists():
+                logger.warning(f"{name.capitalize()} output file {output} exists, skipping.")
+                continue
+            file = open(output, "w")
+            self.files.append(file)
+            writer = csv.DictWriter(file, fieldnames=dataclass.__annotations__)
             writer.writeheader()
-            for entry in entries:
-                writer.writerow(vars(entry))
+            self.writers[dataclass] = writer
 
-    def publish(self) -> None:
-        assert self.parser is not None, "Parser must be set to run CSV publication."
-        training_log = self.parser.output
-        training_output = self.output_dir / "training.csv"
-        if training_output.exists():
-            logger.warning(f"Training output file {training_output} exists, skipping.")
-        else:
-            self.write_data(training_output, training_log.training, TrainingEpoch)
+    def write_entry(self, entry: TrainingEpoch | ValidationEpoch) -> None:
+        dataclass = type(entry)
+        self.counts[dataclass] += 1
+        if writer := self.writers.get(dataclass):
+            writer.writerow(vars(entry))
 
-        validation_output = self.output_dir / "validation.csv"
-        if validation_output.exists():
-            logger.warning(f"Validation output file {validation_output} exists, skipping.")
-        else:
-            self.write_data(validation_output, training_log.validation, ValidationEpoch)
+    def handle_training(self, training: TrainingEpoch) -> None:
+        self.write_entry(training)
+
+    def handle_validation(self, validation: ValidationEpoch) -> None:
+        self.write_entry(validation)
+
+    def close(self) -> None:
+        for dataclass in self.writers:
+            if not self.counts[dataclass]:
+                logger.warning(f"No {dataclass.__name__} entry, skipping.")
+        for file in self.files:
+            file.close()
+        self.files = []
+        self.writers = {}
+
+
+class ColumnarExport(Publisher):
+    """
+    Export the training and validation entries and the evaluation metrics of a run to a
+    compact columnar file, that can be loaded across runs with `columnar.load_table`.
+    The file is written once the parser is done.
+    """
+
+    def __init__(self, output_dir: Path, *, project: str, group: str, run: str) -> None:
+        self.output_dir = output_dir
+        self.project = project
+        self.group = group
+        self.run = run
+        self.tables = {name: columnar.Table(name) for name in columnar.TABLES}
+
+    def handle_training(self, training: TrainingEpoch) -> None:
+        self.tables["training"].append(training)
+
+    def handle_validation(self, validation: ValidationEpoch) -> None:
+        self.tables["validation"].append(validation)
+
+    def handle_metrics(self, metrics: Sequence[Metric]) -> None:
+        for metric in metrics:
+            self.tables["metrics"].append(metric)
+
+    def close(self) -> None:
+        path = columnar.write_run(
+            self.output_dir, self.project, self.group, self.run, self.tables.values()
+        )
+        counts = ", ".join(f"{len(table)} {name}" for name, table in self.tables.items())
+        logger.info(f"Exported {counts} entries to {path}")
 
 
 class WandB(Publisher):
@@ -129,8 +175,8 @@ class WandB(Publisher):
         if self.parser is not None:
             # Store Marian logs as the main log artifact, instead of W&B client runtime.
             # This will be overwritten in case an unhandled exception occurs.
-            for line in self.parser.parsed_logs:
-                sys.stdout.write(f"{line}\n")
+            # In streaming mode, the full log is read back from the parser's temporary file.
+            self.parser.write_logs(sys.stdout)
 
         self.wandb.finish()
 
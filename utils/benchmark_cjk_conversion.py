@@ -0,0 +1,150 @@
+import argparse
+import logging
+import multiprocessing
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Callable, Optional
+
+import hanzidentifier
+
+from pipeline.common.downloads import read_lines, write_lines
+from pipeline.data.cjk import ChineseConverter, ChineseType
+
+"""
+Benchmark the conversion of a Chinese dataset to one script, comparing the conversion of each
+line on its own to the conversion of chunks of lines, in this process and in a pool.
+
+Without a --corpus, a corpus is synthesized by repeating the Chinese side of the recorded
+TED talks sample, which mixes Traditional and Simplified Chinese.
+
+python utils/benchmark_cjk_conversion.py --corpus data/corpus.zh.zst --processes 16
+"""
+
+ROOT_DIR = Path(__file__).parent.parent
+SAMPLE_ZIP = ROOT_DIR / "tests/data/corpus_samples/en-zh.txt.zip"
+SAMPLE_NAME = "NeuLab-TedTalks.en-zh.zh"
+
+
+def synthesize_corpus(path: Path, lines_count: int) -> None:
+    with zipfile.ZipFile(SAMPLE_ZIP) as archive:
+        sample = archive.read(SAMPLE_NAME).decode("utf-8").splitlines(keepends=True)
+
+    with path.open("w", encoding="utf-8") as file:
+        written = 0
+        while written < lines_count:
+            file.writelines(sample[: lines_count - written])
+            written += len(sample[: lines_count - written])
+
+
+def identify(text: str) -> ChineseType:
+    """
+    The detection of the script of a line with hanzidentifier, as it was done before the lookup
+    table.
+    """
+    result = hanzidentifier.identify(text)
+    if result == hanzidentifier.SIMPLIFIED:
+        return ChineseType.simplified
+    if result == hanzidentifier.TRADITIONAL:
+        return ChineseType.traditional
+    if result in (hanzidentifier.BOTH, hanzidentifier.MIXED):
+        return ChineseType.traditional | ChineseType.simplified
+    return ChineseType.none
+
+
+def convert_file_per_line(input_path: Path, output_path: Path, to: ChineseType) -> None:
+    """
+    The conversion of every line on its own, as it was done before the chunks.
+    """
+    converter = ChineseConverter()
+    with write_lines(output_path) as out_file, read_lines(input_path) as lines:
+        for line in lines:
+            if identify(line) in (ChineseType.none, to):
+                out_file.write(line)
+            else:
+                out_file.write(converter._convert_line(line, to))
+
+
+def benchmark(
+    name: str,
+    convert: Callable[[Path, Path, ChineseType], object],
+    path: Path,
+    output_dir: Path,
+    lines_count: int,
+) -> Path:
+    output_path = output_dir / f"{name.replace(',', '').replace(' ', '_').lower()}.zh.txt"
+    start = time.perf_counter()
+    convert(path, output_path, ChineseType.simplified)
+    seconds = max(time.perf_counter() - start, 1e-9)
+    print(f"{name:<24} {seconds:.2f}s ({lines_count / seconds:,.0f} lines/s)")
+    return output_path
+
+
+def main(args: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--corpus",
+        type=Path,
+        default=None,
+        help="A Chinese corpus to convert to Simplified Chinese. Defaults to a synthesized one.",
+    )
+    parser.add_argument(
+        "--lines",
+        type=int,
+        default=2_000_000,
+        help="The number of lines of the synthesized corpus.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="The number of processes of the pool.",
+    )
+    parsed_args = parser.parse_args(args)
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = parsed_args.corpus
+        if not path:
+            path = Path(tmp_dir) / "corpus.zh.txt"
+            print(f"Synthesizing a corpus of {parsed_args.lines:,} lines")
+            synthesize_corpus(path, parsed_args.lines)
+
+        with read_lines(path) as lines:
+            lines_count = sum(1 for _ in lines)
+        print(f"Corpus: {path} ({lines_count:,} lines)")
+
+        output_dir = Path(tmp_dir)
+        per_line = benchmark(
+            "Per line",
+            convert_file_per_line,
+            path,
+            output_dir,
+            lines_count,
+        )
+        chunks = benchmark(
+            "Chunks",
+            ChineseConverter(processes=0).convert_file,
+            path,
+            output_dir,
+            lines_count,
+        )
+        pool = benchmark(
+            f"Chunks, {parsed_args.processes} processes",
+            ChineseConverter(processes=parsed_args.processes).convert_file,
+            path,
+            output_dir,
+            lines_count,
+        )
+        same = per_line.read_bytes() == chunks.read_bytes() == pool.read_bytes()
+        print(f"Identical outputs: {same}")
+
+
+if __name__ == "__main__":
+    main()
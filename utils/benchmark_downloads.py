@@ -0,0 +1,169 @@
+import argparse
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+from typing import Callable, Optional
+
+from pipeline.common import downloads
+from pipeline.common.downloads import DownloadChunkStreamer, stream_download_to_file
+
+"""
+Benchmark the downloads from a local HTTP server, comparing the fixed 8 KiB chunks that were
+used before to the adaptive chunks, the reads of the chunk streamer as a file, and the
+downloads in ranges over several connections.
+
+The local server takes the network out of the measurement, so this measures the overhead of
+the download code itself.
+
+python utils/benchmark_downloads.py --megabytes 1000 --connections 8
+"""
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Serves the files of a directory, with the support of open and closed range requests."""
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+
+        size = os.path.getsize(path)
+        start, end = 0, size
+        range_header = self.headers.get("Range")
+        if range_header:
+            first, last = range_header.removeprefix("bytes=").split("-")
+            start, end = int(first), int(last) + 1 if last else size
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Last-Modified", self.date_time_string(int(os.path.getmtime(path))))
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        self.range_bytes = end - start
+
+        file = open(path, "rb")
+        file.seek(start)
+        return file
+
+    def copyfile(self, source, outputfile) -> None:
+        # Only copy the requested range.
+        remaining = self.range_bytes
+        while remaining > 0:
+            data = source.read(min(remaining, 1024 * 1024))
+            if not data:
+                break
+            outputfile.write(data)
+            remaining -= len(data)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def download_chunks(url: str, destination: Path) -> None:
+    with open(destination, "wb") as file, DownloadChunkStreamer(url) as chunk_streamer:
+        for chunk in chunk_streamer.download_chunks():
+            file.write(chunk)
+
+
+def download_reads(url: str, destination: Path) -> None:
+    with open(destination, "wb") as file, DownloadChunkStreamer(url) as chunk_streamer:
+        while data := chunk_streamer.read(64 * 1024):
+            file.write(data)
+
+
+def download_fixed_chunks(url: str, destination: Path) -> None:
+    """The chunks of 8 KiB, as they were downloaded before the chunks adapted their size."""
+    min_chunk_bytes, max_chunk_bytes = downloads.MIN_CHUNK_BYTES, downloads.MAX_CHUNK_BYTES
+    downloads.MIN_CHUNK_BYTES = downloads.MAX_CHUNK_BYTES = 8 * 1024
+    try:
+        download_chunks(url, destination)
+    finally:
+        downloads.MIN_CHUNK_BYTES, downloads.MAX_CHUNK_BYTES = min_chunk_bytes, max_chunk_bytes
+
+
+def benchmark(
+    name: str,
+    download: Callable[[str, Path], None],
+    url: str,
+    destination: Path,
+    expected: Path,
+) -> None:
+    destination.unlink(missing_ok=True)
+    start = time.perf_counter()
+    download(url, destination)
+    seconds = max(time.perf_counter() - start, 1e-9)
+    megabytes = destination.stat().st_size / 1_000_000
+    same = destination.read_bytes() == expected.read_bytes()
+    print(f"{name:<28} {seconds:.2f}s ({megabytes / seconds:,.0f} MB/s, identical: {same})")
+
+
+def main(args: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--megabytes",
+        type=int,
+        default=500,
+        help="The size of the file that is served.",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=4,
+        help="The number of connections of the downloads in ranges.",
+    )
+    parsed_args = parser.parse_args(args)
+
+    downloads.logger.setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        served_dir = Path(tmp_dir) / "served"
+        served_dir.mkdir()
+        served_path = served_dir / "file.bin"
+        print(f"Generating a file of {parsed_args.megabytes:,} MB")
+        rng = random.Random(0)
+        with served_path.open("wb") as file:
+            for _ in range(parsed_args.megabytes):
+                file.write(rng.randbytes(1_000_000))
+
+        handler = partial(RangeRequestHandler, directory=str(served_dir))
+        httpd = ThreadingHTTPServer(("localhost", 0), handler)
+        thread = Thread(target=httpd.serve_forever)
+        thread.start()
+        url = f"http://localhost:{httpd.server_address[1]}/file.bin"
+        destination = Path(tmp_dir) / "downloaded.bin"
+        try:
+            benchmark("Fixed 8 KiB chunks", download_fixed_chunks, url, destination, served_path)
+            benchmark("Adaptive chunks", download_chunks, url, destination, served_path)
+            benchmark("Reads of 64 KiB", download_reads, url, destination, served_path)
+            benchmark(
+                "To file, 1 connection", stream_download_to_file, url, destination, served_path
+            )
+            benchmark(
+                f"To file, {parsed_args.connections} connections",
+                partial(stream_download_to_file, connections=parsed_args.connections),
+                url,
+                destination,
+                served_path,
+            )
+        finally:
+            httpd.shutdown()
+            thread.join()
+            shutil.rmtree(served_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from pipeline.common.downloads import read_lines
+from pipeline.data.hplt import HPLTDocument, decode_document, decode_document_header
+
+"""
+Benchmark the decoding of the HPLT documents, comparing the decoding of every document with the
+json module to the fast path, which only decodes the documents that pass the score and the
+language filters.
+
+Without a --shard, the recorded sample shard is used, repeated to get a stable measurement.
+
+python utils/benchmark_hplt_decoding.py --shard data/hplt/eng_Latn_1.jsonl.zst --language eng_Latn
+"""
+
+ROOT_DIR = Path(__file__).parent.parent
+SAMPLE_SHARD = ROOT_DIR / "tests/data/corpus_samples/hplt-en_100.jsonl.zst"
+
+
+def decode_all(documents: list[str], min_doc_score: float, locale: str) -> int:
+    kept = 0
+    for document_json in documents:
+        document = HPLTDocument(**json.loads(document_json))
+        if document.doc_scores[0] >= min_doc_score and document.lang[0] == locale:
+            kept += 1
+    return kept
+
+
+def decode_kept(documents: list[str], min_doc_score: float, locale: str) -> int:
+    kept = 0
+    for document_json in documents:
+        header = decode_document_header(document_json)
+        if header is None:
+            document = decode_document(document_json)
+            header = document.doc_scores[0], document.lang[0]
+        if header[0] >= min_doc_score and header[1] == locale:
+            decode_document(document_json)
+            kept += 1
+    return kept
+
+
+def benchmark(
+    name: str,
+    decode: Callable[[list[str], float, str], int],
+    documents: list[str],
+    min_doc_score: float,
+    locale: str,
+) -> None:
+    start = time.perf_counter()
+    kept = decode(documents, min_doc_score, locale)
+    seconds = max(time.perf_counter() - start, 1e-9)
+    docs_per_second = len(documents) / seconds
+    print(f"{name:<24} {seconds:.2f}s ({docs_per_second:,.0f} docs/s, {kept:,} kept)")
+
+
+def main(args: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--shard",
+        type=str,
+        default=str(SAMPLE_SHARD),
+        help="A local path or URL to an HPLT shard. Defaults to the recorded sample shard.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=None,
+        help="How many times the documents of the shard are decoded. "
+        "Defaults to 200 for the sample shard, and 1 otherwise.",
+    )
+    parser.add_argument(
+        "--language",
+        type=str,
+        default="eng_Latn",
+        help="The HPLT locale of the documents to keep.",
+    )
+    parser.add_argument(
+        "--min_doc_score",
+        type=float,
+        default=5.0,
+        help="The minimum score of the documents to keep.",
+    )
+    parsed_args = parser.parse_args(args)
+
+    repeat = parsed_args.repeat
+    if repeat is None:
+        repeat = 200 if parsed_args.shard == str(SAMPLE_SHARD) else 1
+
+    with read_lines(parsed_args.shard) as lines:
+        documents = list(lines) * repeat
+
+    print(f"Shard:     {parsed_args.shard}")
+    print(f"Documents: {len(documents):,}")
+    benchmark(
+        "json.loads every doc",
+        decode_all,
+        documents,
+        parsed_args.min_doc_score,
+        parsed_args.language,
+    )
+    benchmark(
+        "Header, decode kept",
+        decode_kept,
+        documents,
+        parsed_args.min_doc_score,
+        parsed_args.language,
+    )
+
+
+if __name__ == "__main__":
+    main()
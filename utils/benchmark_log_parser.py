@@ -0,0 +1,130 @@
+import argparse
+import logging
+import os
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Iterator, Optional
+
+from translations_parser.parser import TrainingParser
+from translations_parser.publishers import Publisher
+
+"""
+Benchmark the Marian training log parser, comparing the time spent reading the log to the time
+spent parsing it.
+
+Without a --log, a multi-million line log is synthesized by repeating the training and validation
+entries of the recorded log in tests/data/taskcluster.log.
+
+python utils/benchmark_log_parser.py --log data/taskcluster-logs/train.log
+"""
+
+ROOT_DIR = Path(__file__).parent.parent
+RECORDED_LOG = ROOT_DIR / "tests/data/taskcluster.log"
+
+
+class CountingPublisher(Publisher):
+    """Count the published entries, so the benchmark doesn't measure a real publisher."""
+
+    def __init__(self) -> None:
+        self.training = 0
+        self.validation = 0
+
+    def handle_training(self, training) -> None:
+        self.training += 1
+
+    def handle_validation(self, validation) -> None:
+        self.validation += 1
+
+
+def synthesize_log(path: Path, lines_count: int) -> None:
+    """
+    Write a log with the header of the recorded log, followed by its training and validation
+    entries repeated until there are enough lines.
+    """
+    with RECORDED_LOG.open("r") as f:
+        recorded = f.readlines()
+    start = next(i for i, line in enumerate(recorded) if "Ep. 1 : Up. " in line)
+    header, body = recorded[:start], recorded[start:]
+
+    with path.open("w") as f:
+        f.writelines(header)
+        written = len(header)
+        while written < lines_count:
+            f.writelines(body)
+            written += len(body)
+
+
+def read_log(path: Path) -> Iterator[str]:
+    with path.open("r") as f:
+        for line in f:
+            yield line.strip()
+
+
+def benchmark(path: Path, streaming: bool) -> None:
+    start = time.perf_counter()
+    lines_count = sum(1 for _ in read_log(path))
+    read_seconds = time.perf_counter() - start
+
+    publisher = CountingPublisher()
+    parser = TrainingParser(
+        read_log(path), publishers=[publisher], skip_marian_context=True, streaming=streaming
+    )
+    # The parser echoes every line to stdout, which is discarded here.
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        parser.run()
+    total_seconds = time.perf_counter() - start
+    parse_seconds = max(total_seconds - read_seconds, 1e-9)
+
+    print(f"Log:        {path} ({lines_count:,} lines)")
+    print(f"Entries:    {publisher.training:,} training, {publisher.validation:,} validation")
+    print(
+        f"Read:       {read_seconds:.2f}s ({lines_count / max(read_seconds, 1e-9):,.0f} lines/s)"
+    )
+    print(f"Read+parse: {total_seconds:.2f}s ({lines_count / total_seconds:,.0f} lines/s)")
+    print(f"Parse only: {parse_seconds:.2f}s ({lines_count / parse_seconds:,.0f} lines/s)")
+
+
+def main(args: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--log",
+        type=Path,
+        default=None,
+        help="A recorded Marian train.log. Defaults to a synthesized log.",
+    )
+    parser.add_argument(
+        "--lines",
+        type=int,
+        default=2_000_000,
+        help="The number of lines of the synthesized log.",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Parse in the bounded memory streaming mode.",
+    )
+    parsed_args = parser.parse_args(args)
+
+    # The parser logs a summary at the end of the run, which isn't interesting here.
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if parsed_args.log:
+        benchmark(parsed_args.log, parsed_args.streaming)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "train.log"
+        print(f"Synthesizing a log of {parsed_args.lines:,} lines")
+        synthesize_log(path, parsed_args.lines)
+        benchmark(path, parsed_args.streaming)
+
+
+if __name__ == "__main__":
+    main()
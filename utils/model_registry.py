@@ -32,8 +32,11 @@ Features:
 - Fetches training runs and associated Taskcluster task groups.
 - Extracts corpora (aligned and non-aligned) and stores metadata.
 - Collects trained models and their evaluation metrics.
-- Generates structured JSON output for static site usage.
+- Generates structured JSON output for static site usage, and a compact index of
+  all of the training runs.
 - Supports caching of fetched data to optimize repeated runs.
+- Fans out the Taskcluster and GCS requests over a bounded pool of workers, with a
+  shared rate limit.
 
 Usage:
  - This can't be run with poetry due to requirement conflicts. First create a venv:
@@ -51,27 +54,39 @@ Usage:
  - Re-run with a cleared HTTP cache:
    python utils/model_registry.py -- --clear_cache
 
+ - Use more workers, with a higher request rate:
+   python utils/model_registry.py -- --workers 32 --max_requests_per_second 50
+
  - Completely rebuild everything
    python script.py -- --clear_cache --overwrite_runs
+
+ - Only rebuild the parts of the training runs whose tasks or evaluations changed:
+   python utils/model_registry.py -- --incremental
 """
 
 import argparse
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import asdict, dataclass, is_dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 import os
 from pathlib import Path
 import re
-from typing import Any, Callable, Iterable, Optional, Union
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Optional, Union
 
-# Poetry has some install issues with dependencies here:
-from google.cloud import storage  # type: ignore
 import requests
 import taskcluster
 import warnings
 import shelve
 from taskgraph.util.taskcluster import get_artifact, get_artifact_url
 
+if TYPE_CHECKING:
+    # Poetry has some install issues with dependencies here:
+    from google.cloud import storage  # type: ignore
+
 # This script is not integrated into a production environment, so suppress the auth warning.
 warnings.filterwarnings("ignore", category=UserWarning, module="google.auth._default")
 
@@ -82,26 +97,157 @@ MODEL_REGISTRY_DIR = ROOT_DIR / "data/model-registry"
 TRAINING_RUNS_DIR = MODEL_REGISTRY_DIR / "training-runs"
 CACHE_FILE = MODEL_REGISTRY_DIR / "cache.pickle"
 
+# New training runs and artifacts are regularly added to GCS.
+GCS_LISTING_TTL = timedelta(days=1)
+# Task groups that are still running change, but finished ones are only changed by re-runs.
+RUNNING_TASK_GROUP_TTL = timedelta(hours=1)
+RESOLVED_TASK_GROUP_TTL = timedelta(days=30)
+RESOLVED_STATES = {"completed", "failed", "exception"}
+
+# The parts of a TrainingRun, and the fields they are stored in. In incremental mode, a part
+# is only rebuilt when the digest of its inputs changed.
+TRAINING_RUN_PARTS = {
+    "models": [
+        "backwards",
+        "teacher_1",
+        "teacher_2",
+        "teacher_ensemble_flores",
+        "student",
+        "student_finetuned",
+        "student_quantized",
+        "student_exported",
+    ],
+    "corpora": [
+        "parallel_corpus_aligned",
+        "backtranslations_corpus_aligned",
+        "distillation_corpus_aligned",
+        "parallel_corpus",
+        "backtranslations_corpus",
+        "distillation_corpus",
+    ],
+    "flores_comparisons": ["comet_flores_comparison", "bleu_flores_comparison"],
+}
+# The labels of the tasks that the models and corpora are built from, including the renamed
+# tasks. See collect_models and collect_corpora.
+MODEL_TASKS_REGEX = re.compile(
+    r"^(train-|finetune-|distillation-student-model-|backtranslations-train-backwards-model-"
+    r"|quantize-|export-|evaluate-)"
+)
+CORPORA_TASKS_REGEX = re.compile(
+    r"^(corpus-align-|alignments-|merge-corpus-|corpus-merge-parallel-|collect-mono-"
+    r"|backtranslations-mono-trg-dechunk-translations-"
+    r"|distillation-mono-src-dechunk-translations-|distillation-corpus-final-filtering-)"
+)
+
+# The requests to Taskcluster and GCS are fanned out over a pool of workers.
+DEFAULT_WORKERS = 16
+DEFAULT_MAX_REQUESTS_PER_SECOND = 20.0
+
 MODEL_REGISTRY_DIR.mkdir(exist_ok=True)
 
 os.environ["TASKCLUSTER_ROOT_URL"] = "https://firefox-ci-tc.services.mozilla.com"
 
-client = storage.Client(project=PROJECT_NAME)
-bucket = client.get_bucket(BUCKET_NAME)
+_bucket: Optional["storage.Bucket"] = None
+_bucket_lock = threading.Lock()
+
+
+def get_bucket() -> "storage.Bucket":
+    """
+    The GCS client is only created on the first use, so that the module can be imported
+    without credentials, and a different bucket can be set in its place.
+    """
+    global _bucket
+    with _bucket_lock:
+        if _bucket is None:
+            # Poetry has some install issues with dependencies here:
+            from google.cloud import storage  # type: ignore
+
+            client = storage.Client(project=PROJECT_NAME)
+            _bucket = client.get_bucket(BUCKET_NAME)
+        return _bucket
+
+
+class RateLimiter:
+    """
+    Space out the requests made by all of the worker threads, so that fanning out the
+    requests doesn't overwhelm Taskcluster or GCS.
+    """
+
+    def __init__(self, max_requests_per_second: float) -> None:
+        self.interval = 0.0
+        self.lock = threading.Lock()
+        self.next_request = time.monotonic()
+        self.set_rate(max_requests_per_second)
+
+    def set_rate(self, max_requests_per_second: float) -> None:
+        self.interval = 1.0 / max_requests_per_second if max_requests_per_second > 0 else 0.0
+
+    def wait(self) -> None:
+        """Block until the next request is allowed."""
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_request - now
+            self.next_request = max(now, self.next_request) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+rate_limiter = RateLimiter(DEFAULT_MAX_REQUESTS_PER_SECOND)
+
+
+class ExpiringCache:
+    """
+    A thread safe wrapper around the shelve cache, where every entry carries an expiry time.
+    Entries from older versions of this script don't have an expiry, and are fetched again.
+    """
+
+    def __init__(self, shelf: shelve.Shelf) -> None:
+        self.shelf = shelf
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self.lock:
+            entry = self.shelf.get(key, None)
+        if not isinstance(entry, dict) or "expires" not in entry:
+            return None
+        if entry["expires"] < time.time():
+            return None
+        return entry["value"]
+
+    def set(self, key: str, value: Any, ttl: timedelta) -> None:
+        with self.lock:
+            self.shelf[key] = {"value": value, "expires": time.time() + ttl.total_seconds()}
+
+    def clear(self) -> None:
+        with self.lock:
+            self.shelf.clear()
 
+    def close(self) -> None:
+        with self.lock:
+            self.shelf.close()
 
-def get_gcs_subdirectories(prefix: str, cache: Optional[shelve.Shelf]) -> set[str]:
+
+def head(url: str) -> requests.Response:
+    """Get the headers of an artifact, following the redirects to the storage."""
+    rate_limiter.wait()
+    return requests.head(url, allow_redirects=True)
+
+
+def get_gcs_subdirectories(prefix: str, cache: Optional[ExpiringCache]) -> set[str]:
     """
     Get the subdirectories of the a given prefix for a Google Cloud Storage bucket.
     """
     cache_key = f"get_subdirectories-{BUCKET_NAME}-{prefix}"
     if cache is not None:
-        data = cache.get(cache_key, None)
+        data = cache.get(cache_key)
         if data:
             return data
 
     print(f"Listing {BUCKET_NAME}/{prefix}")
-    blobs = bucket.list_blobs(
+    rate_limiter.wait()
+    blobs = get_bucket().list_blobs(
         prefix=prefix,
         # Specify a delimiter to only return the objects in the directory
         delimiter="/",
@@ -113,7 +259,7 @@ def get_gcs_subdirectories(prefix: str, cache: Optional[shelve.Shelf]) -> set[st
         prefixes.update(page.prefixes)
 
     if cache is not None:
-        cache[cache_key] = prefixes
+        cache.set(cache_key, prefixes, GCS_LISTING_TTL)
 
     return prefixes
 
@@ -175,8 +321,8 @@ class Corpus:
             f"public/build/corpus.{training_run.target_lang}.zst",
         )
 
-        source_head = requests.head(source_url, allow_redirects=True)
-        target_head = requests.head(target_url, allow_redirects=True)
+        source_head = head(source_url)
+        target_head = head(target_url)
 
         if not source_head.ok or not target_head.ok:
             print("  [corpus] corpus missing")
@@ -230,8 +376,8 @@ class Corpus:
             f"public/build/mono.{training_run.target_lang}.zst",
         )
 
-        source_head = requests.head(source_url, allow_redirects=True)
-        target_head = requests.head(target_url, allow_redirects=True)
+        source_head = head(source_url)
+        target_head = head(target_url)
 
         if not source_head.ok or not target_head.ok:
             print("  [corpus] corpus missing")
@@ -299,9 +445,9 @@ class WordAlignedCorpus:
             f"public/build/corpus.tok-icu.{training_run.target_lang}.zst",
         )
 
-        alignments_head = requests.head(alignments_url, allow_redirects=True)
-        source_head = requests.head(source_url, allow_redirects=True)
-        target_head = requests.head(target_url, allow_redirects=True)
+        alignments_head = head(alignments_url)
+        source_head = head(source_url)
+        target_head = head(target_url)
 
         if not alignments_head.ok or not source_head.ok or not target_head.ok:
             print("  [word-aligned-corpus] could not find the files from task")
@@ -351,8 +497,9 @@ class Model:
         If no live log was synced, do it now.
         """
         tasks_gcs_path = f"models/{training_run.langpair}/{training_run.name}_{self.task_group_id}/{gcs_model_name}/live.log"
-        live_log_blob = bucket.blob(tasks_gcs_path)
+        live_log_blob = get_bucket().blob(tasks_gcs_path)
 
+        rate_limiter.wait()
         if live_log_blob.exists():
             return
 
@@ -411,6 +558,10 @@ class TrainingRun:
     student_quantized: Optional[Model]
     student_exported: Optional[Model]
 
+    # The digests of the inputs of the training run and its parts, e.g.
+    # { "tasks": "3f1c...", "models": "8ab0...", "corpora": "...", "flores_comparisons": "..." }
+    input_digests: dict[str, str]
+
     @staticmethod
     def create(name: str, task_group_ids: list[str], langpair):
         source_lang, target_lang = langpair.split("-")
@@ -440,6 +591,7 @@ class TrainingRun:
             student_finetuned=None,
             student_quantized=None,
             student_exported=None,
+            input_digests={},
         )
 
     def get_json_cache_path(self) -> Path:
@@ -474,7 +626,8 @@ class JsonEncoder(json.JSONEncoder):
 
 
 def get_training_runs_by_langpair(
-    cache: Optional[shelve.Shelf],
+    cache: Optional[ExpiringCache],
+    executor: ThreadPoolExecutor,
 ) -> dict[str, list[TrainingRun]]:
     """
     Training runs are stored in the following structure. Extract out the information into
@@ -496,12 +649,17 @@ def get_training_runs_by_langpair(
     runs_by_langpair: dict[str, list[TrainingRun]] = {}
     training_runs_by_name: dict[str, TrainingRun] = {}
 
-    for langpair in langpairs:
+    # List the language pairs concurrently.
+    task_group_prefixes_by_langpair = executor.map(
+        lambda langpair: get_gcs_subdirectories(f"models/{langpair}/", cache), langpairs
+    )
+
+    for langpair, task_group_prefixes in zip(langpairs, task_group_prefixes_by_langpair):
         training_runs: list[TrainingRun] = []
         runs_by_langpair[langpair] = training_runs
 
         # e.g { "models/en-lv/spring-2024_J3av8ewURni5QQqP2u3QRg/", ... }
-        for task_group_prefix in get_gcs_subdirectories(f"models/{langpair}/", cache):
+        for task_group_prefix in task_group_prefixes:
             # e.g. "spring-2024_J3av8ewURni5QQqP2u3QRg"
             name_task_group_tuple = task_group_prefix.split("/")[2]
 
@@ -570,31 +728,121 @@ EvaluationJson = dict[str, dict[str, dict[str, float]]]
 Task = dict[str, dict]
 
 
-def iterate_training_runs(
-    runs_by_training_pair: dict[str, list[TrainingRun]],
+def collect_tasks_for_training_runs(
+    training_runs: list[TrainingRun],
     upload: bool,
-    cache: Optional[shelve.Shelf],
-):
+    cache: Optional[ExpiringCache],
+    executor: ThreadPoolExecutor,
+) -> list[list[Task]]:
     """
-    Reduce the complexity required for iterating over the training runs and their tasks.
+    Get the tasks of every training run, fanning out over all of the task groups of all of
+    the training runs at once.
     """
-    for training_runs in runs_by_training_pair.values():
-        for training_run in training_runs:
-            yield training_run, get_tasks_in_all_runs(training_run, upload, cache)
+    queue = taskcluster.Queue(options={"rootUrl": "https://firefox-ci-tc.services.mozilla.com"})
+    futures_by_run = [
+        [
+            executor.submit(
+                get_tasks_in_task_group, training_run, task_group_id, upload, cache, queue
+            )
+            for task_group_id in training_run.task_group_ids
+        ]
+        for training_run in training_runs
+    ]
+
+    tasks_by_run: list[list[Task]] = []
+    for training_run, futures in zip(training_runs, futures_by_run):
+        tasks_in_all_runs: list[Task] = []
+        for future in futures:
+            tasks_in_all_runs.extend(future.result())
+
+        for task in tasks_in_all_runs:
+            date = str_to_datetime(task["task"]["created"])
+            if training_run.date_started is None or date < training_run.date_started:
+                training_run.date_started = date
+
+        tasks_by_run.append(tasks_in_all_runs)
+    return tasks_by_run
+
+
+def get_tasks_digest(tasks: list[Task]) -> str:
+    """
+    Digest the task ids, states and resolved times, which change when a task is re-run.
+    """
+    digest = hashlib.sha256()
+    for task in sorted(tasks, key=lambda task: task["status"]["taskId"]):
+        status = task["status"]
+        resolved = status["runs"][-1].get("resolved") if status["runs"] else None
+        digest.update(f"{status['taskId']} {status['state']} {resolved}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_input_digests(
+    training_run: TrainingRun,
+    tasks: list[Task],
+    comet_results_by_langpair: EvaluationJson,
+    bleu_results_by_langpair: EvaluationJson,
+) -> dict[str, str]:
+    """
+    Compute the digest of the inputs of each part of the training run.
+    """
+    flores_comparisons = {
+        "comet": comet_results_by_langpair.get(training_run.langpair),
+        "bleu": bleu_results_by_langpair.get(training_run.langpair),
+    }
+    return {
+        "tasks": get_tasks_digest(tasks),
+        "models": get_tasks_digest(
+            [task for task in tasks if MODEL_TASKS_REGEX.match(task_name(task))]
+        ),
+        "corpora": get_tasks_digest(
+            [task for task in tasks if CORPORA_TASKS_REGEX.match(task_name(task))]
+        ),
+        "flores_comparisons": hashlib.sha256(
+            json.dumps(flores_comparisons, sort_keys=True).encode("utf-8")
+        ).hexdigest(),
+    }
+
+
+def load_training_run_json(training_run: TrainingRun, upload: bool) -> Optional[dict]:
+    """
+    Load the JSON of a training run that was already built, from the local cache or GCS.
+    """
+    if not upload and training_run.get_json_cache_path().exists():
+        with training_run.get_json_cache_path().open() as file:
+            return json.load(file)
+
+    blob = get_bucket().blob(training_run.get_json_gcs_path())
+    rate_limiter.wait()
+    if not blob.exists():
+        return None
+
+    json_text = blob.download_as_text()
+    if not upload:
+        print("Downloading from GCS", training_run.name, training_run.langpair)
+        with training_run.get_json_cache_path().open("w") as file:
+            file.write(json_text)
+    return json.loads(json_text)
 
 
 def build_json_for_training_runs(
     runs_by_training_pair: dict[str, list[TrainingRun]],
     overwrite_runs: bool,
+    incremental: bool,
     upload: bool,
-    cache: Optional[shelve.Shelf],
-):
+    cache: Optional[ExpiringCache],
+    executor: ThreadPoolExecutor,
+) -> list[dict]:
     """
     Each training run gets saved as a unique tuple of the run's name and its language
     pair. This gets saved statically as JSON so that it can be displayed in a model
-    registry.
+    registry. The training runs are processed concurrently.
 
     site/model-registry/training-runs/{name}-{langpair}.json
+
+    In incremental mode, the training runs that were already built are only rebuilt when
+    the digest of their inputs changed, and only the parts whose inputs changed are rebuilt.
+
+    Returns the JSON of every training run.
     """
 
     # Find if there are any evaluations.
@@ -606,116 +854,155 @@ def build_json_for_training_runs(
     )
     # chrF is not computed in the evaluation at this time.
 
-    for training_run, tasks in iterate_training_runs(runs_by_training_pair, upload, cache):
-        blob = bucket.blob(training_run.get_json_gcs_path())
+    training_runs = [
+        training_run
+        for training_runs in runs_by_training_pair.values()
+        for training_run in training_runs
+    ]
+    tasks_by_run = collect_tasks_for_training_runs(training_runs, upload, cache, executor)
 
+    def build_json(training_run: TrainingRun, tasks: list[Task]) -> dict:
+        previous_json = None
         if not overwrite_runs:
-            if upload:
-                if blob.exists():
-                    print("Already uploaded", training_run.name, training_run.langpair)
-                    continue
-            else:
-                if training_run.get_json_cache_path().exists():
-                    print("Already created", training_run.name, training_run.langpair)
-                    continue
-                if blob.exists():
-                    blob.download_to_filename(training_run.get_json_cache_path())
-                    print("Downloading from GCS", training_run.name, training_run.langpair)
-                    continue
-
-        print("Processing", training_run.name, training_run.langpair)
-        collect_models(tasks, training_run, upload)
-        collect_flores_comparisons(
-            training_run, comet_results_by_langpair, bleu_results_by_langpair
-        )
-        collect_corpora(training_run, tasks)
+            previous_json = load_training_run_json(training_run, upload)
+            if previous_json is not None and not incremental:
+                print("Already built", training_run.name, training_run.langpair)
+                return previous_json
 
-        json_text = json.dumps(training_run, cls=JsonEncoder, indent=2)
+        input_digests = get_input_digests(
+            training_run, tasks, comet_results_by_langpair, bleu_results_by_langpair
+        )
+        previous_digests = previous_json.get("input_digests", {}) if previous_json else {}
+        if previous_json is not None and previous_digests == input_digests:
+            print("Unchanged", training_run.name, training_run.langpair)
+            return previous_json
+
+        changed_parts = {
+            part
+            for part in TRAINING_RUN_PARTS
+            if previous_json is None or previous_digests.get(part) != input_digests[part]
+        }
+        print(
+            "Processing",
+            training_run.name,
+            training_run.langpair,
+            f"({', '.join(sorted(changed_parts)) or 'tasks'})",
+        )
+        if "models" in changed_parts:
+            collect_models(tasks, training_run, upload)
+        if "flores_comparisons" in changed_parts:
+            collect_flores_comparisons(
+                training_run, comet_results_by_langpair, bleu_results_by_langpair
+            )
+        if "corpora" in changed_parts:
+            collect_corpora(training_run, tasks)
+        training_run.input_digests = input_digests
+
+        run_json = json.loads(json.dumps(training_run, cls=JsonEncoder))
+        # Keep the parts that didn't change from the previous build.
+        for part, fields in TRAINING_RUN_PARTS.items():
+            if part not in changed_parts:
+                for field in fields:
+                    run_json[field] = previous_json[field]  # type: ignore[index]
+
+        json_text = json.dumps(run_json, indent=2)
         if upload:
-            blob.upload_from_string(json_text)
+            get_bucket().blob(training_run.get_json_gcs_path()).upload_from_string(json_text)
         else:
-            with training_run.get_json_cache_path().open() as file:
+            with training_run.get_json_cache_path().open("w") as file:
                 file.write(json_text)
+        print("Finished", training_run.name, training_run.langpair)
+        return run_json
+
+    TRAINING_RUNS_DIR.mkdir(exist_ok=True)
+    return list(executor.map(build_json, training_runs, tasks_by_run))
 
 
-def get_tasks_in_all_runs(
-    training_run: TrainingRun, upload: bool, cache: Optional[shelve.Shelf]
+def get_tasks_in_task_group(
+    training_run: TrainingRun,
+    task_group_id: str,
+    upload: bool,
+    cache: Optional[ExpiringCache],
+    queue: taskcluster.Queue,
 ) -> list[Task]:
     """
-    Get a flat list of the tasks in every TaskGroup of the training run. These are
-    tasks are arbitrarily sorted. If picking a task from it use find_latest_task and
-    find_earliest_task.
+    Get the tasks of a TaskGroup of the training run. These are tasks are arbitrarily
+    sorted. If picking a task from it use find_latest_task and find_earliest_task.
 
     Note that the tasks will be pulled from GCS first, and TaskCluster second. If the
     --upload parameter is set, the tasks will be saved to GCS storage if they are not
     present.
     """
-    queue = taskcluster.Queue(options={"rootUrl": "https://firefox-ci-tc.services.mozilla.com"})
-
-    tasks_in_all_runs: list[Task] = []
-    for task_group_id in training_run.task_group_ids:
-        cache_key = f"list_task_group-{task_group_id}"
-        tasks = None
-        prefix = "Fetched"
-        # e.g.
-        # "models/en-sk/spring-2024_MRw1u6KIRgO056Isf0GKpA/tasks.json"
-        tasks_gcs_path = (
-            f"models/{training_run.langpair}/{training_run.name}_{task_group_id}/tasks.json"
-        )
-        tasks_blob = bucket.blob(tasks_gcs_path)
+    cache_key = f"list_task_group-{task_group_id}"
+    tasks = None
+    prefix = "Fetched"
+    # e.g.
+    # "models/en-sk/spring-2024_MRw1u6KIRgO056Isf0GKpA/tasks.json"
+    tasks_gcs_path = (
+        f"models/{training_run.langpair}/{training_run.name}_{task_group_id}/tasks.json"
+    )
+    tasks_blob = get_bucket().blob(tasks_gcs_path)
 
-        if cache is not None:
-            tasks = cache.get(cache_key, None)
-            if tasks is not None:
-                prefix = "Using cached"
-                if upload and not tasks_blob.exists():
+    if cache is not None:
+        tasks = cache.get(cache_key)
+        if tasks is not None:
+            prefix = "Using cached"
+            if upload:
+                rate_limiter.wait()
+                if not tasks_blob.exists():
                     print("Uploading tasks (from cache) to GCS:", tasks_gcs_path)
                     tasks_blob.upload_from_string(json.dumps(tasks, indent=2))
 
-        if tasks is None:
-            tasks = []
-            if tasks_blob.exists():
-                print(f"Downloading tasks: {tasks_gcs_path}")
-                tasks = json.loads(tasks_blob.download_as_string())
-                assert isinstance(tasks, list), "Expected the tasks to be a list"
-            else:
-                try:
-                    list_task_group: Any = queue.listTaskGroup(task_group_id)
+    if tasks is None:
+        tasks = []
+        rate_limiter.wait()
+        if tasks_blob.exists():
+            print(f"Downloading tasks: {tasks_gcs_path}")
+            tasks = json.loads(tasks_blob.download_as_string())
+            assert isinstance(tasks, list), "Expected the tasks to be a list"
+        else:
+            try:
+                rate_limiter.wait()
+                list_task_group: Any = queue.listTaskGroup(task_group_id)
+                tasks.extend(list_task_group["tasks"])
+
+                # Do a bounded lookup of more tasks. 10 should be a reasonable limit.
+                for _ in range(10):
+                    if not list_task_group.get("continuationToken", None):
+                        break
+                    rate_limiter.wait()
+                    list_task_group: Any = queue.listTaskGroup(
+                        task_group_id,
+                        continuationToken=list_task_group["continuationToken"],
+                    )
                     tasks.extend(list_task_group["tasks"])
+            except taskcluster.exceptions.TaskclusterRestFailure as error:
+                # 404 errors indicate expired task groups.
+                if error.status_code == 404:
+                    print("Task group expired:", task_group_id)
+                else:
+                    raise error
 
-                    # Do a bounded lookup of more tasks. 10 should be a reasonable limit.
-                    for _ in range(10):
-                        if not list_task_group.get("continuationToken", None):
-                            break
-                        list_task_group: Any = queue.listTaskGroup(
-                            task_group_id,
-                            continuationToken=list_task_group["continuationToken"],
-                        )
-                        tasks.extend(list_task_group["tasks"])
-                except taskcluster.exceptions.TaskclusterRestFailure as error:
-                    # 404 errors indicate expired task groups.
-                    if error.status_code == 404:
-                        print("Task group expired:", task_group_id)
-                    else:
-                        raise error
-
-                if upload:
-                    print("Uploading tasks to GCS:", tasks_gcs_path)
-                    tasks_blob.upload_from_string(json.dumps(tasks, indent=2))
+            if upload:
+                print("Uploading tasks to GCS:", tasks_gcs_path)
+                tasks_blob.upload_from_string(json.dumps(tasks, indent=2))
 
-        if cache is not None:
-            cache[cache_key] = tasks
+    if cache is not None:
+        cache.set(cache_key, tasks, get_task_group_ttl(tasks))
 
-        tasks_in_all_runs.extend(tasks)
+    print(f"{prefix} {len(tasks)} tasks from {task_group_id}")
+    return tasks
 
-        print(f"{prefix} {len(tasks)} tasks from {task_group_id}")
-        for task in tasks:
-            date = str_to_datetime(task["task"]["created"])
 
-            if training_run.date_started is None or date < training_run.date_started:
-                training_run.date_started = date
-
-    return tasks_in_all_runs
+def get_task_group_ttl(tasks: list[Task]) -> timedelta:
+    """
+    The tasks of a task group that is still running will change, so they need to be
+    fetched again sooner.
+    """
+    for task in tasks:
+        if task["status"]["state"] not in RESOLVED_STATES:
+            return RUNNING_TASK_GROUP_TTL
+    return RESOLVED_TASK_GROUP_TTL
 
 
 def collect_flores_comparisons(
@@ -960,7 +1247,8 @@ def get_model(
 
     # List all of the artifacts.
     print(f"  [model] listing {tc_model_name} files - {model.artifact_folder}")
-    blobs: Optional[Iterable[storage.Blob]] = bucket.list_blobs(prefix=prefix)
+    rate_limiter.wait()
+    blobs: Optional[Iterable["storage.Blob"]] = get_bucket().list_blobs(prefix=prefix)
     if blobs:
         model.artifact_urls = [
             f"https://storage.googleapis.com/{BUCKET_NAME}/{blob.name}" for blob in blobs
@@ -997,7 +1285,8 @@ def get_model_without_evals(
 
     # List all of the artifacts.
     print(f"  [model] listing {model_name} files - {model.artifact_folder}")
-    blobs: Optional[Iterable[storage.Blob]] = bucket.list_blobs(prefix=prefix)
+    rate_limiter.wait()
+    blobs: Optional[Iterable["storage.Blob"]] = get_bucket().list_blobs(prefix=prefix)
     if blobs:
         model.artifact_urls = [
             f"https://storage.googleapis.com/{BUCKET_NAME}/{blob.name}" for blob in blobs
@@ -1025,7 +1314,7 @@ def get_flores_eval_blob(
     task_group_id: str,
     gcs_eval_name: str,
     tc_model_name: str,
-) -> Optional[storage.Blob]:
+) -> Optional["storage.Blob"]:
     """
     Attempt to look up the flores eval blob from GCS.
     """
@@ -1035,7 +1324,8 @@ def get_flores_eval_blob(
         f"evaluation/{gcs_eval_name}/"
         f"{tc_model_name}-flores-devtest-{training_run.source_lang}_devtest.metrics.json"
     )
-    blob = bucket.get_blob(blob_url)
+    rate_limiter.wait()
+    blob = get_bucket().get_blob(blob_url)
     if not blob:
         # Also check with the langpair.
         blob_url = (
@@ -1043,7 +1333,8 @@ def get_flores_eval_blob(
             f"evaluation/{gcs_eval_name}/"
             f"{tc_model_name}-flores-devtest-{training_run.langpair}_devtest.metrics.json"
         )
-        blob = bucket.get_blob(blob_url)
+        rate_limiter.wait()
+        blob = get_bucket().get_blob(blob_url)
 
     return blob
 
@@ -1062,6 +1353,7 @@ def get_config(action_task_id: dict) -> Optional[dict]:
     """
     Get a config from the action's task id.
     """
+    rate_limiter.wait()
     try:
         return get_artifact(action_task_id, "public/parameters.yml")["training_config"]
     except Exception:
@@ -1155,10 +1447,43 @@ def save_training_run_listing(runs_by_training_pair: dict[str, list[TrainingRun]
 
     listing_path = "models/listing.json"
     print(f"Uploading gs://{BUCKET_NAME}/{listing_path}")
-    listing_blob = bucket.blob(listing_path)
+    listing_blob = get_bucket().blob(listing_path)
     listing_blob.upload_from_string(json.dumps(listing, indent=2))
 
 
+def save_training_run_index(run_jsons: list[dict], upload: bool) -> None:
+    """
+    Create a compact index of all the training runs, so that the static site can build its
+    table from a single file instead of fetching every training run JSON. The model configs
+    are the bulk of the training runs, and are only shown on demand, so they are left out
+    and fetched from the full training run JSON referenced by "json".
+
+    Saved to:
+      - data/model-registry/index.json
+      - gs://{BUCKET}/models/index.json (with --upload)
+    """
+    index = []
+    for run_json in run_jsons:
+        entry = {key: value for key, value in run_json.items() if key != "input_digests"}
+        entry["json"] = f"models/{run_json['langpair']}/{run_json['name']}.json"
+        for field in TRAINING_RUN_PARTS["models"]:
+            model = entry.get(field)
+            if isinstance(model, dict):
+                entry[field] = {key: value for key, value in model.items() if key != "config"}
+        index.append(entry)
+    index.sort(key=lambda entry: (entry["langpair"], entry["name"]))
+
+    index_text = json.dumps(index, separators=(",", ":"))
+    index_path = MODEL_REGISTRY_DIR / "index.json"
+    print(f"Writing {index_path}")
+    index_path.write_text(index_text)
+
+    if upload:
+        index_gcs_path = "models/index.json"
+        print(f"Uploading gs://{BUCKET_NAME}/{index_gcs_path}")
+        get_bucket().blob(index_gcs_path).upload_from_string(index_text)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description=__doc__,
@@ -1179,30 +1504,61 @@ def main():
         action="store_true",
         help="By default only missing training runs are created. This recreates everything.",
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Rebuild the existing training runs whose tasks or evaluations changed. Only the "
+        "changed parts (models, corpora, flores comparisons) are rebuilt.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="The number of concurrent requests to Taskcluster and GCS.",
+    )
+    parser.add_argument(
+        "--max_requests_per_second",
+        type=float,
+        default=DEFAULT_MAX_REQUESTS_PER_SECOND,
+        help="The rate limit shared by all of the workers, 0 disables it.",
+    )
     args = parser.parse_args()
 
+    rate_limiter.set_rate(args.max_requests_per_second)
+
     cache = None
     if not args.no_cache:
         print(f"Using the cache {CACHE_FILE}")
-        cache = shelve.open(str(CACHE_FILE))
+        cache = ExpiringCache(shelve.open(str(CACHE_FILE)))
 
     if args.clear_cache:
         print(f"Clearing the cache {CACHE_FILE}")
         if cache is None:
-            cache = shelve.open(str(CACHE_FILE))
-            cache.clear()
-            cache.close()
-            cache = None
+            with shelve.open(str(CACHE_FILE)) as shelf:
+                shelf.clear()
         else:
             cache.clear()
 
-    runs_by_training_pair = get_training_runs_by_langpair(cache)
-    print_training_runs_tree(runs_by_training_pair)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        runs_by_training_pair = get_training_runs_by_langpair(cache, executor)
+        print_training_runs_tree(runs_by_training_pair)
+
+        # Saves out the training runs depending on the --upload argument:
+        #   - data/model-registry/training-runs/{name}-{langpair}.json
+        #   - gs://{BUCKET}/models/{langpair}/{name}.json
+        run_jsons = build_json_for_training_runs(
+            runs_by_training_pair,
+            args.overwrite_runs,
+            args.incremental,
+            args.upload,
+            cache,
+            executor,
+        )
 
-    # Saves out the training runs depending on the --upload argument:
-    #   - data/model-registry/training-runs/{name}-{langpair}.json
-    #   - gs://{BUCKET}/models/{langpair}/{name}.json
-    build_json_for_training_runs(runs_by_training_pair, args.overwrite_runs, args.upload, cache)
+    # Saves a compact index of the training runs:
+    #   - data/model-registry/index.json
+    #   - gs://{BUCKET}/models/index.json
+    save_training_run_index(run_jsons, args.upload)
 
     # Saves a reference of all the listings:
     #   - gs://{BUCKET}/models/listing.json